@@ -1,18 +1,429 @@
+import os
+import errno
 import filecmp
+import threading
+from collections import OrderedDict, deque
+from contextlib import ExitStack, nullcontext
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from io import FileIO
+from typing import Callable, Iterable, Iterator, Sequence, ContextManager, IO
 
 from .types import FsPath
+from .io_policy import IoPolicy
+from .known_digests import KnownDigests
+
+
+ComparePair = tuple[FsPath, FsPath]
+CompareResult = tuple[FsPath, FsPath, bool]
+
+
+def compare_concurrently(
+        compare: Callable[[FsPath, FsPath], bool], pairs: Iterable[ComparePair], *, max_workers: int, ordered: bool) -> Iterator[CompareResult]:
+    """Call 'compare' for each pair on a thread pool with 'max_workers' threads, and yield (fsp1, fsp2, result).
+
+    At most 2 * 'max_workers' comparisons are queued, so 'pairs' may be a long running generator.
+    Results are yielded in the order of 'pairs' if 'ordered' is true, otherwise as they complete.
+    """
+
+    def compare_pair(pair: ComparePair) -> CompareResult:
+        return pair[0], pair[1], compare(*pair)
+
+    max_pending = 2 * max_workers
+    pending: deque[Future[CompareResult]] = deque()
+
+    def next_results() -> Iterator[CompareResult]:
+        nonlocal pending
+        if ordered:
+            yield pending.popleft().result()
+            return
+
+        done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+        pending = deque(not_done)
+        for future in done:
+            yield future.result()
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="compare")
+    try:
+        for pair in pairs:
+            if len(pending) >= max_pending:
+                yield from next_results()
+            pending.append(pool.submit(compare_pair, pair))
+
+        while pending:
+            yield from next_results()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def _readinto_full(ff: FileIO, view: memoryview) -> int:
+    """Read into 'view' until it is full or end of file is reached. Return number of bytes read."""
+    num = 0
+    size = len(view)
+    while num < size:
+        got = ff.readinto(view[num:])
+        if not got:
+            break
+        num += got
+    return num
+
+
+_CacheKey = tuple[tuple[int, int, int, int], ...]
+
+
+def _cache_key(st1: os.stat_result, st2: os.stat_result) -> _CacheKey:
+    """Comparison is symmetric, so the order of the files does not matter."""
+    key1 = (st1.st_dev, st1.st_ino, st1.st_size, st1.st_mtime_ns)
+    key2 = (st2.st_dev, st2.st_ino, st2.st_size, st2.st_mtime_ns)
+    return (key1, key2) if key1 <= key2 else (key2, key1)
 
 
 class CompareFiles():
     """Provides the basic interface needed by the filehandler when comparing files.
 
-    This implementation simply does a filecmp.
+    This implementation compares content like filecmp, but does not use the unbounded module global filecmp cache.
+    Two names of the same inode (hard links) are considered equal without reading any data.
+
+    Results of content comparisons are kept in a least recently used cache, keyed by inode, size and mtime_ns of both files,
+    so a changed file is compared again.
+
+    Arguments:
+        cache_size: Max number of comparison results to cache. Zero disables the cache.
+        io_policy: Page cache advice and bandwidth limit used when reading files. None means no advice or limit.
+        known_digests: If not None, files with known digests (from xattrs or sidecar files) are compared by digest without reading the content.
+            See `KnownDigests` about which digests are trusted.
     """
 
+    # Size of blocks read when comparing content
+    block_size = filecmp.BUFSIZE
+
+    def __init__(self, *, cache_size: int = 10_000, io_policy: IoPolicy|None = None, known_digests: KnownDigests|None = None):
+        self.cache_size = cache_size
+        self.io_policy = io_policy
+        self.known_digests = known_digests
+        self._cache: OrderedDict[_CacheKey, bool] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
     def compare(self, fsp1: FsPath, fsp2: FsPath) -> bool:
         """Compare two files"""
 
-        if fsp1.stat().st_size != fsp2.stat().st_size:
+        st1 = fsp1.stat()
+        st2 = fsp2.stat()
+        if st1.st_size != st2.st_size:
             return False
 
-        return filecmp.cmp(fsp1, fsp2, shallow=False)
+        if st1.st_ino == st2.st_ino and st1.st_dev == st2.st_dev:
+            return True
+
+        known = self._known_same(fsp1, fsp2, st1, st2)
+        if known is not None:
+            return known
+
+        if not self.cache_size:
+            return self._compare_content(fsp1, fsp2)
+
+        key = _cache_key(st1, st2)
+        res = self._cache_get(key)
+        if res is None:
+            res = self._compare_content(fsp1, fsp2)
+            self._cache_put(key, res)
+
+        return res
+
+    def _known_same(self, fsp1: FsPath, fsp2: FsPath, st1: os.stat_result, st2: os.stat_result) -> bool|None:
+        """Compare by known digests, None if not known for both files."""
+        if self.known_digests:
+            return self.known_digests.compare(fsp1, fsp2, st1, st2)
+        return None
+
+    def compare_one_to_many(self, fsp: FsPath, candidates: Iterable[FsPath], *, max_open_files: int = 256) -> list[FsPath]:
+        """Return the candidates with the same content as 'fsp', in the order given.
+
+        Candidates with a different size are not read, and hard links to 'fsp' match without reading.
+        The content of 'fsp' and the remaining candidates is read in lockstep, block by block, and candidates are dropped as soon as they differ,
+        so each file is read at most once, as long as there are no more than 'max_open_files' candidates to read.
+        """
+
+        candidates = list(candidates)
+        st = fsp.stat()
+        matches: set[int] = set()
+        to_read: list[tuple[int, FsPath, _CacheKey]] = []
+        for idx, cand in enumerate(candidates):
+            cst = cand.stat()
+            if cst.st_size != st.st_size:
+                continue
+
+            if cst.st_ino == st.st_ino and cst.st_dev == st.st_dev:
+                matches.add(idx)
+                continue
+
+            res = self._known_same(fsp, cand, st, cst)
+            if res is None:
+                key = _cache_key(st, cst)
+                res = self._cache_get(key) if self.cache_size else None
+                if res is None:
+                    to_read.append((idx, cand, key))
+                    continue
+
+            if res:
+                matches.add(idx)
+
+        for start in range(0, len(to_read), max_open_files):
+            chunk = to_read[start:start + max_open_files]
+            same = self._compare_content_one_to_many(fsp, [cand for _, cand, _ in chunk])
+            for (idx, _, key), res in zip(chunk, same):
+                if self.cache_size:
+                    self._cache_put(key, res)
+                if res:
+                    matches.add(idx)
+
+        return [cand for idx, cand in enumerate(candidates) if idx in matches]
+
+    def _compare_content_one_to_many(self, fsp: FsPath, candidates: list[FsPath]) -> list[bool]:
+        """Compare content of 'fsp' with each of 'candidates', all with the same size, reading all files in lockstep."""
+        with ExitStack() as stack:
+            ff = stack.enter_context(open(fsp, 'rb'))
+            remaining = {idx: stack.enter_context(open(cand, 'rb')) for idx, cand in enumerate(candidates)}
+            stack.enter_context(self._reading(ff, *remaining.values()))
+            while remaining:
+                data = ff.read(self.block_size)
+                self._consume(len(data) * (len(remaining) + 1))
+                for idx, cff in list(remaining.items()):
+                    if cff.read(self.block_size) != data:
+                        if self.io_policy:
+                            self.io_policy.done(cff.fileno())
+                        cff.close()
+                        del remaining[idx]
+
+                if not data:
+                    break
+
+            return [idx in remaining for idx in range(len(candidates))]
+
+    def _reading(self, *files: IO[bytes]) -> ContextManager[None]:
+        """Apply the io_policy to 'files' while reading."""
+        return self.io_policy.reading(*files) if self.io_policy else nullcontext()
+
+    def _consume(self, num_bytes: int) -> None:
+        if self.io_policy:
+            self.io_policy.consume(num_bytes)
+
+    def _prefetch(self, pairs: Iterable[ComparePair]) -> Iterator[ComparePair]:
+        """Prefetch files as they are queued for comparison."""
+        assert self.io_policy
+        for pair in pairs:
+            self.io_policy.prefetch(pair[0])
+            self.io_policy.prefetch(pair[1])
+            yield pair
+
+    def _cache_get(self, key: _CacheKey) -> bool|None:
+        with self._cache_lock:
+            res = self._cache.get(key)
+            if res is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return res
+            self.cache_misses += 1
+            return None
+
+    def _cache_put(self, key: _CacheKey, res: bool) -> None:
+        with self._cache_lock:
+            self._cache[key] = res
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def compare_many(self, pairs: Iterable[ComparePair], *, max_workers: int = 8, ordered: bool = True) -> Iterator[CompareResult]:
+        """Compare pairs of files concurrently on a bounded thread pool, yielding (fsp1, fsp2, result).
+
+        If the io_policy prefetches, files are prefetched when they are queued.
+        See `compare_concurrently`.
+        """
+        if self.io_policy and self.io_policy.prefetch_size:
+            pairs = self._prefetch(pairs)
+        return compare_concurrently(self.compare, pairs, max_workers=max_workers, ordered=ordered)
+
+    def clear_cache(self) -> None:
+        """Clear the comparison result cache."""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _compare_content(self, fsp1: FsPath, fsp2: FsPath) -> bool:
+        """Compare content of two different files with the same size. Override this to change how content is compared."""
+        bufsize = self.block_size
+        with open(fsp1, 'rb') as ff1, open(fsp2, 'rb') as ff2, self._reading(ff1, ff2):
+            while True:
+                data1 = ff1.read(bufsize)
+                data2 = ff2.read(bufsize)
+                self._consume(len(data1) + len(data2))
+                if data1 != data2:
+                    return False
+                if not data1:
+                    return True
+
+
+class BufferedCompareFiles(CompareFiles):
+    """Compare file content in large blocks read into two preallocated buffers, which are reused for all comparisons done by a thread.
+
+    Unlike filecmp, which reads 8 KiB at a time into new bytes objects, no objects are allocated per block.
+
+    Arguments:
+        cache_size, io_policy, known_digests: See `CompareFiles`.
+        block_size: Size of read blocks.
+    """
+
+    def __init__(
+            self, *, cache_size: int = 10_000, io_policy: IoPolicy|None = None, known_digests: KnownDigests|None = None,
+            block_size: int = 256 * 1024):
+        super().__init__(cache_size=cache_size, io_policy=io_policy, known_digests=known_digests)
+        self.block_size = block_size
+        self._thread_local = threading.local()
+
+    def _buffers(self) -> tuple[bytearray, bytearray]:
+        """Return the buffers of the current thread."""
+        buffers: tuple[bytearray, bytearray]|None = getattr(self._thread_local, 'buffers', None)
+        if buffers is None:
+            buffers = self._thread_local.buffers = (bytearray(self.block_size), bytearray(self.block_size))
+        return buffers
+
+    def _compare_blocks(self, ff1: FileIO, ff2: FileIO, length: int) -> bool:
+        """Compare the next 'length' bytes of 'ff1' and 'ff2', or until end of file if 'length' is negative."""
+        buf1, buf2 = self._buffers()
+        with memoryview(buf1) as view1, memoryview(buf2) as view2:
+            while length:
+                num = self.block_size if length < 0 else min(self.block_size, length)
+                num1 = _readinto_full(ff1, view1[:num])
+                num2 = _readinto_full(ff2, view2[:num])
+                self._consume(num1 + num2)
+                if num1 != num2:
+                    return False
+
+                if num1 == self.block_size:
+                    # Full blocks, compare the bytearrays without copying. Note that comparing memoryviews is much slower.
+                    if buf1 != buf2:
+                        return False
+                elif buf1[:num1] != buf2[:num2]:
+                    return False
+
+                if num1 < num:
+                    # End of file, files may have been truncated since size was checked
+                    return length < 0
+
+                if length > 0:
+                    length -= num1
+
+        return True
+
+    def _compare_content(self, fsp1: FsPath, fsp2: FsPath) -> bool:
+        with open(fsp1, 'rb', buffering=0) as ff1, open(fsp2, 'rb', buffering=0) as ff2, self._reading(ff1, ff2):
+            return self._compare_blocks(ff1, ff2, -1)
+
+
+def data_extents(fd: int, size: int) -> list[tuple[int, int]]:
+    """Return list of (start, end) of data regions in the file open as 'fd', using lseek SEEK_DATA/SEEK_HOLE.
+
+    On filesystems without hole support the whole file is returned as one data region.
+    """
+    extents = []
+    pos = 0
+    try:
+        while pos < size:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+            extents.append((start, end))
+            pos = end
+    except OSError as ex:
+        if ex.errno == errno.ENXIO:
+            # No more data, only a hole until end of file
+            return extents
+        if ex.errno == errno.EINVAL:
+            return [(0, size)]
+        raise
+
+    return extents
+
+
+def _merge_extents(extents: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(extents):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class SparseCompareFiles(BufferedCompareFiles):
+    """Compare only the data regions of sparse files, found with lseek SEEK_DATA/SEEK_HOLE.
+
+    Regions which are holes in both files read as zeros in both files, and are skipped. The union of the data regions of both files is compared,
+    so a sparse file and a non-sparse copy of it are still equal.
+    On platforms without SEEK_DATA, this works like `BufferedCompareFiles`.
+
+    Arguments:
+        cache_size, io_policy, known_digests, block_size: See `BufferedCompareFiles`.
+    """
+
+    def _compare_content(self, fsp1: FsPath, fsp2: FsPath) -> bool:
+        if not hasattr(os, 'SEEK_DATA'):  # pragma: no cover
+            return super()._compare_content(fsp1, fsp2)
+
+        with open(fsp1, 'rb', buffering=0) as ff1, open(fsp2, 'rb', buffering=0) as ff2, self._reading(ff1, ff2):
+            size = os.fstat(ff1.fileno()).st_size
+            extents = _merge_extents(data_extents(ff1.fileno(), size) + data_extents(ff2.fileno(), size))
+            for start, end in extents:
+                ff1.seek(start)
+                ff2.seek(start)
+                if not self._compare_blocks(ff1, ff2, end - start):
+                    return False
+
+            return True
+
+
+class SampleCompareFiles(BufferedCompareFiles):
+    """Compare a few sample blocks of the files first, and only compare the full content if all samples are equal.
+
+    Many files with the same size differ in headers or trailers, so the default samples are head, tail and middle.
+    The number of pairs rejected by sampling are counted in 'num_sample_rejected', and the number of pairs which needed a full compare
+    in 'num_sample_passed'.
+
+    Arguments:
+        cache_size, io_policy, known_digests, block_size: See `BufferedCompareFiles`.
+        sample_size: Size of each sample block.
+        sample_offsets: Offsets of the sample blocks as fractions of the file size, 0.0 is the first and 1.0 is the last block of the file.
+    """
+
+    def __init__(
+            self, *, cache_size: int = 10_000, io_policy: IoPolicy|None = None, known_digests: KnownDigests|None = None,
+            block_size: int = 256 * 1024, sample_size: int = 4096, sample_offsets: Sequence[float] = (0.0, 1.0, 0.5)):
+        super().__init__(cache_size=cache_size, io_policy=io_policy, known_digests=known_digests, block_size=block_size)
+        self.sample_size = sample_size
+        self.sample_offsets = sample_offsets
+
+        self._counter_lock = threading.Lock()
+        self.num_sample_rejected = 0
+        self.num_sample_passed = 0
+
+    def _samples_equal(self, fd1: int, fd2: int, size: int) -> bool:
+        for frac in self.sample_offsets:
+            offset = int((size - self.sample_size) * frac)
+            data1 = os.pread(fd1, self.sample_size, offset)
+            data2 = os.pread(fd2, self.sample_size, offset)
+            self._consume(len(data1) + len(data2))
+            if data1 != data2:
+                return False
+        return True
+
+    def _compare_content(self, fsp1: FsPath, fsp2: FsPath) -> bool:
+        with open(fsp1, 'rb', buffering=0) as ff1, open(fsp2, 'rb', buffering=0) as ff2, self._reading(ff1, ff2):
+            size = os.fstat(ff1.fileno()).st_size
+            if size > self.sample_size * len(self.sample_offsets):
+                if not self._samples_equal(ff1.fileno(), ff2.fileno(), size):
+                    with self._counter_lock:
+                        self.num_sample_rejected += 1
+                    return False
+
+                with self._counter_lock:
+                    self.num_sample_passed += 1
+
+            return self._compare_blocks(ff1, ff2, -1)
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+import logging
+from pathlib import Path
+from contextlib import nullcontext
+from typing import Any
+
+from .types import FsPath
+from .io_policy import IoPolicy
+
+
+_LOG = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    hash_name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    digest BLOB NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (dev, ino, hash_name)
+);
+CREATE INDEX IF NOT EXISTS digests_last_used ON digests (last_used);
+"""
+
+
+def _i64(num: int) -> int:
+    """SQLite integers are signed 64 bit, st_dev and st_ino are unsigned."""
+    return num - 2**64 if num >= 2**63 else num
+
+
+class DigestCache():
+    """Persistent cache of file content digests, stored in an SQLite database.
+
+    Digests are keyed by file identity (st_dev, st_ino) and the hash algorithm name, and are only valid as long as
+    size, mtime_ns and ctime_ns are unchanged. A lookup of an entry where any of these has changed invalidates the entry.
+
+    The database uses write-ahead logging, so several processes may read (and write) the cache concurrently.
+    A `DigestCache` object may be shared between threads.
+
+    Arguments:
+        db_path: The SQLite database file. Created if it does not exist.
+        max_entries: When the cache grows beyond this number of entries, the least recently used entries are evicted.
+        timeout: Seconds to wait for a lock held by another process.
+    """
+
+    def __init__(self, db_path: Path|str, *, max_entries: int = 10_000_000, timeout: float = 30.0):
+        self.db_path = db_path
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._num_entries: int = self._conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_invalidated = 0
+        self.num_evicted = 0
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> 'DigestCache':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def get(self, st: os.stat_result, hash_name: str) -> bytes|None:
+        """Return the cached digest for file with stat result 'st', or None if not cached or changed since cached."""
+        key = (_i64(st.st_dev), _i64(st.st_ino), hash_name)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, ctime_ns, digest FROM digests WHERE dev=? AND ino=? AND hash_name=?", key).fetchone()
+            if row is None:
+                self.num_misses += 1
+                return None
+
+            size, mtime_ns, ctime_ns, digest = row
+            if (size, mtime_ns, ctime_ns) != (st.st_size, st.st_mtime_ns, st.st_ctime_ns):
+                _LOG.debug("Invalidating cached digest for inode %s", key)
+                self._conn.execute("DELETE FROM digests WHERE dev=? AND ino=? AND hash_name=?", key)
+                self._num_entries -= 1
+                self.num_invalidated += 1
+                self.num_misses += 1
+                return None
+
+            self._conn.execute("UPDATE digests SET last_used=? WHERE dev=? AND ino=? AND hash_name=?", (time.time_ns(), *key))
+            self.num_hits += 1
+            return bytes(digest)
+
+    def put(self, st: os.stat_result, hash_name: str, digest: bytes) -> None:
+        """Store 'digest' for file with stat result 'st'."""
+        key = (_i64(st.st_dev), _i64(st.st_ino), hash_name)
+        values = (st.st_size, st.st_mtime_ns, st.st_ctime_ns, digest, time.time_ns())
+        with self._lock:
+            # The rowcount of INSERT OR REPLACE is 1 also when replacing, so only count inserted entries
+            cur = self._conn.execute("INSERT OR IGNORE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (*key, *values))
+            if not cur.rowcount:
+                self._conn.execute(
+                    "UPDATE digests SET size=?, mtime_ns=?, ctime_ns=?, digest=?, last_used=? WHERE dev=? AND ino=? AND hash_name=?", (*values, *key))
+                return
+
+            self._num_entries += 1
+            if self._num_entries > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Evict least recently used entries. Other processes may have added entries, so count again."""
+        self._num_entries = self._conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+        excess = self._num_entries - self.max_entries
+        if excess <= 0:
+            return
+
+        # Evict a little extra, so that we don't have to do this for every new entry
+        excess += self.max_entries // 100
+        cur = self._conn.execute("DELETE FROM digests WHERE rowid IN (SELECT rowid FROM digests ORDER BY last_used LIMIT ?)", (excess,))
+        self._num_entries -= cur.rowcount
+        self.num_evicted += cur.rowcount
+
+    def digest(self, fsp: FsPath, hash_name: str, *, io_policy: IoPolicy|None = None) -> bytes:
+        """Return the digest of file 'fsp', from the cache if possible, otherwise calculate and cache it.
+
+        If 'io_policy' is not None, it is applied when the file must be read.
+        """
+        st = fsp.stat()
+        digest = self.get(st, hash_name)
+        if digest is not None:
+            return digest
+
+        with open(fsp, 'rb') as ff:
+            with io_policy.reading(ff) if io_policy else nullcontext():
+                digest = hashlib.file_digest(ff, hash_name).digest()
+        if io_policy:
+            io_policy.consume(st.st_size)
+        self.put(st, hash_name, digest)
+        return digest
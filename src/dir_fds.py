@@ -0,0 +1,105 @@
+import os
+import threading
+from collections import OrderedDict, Counter
+from contextlib import contextmanager, ExitStack
+import logging
+from typing import Iterator, Any
+
+
+_LOG = logging.getLogger(__name__)
+
+_HAS_DIR_FD = {os.open, os.unlink, os.rename, os.symlink, os.readlink} <= os.supports_dir_fd
+
+
+class DirFds():
+    """Bounded LRU cache of open directory file descriptors, for file operations relative to the parent directory.
+
+    The operations use the 'dir_fd' variants of the `os` functions, so that the kernel does not have to resolve the full path of the directory on every call.
+    The directories must not be renamed or replaced while cached, as the cached fds will still refer to the original directories.
+
+    A `DirFds` object may be shared between threads. Directories in use are not closed until the operation is done, so more than
+    'max_open' directories may be open temporarily.
+
+    Arguments:
+        max_open: Maximum number of directories kept open.
+    """
+
+    def __init__(self, *, max_open: int = 128):
+        if not _HAS_DIR_FD:  # pragma: no cover
+            raise NotImplementedError("File operations relative to directory file descriptors are not supported on this platform.")
+
+        self.max_open = max_open
+
+        self._lock = threading.Lock()
+        self._fds: OrderedDict[str, int] = OrderedDict()
+        self._in_use: Counter[str] = Counter()
+
+        self.num_opened = 0
+        self.num_hits = 0
+
+    def close(self) -> None:
+        """Close all cached directory fds."""
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+
+    def __enter__(self) -> 'DirFds':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _evict(self) -> None:
+        for dir_path in list(self._fds):
+            if len(self._fds) <= self.max_open:
+                return
+            if not self._in_use[dir_path]:
+                os.close(self._fds.pop(dir_path))
+
+    @contextmanager
+    def _opened(self, path: str) -> Iterator[tuple[int, str]]:
+        """Yield (fd of parent directory, name) for absolute 'path'."""
+        dir_path, name = os.path.split(path)
+        with self._lock:
+            fd = self._fds.get(dir_path)
+            if fd is None:
+                fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+                self._fds[dir_path] = fd
+                self.num_opened += 1
+            else:
+                self._fds.move_to_end(dir_path)
+                self.num_hits += 1
+
+            self._in_use[dir_path] += 1
+            self._evict()
+
+        try:
+            yield fd, name
+        finally:
+            with self._lock:
+                self._in_use[dir_path] -= 1
+                if not self._in_use[dir_path]:
+                    del self._in_use[dir_path]
+
+    def readlink(self, path: str) -> str:
+        """`os.readlink` of absolute 'path'."""
+        with self._opened(path) as (fd, name):
+            return os.readlink(name, dir_fd=fd)
+
+    def unlink(self, path: str) -> None:
+        """`os.unlink` of absolute 'path'."""
+        with self._opened(path) as (fd, name):
+            os.unlink(name, dir_fd=fd)
+
+    def symlink(self, points_to: str, path: str) -> None:
+        """`os.symlink` creating absolute 'path' pointing to 'points_to'."""
+        with self._opened(path) as (fd, name):
+            os.symlink(points_to, name, dir_fd=fd)
+
+    def rename(self, src_path: str, dst_path: str) -> None:
+        """`os.rename` of absolute 'src_path' to absolute 'dst_path'."""
+        with ExitStack() as stack:
+            src_fd, src_name = stack.enter_context(self._opened(src_path))
+            dst_fd, dst_name = stack.enter_context(self._opened(dst_path))
+            os.rename(src_name, dst_name, src_dir_fd=src_fd, dst_dir_fd=dst_fd)
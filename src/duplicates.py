@@ -0,0 +1,262 @@
+from os import DirEntry
+import hashlib
+from collections import defaultdict
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+import logging
+from typing import Callable, Iterator, Iterable, ContextManager, IO
+
+from .groups import FileGroups, GroupType
+from .compare_files import CompareFiles
+from .digest_cache import DigestCache
+from .io_policy import IoPolicy
+from .known_digests import KnownDigests
+
+
+_LOG = logging.getLogger(__name__)
+
+
+@dataclass
+class DuplicateSet():
+    """A set of files with identical content.
+
+    The paths are split into protected files, which must be kept, and files which may be worked on.
+    """
+    size: int
+    must_protect: list[str] = field(default_factory=list)
+    may_work_on: list[str] = field(default_factory=list)
+
+
+# A file considered by the duplicate finder, all names are hard links to the same inode.
+@dataclass
+class _Candidate():
+    entry: DirEntry
+    names: list[tuple[GroupType, str]]
+    digest: bytes|None = None
+
+
+class FindDuplicates():  # pylint: disable=too-many-instance-attributes
+    """Find sets of duplicate files in collected `FileGroups`, where at least one file is in the `may_work_on` group.
+
+    Files are bucketed in stages, each stage only reading data for files which are still possible duplicates:
+
+        1. Size, from the stat information recorded during collect. Hard links are only considered once.
+        2. Hash of a sample of 'sample_size' bytes from the head and tail of the file.
+           Skipped if all files with the same size have a known full hash (from 'known_digests' or 'digest_cache').
+        3. Hash of the full content.
+        4. Optionally confirm with `CompareFiles.compare`.
+
+    Arguments:
+        fg: The collected files to search.
+        fcmp: If not None, confirm files with equal full hash using this object.
+        sample_size: Number of bytes read from each of head and tail of files in stage 2.
+        hash_name: Name of `hashlib` algorithm used for sample and full hash.
+        min_size: Ignore files smaller than this. The default ignores empty files.
+        digest_cache: If not None, full hashes are looked up in and stored in this cache.
+        io_policy: Page cache advice and bandwidth limit used when reading files.
+        known_digests: If not None, use digests from xattrs and checksum sidecar files instead of hashing, and store computed digests.
+            See `KnownDigests` about which digests are trusted.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            fg: FileGroups,
+            *,
+            fcmp: CompareFiles|None = None,
+            sample_size: int = 4096,
+            hash_name: str = 'sha256',
+            min_size: int = 1,
+            digest_cache: DigestCache|None = None,
+            io_policy: IoPolicy|None = None,
+            known_digests: KnownDigests|None = None):
+        self.fg = fg
+        self.fcmp = fcmp
+        self.sample_size = sample_size
+        self.hash_name = hash_name
+        self.min_size = min_size
+        self.digest_cache = digest_cache
+        self.io_policy = io_policy
+        self.known_digests = known_digests
+
+        self.num_bytes_read = 0
+        self.num_sample_hashed = 0
+        self.num_full_hashed = 0
+        self.num_known_digests = 0
+        self.num_compared = 0
+        self.num_duplicate_sets = 0
+
+    def _size_buckets(self) -> dict[int, dict[tuple[int, int], _Candidate]]:
+        """Stage 1: Bucket all collected files by size and inode."""
+        buckets: dict[int, dict[tuple[int, int], _Candidate]] = defaultdict(dict)
+        for group in (self.fg.must_protect, self.fg.may_work_on):
+            for path, entry in group.files.items():
+                st = entry.stat(follow_symlinks=False)
+                if st.st_size < self.min_size:
+                    continue
+
+                inodes = buckets[st.st_size]
+                candidate = inodes.get((st.st_dev, st.st_ino))
+                if candidate is None:
+                    inodes[(st.st_dev, st.st_ino)] = _Candidate(entry, [(group.typ, path)])
+                else:
+                    candidate.names.append((group.typ, path))
+
+        return buckets
+
+    def _reading(self, ff: IO[bytes]) -> ContextManager[None]:
+        return self.io_policy.reading(ff) if self.io_policy else nullcontext()
+
+    def _read(self, ff: IO[bytes], num_bytes: int) -> bytes:
+        data = ff.read(num_bytes)
+        self.num_bytes_read += len(data)
+        if self.io_policy:
+            self.io_policy.consume(len(data))
+        return data
+
+    def _sample_hash(self, candidate: _Candidate, size: int) -> bytes:
+        """Stage 2: Hash head and tail of file."""
+        hsh = hashlib.new(self.hash_name)
+        with open(candidate.entry.path, 'rb') as ff, self._reading(ff):
+            hsh.update(self._read(ff, self.sample_size))
+            if size > 2 * self.sample_size:
+                ff.seek(size - self.sample_size)
+            hsh.update(self._read(ff, self.sample_size))
+
+        self.num_sample_hashed += 1
+        return hsh.digest()
+
+    def _known_digest(self, candidate: _Candidate) -> bytes|None:
+        """Look up the full hash of 'candidate' in known_digests and the digest_cache."""
+        if candidate.digest is not None:
+            return candidate.digest
+
+        st = candidate.entry.stat(follow_symlinks=False)
+        if self.known_digests:
+            candidate.digest = self.known_digests.get(candidate.entry.path, self.hash_name, st)
+            if candidate.digest is not None:
+                self.num_known_digests += 1
+                return candidate.digest
+
+        if self.digest_cache:
+            candidate.digest = self.digest_cache.get(st, self.hash_name)
+
+        return candidate.digest
+
+    def _full_hash(self, candidate: _Candidate, size: int) -> bytes:
+        """Stage 3: Hash full content of file."""
+        known = self._known_digest(candidate)
+        if known is not None:
+            return known
+
+        with open(candidate.entry.path, 'rb') as ff, self._reading(ff):
+            digest = hashlib.file_digest(ff, self.hash_name).digest()
+
+        self.num_bytes_read += size
+        if self.io_policy:
+            self.io_policy.consume(size)
+        self.num_full_hashed += 1
+        st = candidate.entry.stat(follow_symlinks=False)
+        if self.digest_cache:
+            self.digest_cache.put(st, self.hash_name, digest)
+        if self.known_digests:
+            self.known_digests.store(candidate.entry.path, self.hash_name, digest, st)
+        candidate.digest = digest
+        return digest
+
+    def _confirm(self, candidates: list[_Candidate]) -> Iterator[list[_Candidate]]:
+        """Stage 4: Split candidates with equal hash into sets of files which compare equal."""
+        if self.fcmp is None:
+            yield candidates
+            return
+
+        while candidates:
+            first, *rest = candidates
+            same = [first]
+            candidates = []
+            for candidate in rest:
+                self.num_compared += 1
+                if self.fcmp.compare(first.entry, candidate.entry):
+                    same.append(candidate)
+                else:
+                    candidates.append(candidate)
+
+            yield same
+
+    @staticmethod
+    def _split(candidates: list[_Candidate], hash_func: Callable[[_Candidate, int], bytes], size: int) -> Iterable[list[_Candidate]]:
+        """Split candidates into lists with the same 'hash_func' value."""
+        buckets: dict[bytes, list[_Candidate]] = defaultdict(list)
+        for candidate in candidates:
+            buckets[hash_func(candidate, size)].append(candidate)
+        return buckets.values()
+
+    def _same_content(self, candidates: list[_Candidate], size: int) -> Iterator[list[_Candidate]]:
+        """Yield lists of candidates with the same content, including single candidates."""
+        if len(candidates) == 1:
+            yield candidates
+            return
+
+        if (self.known_digests or self.digest_cache) and all(self._known_digest(candidate) is not None for candidate in candidates):
+            for same_hash in self._split(candidates, self._full_hash, size):
+                yield from self._confirm(same_hash)
+            return
+
+        for same_sample in self._split(candidates, self._sample_hash, size):
+            if len(same_sample) == 1:
+                yield same_sample
+                continue
+
+            if size <= 2 * self.sample_size:
+                # The sample covered the whole file
+                same_hash_sets: Iterable[list[_Candidate]] = [same_sample]
+            else:
+                same_hash_sets = self._split(same_sample, self._full_hash, size)
+
+            for same_hash in same_hash_sets:
+                yield from self._confirm(same_hash)
+
+    def _duplicate_set(self, candidates: list[_Candidate], size: int) -> DuplicateSet|None:
+        dup = DuplicateSet(size)
+        for candidate in candidates:
+            for typ, path in candidate.names:
+                if typ is GroupType.MUST_PROTECT:
+                    dup.must_protect.append(path)
+                else:
+                    dup.may_work_on.append(path)
+
+        if not dup.may_work_on or len(dup.must_protect) + len(dup.may_work_on) < 2:
+            return None
+
+        self.num_duplicate_sets += 1
+        return dup
+
+    def find(self) -> Iterator[DuplicateSet]:
+        """Yield the sets of duplicates.
+
+        Only sets with at least one file in the `may_work_on` group are returned.
+        Hard links to the same inode are always duplicates, and are reported without reading any data.
+        """
+
+        for size, inodes in self._size_buckets().items():
+            candidates = list(inodes.values())
+            if not any(typ is GroupType.MAY_WORK_ON for candidate in candidates for typ, _ in candidate.names):
+                continue
+
+            for same in self._same_content(candidates, size):
+                dup = self._duplicate_set(same, size)
+                if dup:
+                    yield dup
+
+    def stats(self) -> None:
+        """Log duplicate finding numbers."""
+        log = _LOG.getChild("stats")
+        lvl = logging.INFO
+        if not log.isEnabledFor(lvl):
+            return
+
+        log.log(lvl, "duplicate sets: %s", self.num_duplicate_sets)
+        log.log(lvl, "sample hashed files: %s", self.num_sample_hashed)
+        log.log(lvl, "full hashed files: %s", self.num_full_hashed)
+        log.log(lvl, "known digests: %s", self.num_known_digests)
+        log.log(lvl, "compared files: %s", self.num_compared)
+        log.log(lvl, "bytes read: %s", self.num_bytes_read)
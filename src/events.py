@@ -0,0 +1,92 @@
+from enum import Enum
+import logging
+from typing import NamedTuple
+
+from .types import FsPath
+
+
+class EventKind(Enum):
+    """Kind of event reported by `FileHandler` to its `EventSink`."""
+    # File system operations
+    DELETE = "delete"
+    TRASH = "trash"
+    RENAME = "rename"
+    MOVE = "move"
+    RELINK = "relink"
+    REPLACE = "replace"
+    HARDLINKS_REMAIN = "hardlinks_remain"
+
+    # Symlinks to deleted or moved files
+    SYMLINKED = "symlinked"
+    KEEP_SYMLINK = "keep_symlink"
+    SYMLINK_TO_SYMLINK = "symlink_to_symlink"
+    BROKEN_SYMLINK = "broken_symlink"
+
+    # Duplicates found by `FileHandlerCompare.compare`
+    DUPLICATE = "duplicate"
+    DUPLICATE_HARDLINK = "duplicate_hardlink"
+
+
+class Event(NamedTuple):
+    """An event about 'path'.
+
+    'target' is:
+        DELETE, SYMLINK_TO_SYMLINK: None
+        TRASH: The path in the trash.
+        RENAME, MOVE: The path renamed or moved to, as specified.
+        RELINK: The new value of the symlink.
+        REPLACE: The absolute path of the file linked to.
+        SYMLINKED, KEEP_SYMLINK, BROKEN_SYMLINK: The absolute path the symlink points to.
+        DUPLICATE, DUPLICATE_HARDLINK: The file which is a duplicate of 'path'.
+
+    'detail' is:
+        RELINK: The absolute path the symlink pointed to.
+        REPLACE: "hard link" or "reflink".
+        HARDLINKS_REMAIN: The number of remaining hard links to the deleted file.
+        Otherwise None.
+    """
+    kind: EventKind
+    path: str|FsPath
+    target: str|FsPath|None = None
+    detail: str|int|None = None
+
+
+class EventSink():
+    """Receiver of events, this base class ignores the events.
+
+    `emit` is called synchronously in the registered operations, from the threads calling them, so it should be fast and thread safe.
+    """
+
+    def emit(self, event: Event) -> None:
+        """Handle 'event'."""
+
+
+_HANDLER_LOG = logging.getLogger('file_groups.handler')
+_HANDLER_COMPARE_LOG = logging.getLogger('file_groups.handler_compare')
+
+# Event kind -> (logger, message format, indexes in event of the message arguments)
+_LOG_MESSAGES: dict[EventKind, tuple[logging.Logger, str, tuple[int, ...]]] = {
+    EventKind.DELETE: (_HANDLER_LOG, "    deleting: %s", (1,)),
+    EventKind.TRASH: (_HANDLER_LOG, "    deleting: %s (to trash %s)", (1, 2)),
+    EventKind.RENAME: (_HANDLER_LOG, "    renaming: %s to %s", (1, 2)),
+    EventKind.MOVE: (_HANDLER_LOG, "    moving: %s to %s", (1, 2)),
+    EventKind.RELINK: (_HANDLER_LOG, "Changing symlink: '%s' -> '%s' (was -> %s)", (1, 2, 3)),
+    EventKind.REPLACE: (_HANDLER_LOG, "    replacing: %s with %s to %s", (1, 3, 2)),
+    EventKind.HARDLINKS_REMAIN: (_HANDLER_LOG, "    %s other hard link(s) to '%s' remain, no space freed.", (3, 1)),
+    EventKind.SYMLINKED: (_HANDLER_LOG, "Symlinked: '%s' -> '%s'", (1, 2)),
+    EventKind.KEEP_SYMLINK: (_HANDLER_LOG, "Keeping symlink pointing outside delete-dirs: '%s' -> '%s'", (1, 2)),
+    EventKind.SYMLINK_TO_SYMLINK: (_HANDLER_LOG, "Symlink to symlink: '%s'.", (1,)),
+    # TODO, verify message
+    EventKind.BROKEN_SYMLINK: (_HANDLER_LOG, "Created broken symlink '%s' -> '%s'", (1, 2)),
+    EventKind.DUPLICATE: (_HANDLER_COMPARE_LOG, "Duplicates: '%s' '%s'", (1, 2)),
+    EventKind.DUPLICATE_HARDLINK: (_HANDLER_COMPARE_LOG, "Duplicates (hard links): '%s' '%s'", (1, 2)),
+}
+
+
+class LoggingEventSink(EventSink):
+    """Log events at INFO level, with the messages and loggers of the `handler` and `handler_compare` modules."""
+
+    def emit(self, event: Event) -> None:
+        log, msg, arg_indexes = _LOG_MESSAGES[event.kind]
+        if log.isEnabledFor(logging.INFO):
+            log.info(msg, *[event[index] for index in arg_indexes])
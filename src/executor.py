@@ -0,0 +1,122 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import logging
+from typing import Callable, Any
+
+from .plan import OpKind, PlannedOp, execute_op
+from .dir_fds import DirFds
+from .move_engine import MoveEngine
+
+
+_LOG = logging.getLogger(__name__)
+
+
+class ConcurrentExecutor():
+    """Execute file system operations on a pool of worker threads, keeping the order of operations on the same directory.
+
+    An operation is started when all previously submitted operations on the same directories are done, and the operation given as 'after' to `submit`
+    is done. Operations on the source and destination directories of a rename or move, and on the directories of the replaced file and the
+    file linked to of a hard link or reflink, are ordered.
+    If the 'after' operation fails, the operation is skipped. Failed and skipped operations are recorded in `failed`.
+
+    The number of submitted operations not yet done is limited to 'max_pending', `submit` blocks until there is room.
+
+    Arguments:
+        max_workers: Number of worker threads.
+        max_pending: Maximum number of submitted operations not done. Default is 4 * max_workers.
+        dir_fds, move_engine: See `plan.execute_op`.
+    """
+
+    def __init__(self, *, max_workers: int = 8, max_pending: int|None = None, dir_fds: DirFds|None = None, move_engine: MoveEngine|None = None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending or 4 * max_workers
+        self.dir_fds = dir_fds
+        self.move_engine = move_engine
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="file_groups")
+        self._cond = threading.Condition()
+        self._num_pending = 0
+        # Directory -> last submitted operation on the directory
+        self._tails: dict[str, Future] = {}
+
+        self.failed: list[tuple[PlannedOp, BaseException]] = []
+        self.num_executed = 0
+        self.num_skipped = 0
+
+    def __enter__(self) -> 'ConcurrentExecutor':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.shutdown()
+
+    @staticmethod
+    def _dirs(op: PlannedOp) -> set[str]:
+        dirs = {os.path.dirname(op.path)}
+        if op.kind in (OpKind.RENAME, OpKind.MOVE, OpKind.TRASH, OpKind.HARDLINK, OpKind.REFLINK):
+            assert op.target is not None
+            dirs.add(os.path.dirname(op.target))
+        return dirs
+
+    def _run(self, op: PlannedOp, depends: list[Future], after: Future|None, on_done: Callable[[PlannedOp], None]|None) -> None:
+        wait(depends)
+        after_ex = after.exception() if after is not None else None
+        if after_ex is not None:
+            _LOG.warning("Skipping %s, because a previous operation failed", op)
+            with self._cond:
+                self.failed.append((op, after_ex))
+                self.num_skipped += 1
+            raise RuntimeError(f"Skipped {op}")
+
+        try:
+            execute_op(op, self.dir_fds, self.move_engine)
+        except Exception as ex:
+            _LOG.warning("Failed %s: %s", op, ex)
+            with self._cond:
+                self.failed.append((op, ex))
+            raise
+
+        with self._cond:
+            self.num_executed += 1
+        if on_done:
+            on_done(op)
+
+    def _finished(self, dirs: set[str], fut: Future) -> None:
+        with self._cond:
+            for dir_path in dirs:
+                if self._tails.get(dir_path) is fut:
+                    del self._tails[dir_path]
+            self._num_pending -= 1
+            self._cond.notify_all()
+
+    def submit(self, op: PlannedOp, *, after: Future|None = None, on_done: Callable[[PlannedOp], None]|None = None) -> Future:
+        """Submit 'op' for execution after 'after' and previous operations on the same directories.
+
+        'on_done' is called with 'op' in the worker thread, when 'op' has been executed successfully.
+        """
+        dirs = self._dirs(op)
+        with self._cond:
+            while self._num_pending >= self.max_pending:
+                self._cond.wait()
+
+            depends = [self._tails[dir_path] for dir_path in dirs if dir_path in self._tails]
+            if after is not None:
+                depends.append(after)
+            fut = self._pool.submit(self._run, op, depends, after, on_done)
+            for dir_path in dirs:
+                self._tails[dir_path] = fut
+            self._num_pending += 1
+
+        fut.add_done_callback(lambda fut: self._finished(dirs, fut))
+        return fut
+
+    def join(self) -> None:
+        """Wait until all submitted operations are done."""
+        with self._cond:
+            while self._num_pending:
+                self._cond.wait()
+
+    def shutdown(self) -> None:
+        """Wait for all submitted operations and stop the worker threads."""
+        self.join()
+        self._pool.shutdown()
@@ -2,14 +2,19 @@ import os
 from os import DirEntry
 from pathlib import Path
 import re
+import time
 from collections import defaultdict
 from dataclasses import dataclass
 from itertools import chain
 from enum import Enum
 import logging
-from typing import Sequence, cast
+from typing import Any, Sequence, cast
 
 from .config_files import DirConfig, ConfigFiles
+from .dir_fds import DirFds
+from .rate_limiter import RateLimiter
+from .metrics import MetricsExporter
+from .trash import TRASH_DIR_NAME
 
 
 _LOG = logging.getLogger(__name__)
@@ -30,6 +35,11 @@ class _Group():
     files: dict[str, DirEntry]
     symlinks: dict[str, DirEntry]
     symlinks_by_abs_points_to: dict[str, list[DirEntry]]
+    # Symlink -> value read during collect, updated by relink
+    link_values: dict[str, str]
+
+    # Files with more than one hard link, by (st_dev, st_ino)
+    files_by_inode: dict[tuple[int, int], list[DirEntry]]
 
     # For stats only
     num_directories: int = 0
@@ -38,20 +48,120 @@ class _Group():
     def add_entry_match(self, entry: DirEntry) -> None:
         """Abstract, but abstract and dataclass does not work with mypy. https://github.com/python/mypy/issues/500"""
 
+    def add_file(self, entry: DirEntry) -> None:
+        """Add 'entry' to files and, if it has multiple hard links, to the inode index.
+
+        The stat result (st_dev, st_ino, st_nlink) is cached on the DirEntry, so later lookups do not need a syscall.
+        """
+        self.files[entry.path] = entry
+        st = entry.stat(follow_symlinks=False)
+        if st.st_nlink > 1:
+            self.files_by_inode[(st.st_dev, st.st_ino)].append(entry)
+
+    def add_symlink(self, entry: DirEntry, link_value: str, abs_points_to: str) -> None:
+        """Add symlink 'entry' with value 'link_value', pointing to absolute path 'abs_points_to'."""
+        self.symlinks[entry.path] = entry
+        self.symlinks_by_abs_points_to[abs_points_to].append(entry)
+        self.link_values[entry.path] = link_value
+
+    def remove(self, path: str, abs_points_to: str|None) -> DirEntry|None:
+        """Remove file or symlink 'path' from the group. 'abs_points_to' is the absolute path the symlink points to.
+
+        Return the removed entry, or None if 'path' is not in the group.
+        """
+        entry = self.files.pop(path, None)
+        if entry is not None:
+            st = entry.stat(follow_symlinks=False)
+            if st.st_nlink > 1:
+                inode = (st.st_dev, st.st_ino)
+                self.files_by_inode[inode].remove(entry)
+                if not self.files_by_inode[inode]:
+                    del self.files_by_inode[inode]
+            return entry
+
+        entry = self.symlinks.pop(path, None)
+        self.link_values.pop(path, None)
+        if entry is not None and abs_points_to is not None:
+            self._remove_symlink_by_abs_points_to(entry, abs_points_to)
+        return entry
+
+    def relink(self, path: str, old_abs_points_to: str, abs_points_to: str, link_value: str) -> None:
+        """Update the index of symlinks by absolute path pointed to and the value, when symlink 'path' is changed to 'link_value'."""
+        entry = self.symlinks[path]
+        self._remove_symlink_by_abs_points_to(entry, old_abs_points_to)
+        self.symlinks_by_abs_points_to[abs_points_to].append(entry)
+        self.link_values[path] = link_value
+
+    def _remove_symlink_by_abs_points_to(self, entry: DirEntry, abs_points_to: str) -> None:
+        self.symlinks_by_abs_points_to[abs_points_to].remove(entry)
+        if not self.symlinks_by_abs_points_to[abs_points_to]:
+            del self.symlinks_by_abs_points_to[abs_points_to]
+
+    def save(self) -> tuple[dict, dict, dict, dict, dict]:
+        """Return a copy of the file and symlink dicts, see `restore`."""
+        return (
+            dict(self.files), dict(self.symlinks),
+            {key: list(entries) for key, entries in self.symlinks_by_abs_points_to.items()},
+            {key: list(entries) for key, entries in self.files_by_inode.items()},
+            dict(self.link_values))
+
+    def restore(self, saved: tuple[dict, dict, dict, dict, dict]) -> None:
+        """Restore the file and symlink dicts from the value returned by `save`."""
+        self.files, self.symlinks = saved[0], saved[1]
+        self.symlinks_by_abs_points_to = defaultdict(list, saved[2])
+        self.files_by_inode = defaultdict(list, saved[3])
+        self.link_values = saved[4]
+
+
+def _with_nlink(st: os.stat_result, nlink: int) -> os.stat_result:
+    """Return a copy of 'st' with link count 'nlink'."""
+    # The reduce value has all fields, including those not in the tuple, e.g. st_mtime_ns
+    fields, extra = cast(tuple[tuple[int, ...], dict[str, Any]], st.__reduce__()[1])
+    return os.stat_result(fields[:3] + (nlink,) + fields[4:], extra)
+
+
+class _MovedEntry():
+    """Stand in for the `DirEntry` of a moved, renamed or hard linked file or symlink.
+
+    Has the new path and name, the file type and stat result are the cached values from the original `DirEntry`, unless another stat
+    result is given, e.g. with a changed link count.
+    """
+
+    def __init__(self, path: str, entry: DirEntry, st: os.stat_result|None = None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._entry = entry
+        self._st = st
+
+    def __fspath__(self) -> str:
+        return self.path
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} '{self.name}'>"
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        """See `os.DirEntry.stat`."""
+        return self._st or self._entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self) -> bool:
+        """See `os.DirEntry.is_symlink`."""
+        return self._entry.is_symlink()
+
+
 @dataclass
 class _IncludeMatchGroup(_Group):
     include: re.Pattern|None = None
 
     def add_entry_match(self, entry: DirEntry) -> None:
         if not self.include:
-            self.files[entry.path] = entry
+            self.add_file(entry)
             return
 
         match = self.include.match(entry.name)
         _LOG.debug(" - include %s, match %s", self.include, match)
 
         if match:
-            self.files[entry.path] = entry
+            self.add_file(entry)
 
 
 @dataclass
@@ -60,14 +170,14 @@ class _ExcludeMatchGroup(_Group):
 
     def add_entry_match(self, entry: DirEntry) -> None:
         if not self.exclude:
-            self.files[entry.path] = entry
+            self.add_file(entry)
             return
 
         match = self.exclude.match(entry.name)
         _LOG.debug(" - exclude %s, match %s", self.exclude, match)
 
         if not match:
-            self.files[entry.path] = entry
+            self.add_file(entry)
 
 
 class FileGroups():
@@ -90,16 +200,28 @@ class FileGroups():
         work_include: ONLY include files matching regex in the may_work_on files (does not apply to symlinks). Default: Include ALL.
 
         config_files: Load config files. See config_files.ConfigFiles. Note that the default 'None' means use the `config_files.ConfigFiles` class with default arguments.
+
+        dir_fds: If not None, read symlinks relative to cached directory file descriptors, instead of resolving the full path for every symlink.
+
+        rate_limiter: If not None, each directory scan is an operation limited by the rate limiter.
+
+        metrics: If not None, the collect time of each protect and work directory is observed in the 'scan' histogram. See `MetricsExporter`.
     """
 
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments
             self,
             protect_dirs_seq: Sequence[Path], work_dirs_seq: Sequence[Path],
             *,
             protect_exclude: re.Pattern|None = None, work_include: re.Pattern|None = None,
-            config_files: ConfigFiles|None = None):
+            config_files: ConfigFiles|None = None,
+            dir_fds: DirFds|None = None,
+            rate_limiter: RateLimiter|None = None,
+            metrics: MetricsExporter|None = None):
         super().__init__()
 
+        self.dir_fds = dir_fds
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
         self.config_files = config_files or ConfigFiles()
         self.config_files.load_config_dir_files()
 
@@ -121,12 +243,15 @@ class FileGroups():
 
             work_dirs[real_dp] = input_work_dir
 
-        self.must_protect = _ExcludeMatchGroup(GroupType.MUST_PROTECT, protect_dirs, {}, {}, defaultdict(list), exclude=protect_exclude)
-        self.may_work_on = _IncludeMatchGroup(GroupType.MAY_WORK_ON, work_dirs, {}, {}, defaultdict(list), include=work_include)
+        # Collected directory -> (group, other group, config) used when collecting the directory
+        self._dir_groups: dict[str, tuple[_Group, _Group, DirConfig]] = {}
+
+        self.must_protect = _ExcludeMatchGroup(GroupType.MUST_PROTECT, protect_dirs, {}, {}, defaultdict(list), {}, defaultdict(list), exclude=protect_exclude)
+        self.may_work_on = _IncludeMatchGroup(GroupType.MAY_WORK_ON, work_dirs, {}, {}, defaultdict(list), {}, defaultdict(list), include=work_include)
 
         self.collect()
 
-    def collect(self) -> None:
+    def collect(self) -> None:  # pylint: disable=too-many-statements
         """Split files into groups.
 
         E.g.:
@@ -179,6 +304,10 @@ class FileGroups():
                     group, other_group = other_group, group
 
             if entry.is_dir(follow_symlinks=False):
+                if entry.name == TRASH_DIR_NAME:
+                    _LOG.debug("find %s - '%s' is a trash directory - ignoring", group.typ.name, entry.path)
+                    return
+
                 if entry.path in other_group.dirs:
                     _LOG.debug("find %s - '%s' is in '%s' dir list and not in '%s' dir list", group.typ.name, entry.path, other_group.typ.name, group.typ.name)
                     find_group(entry.path, other_group, group, dir_config)
@@ -192,16 +321,21 @@ class FileGroups():
 
             if entry.is_symlink():
                 # cast: https://github.com/python/mypy/issues/11964
-                points_to = os.readlink(cast(str, entry))
+                points_to = self.dir_fds.readlink(entry.path) if self.dir_fds else os.readlink(cast(str, entry))
                 abs_points_to = os.path.normpath(os.path.join(abs_dir_path, points_to))
 
-                if entry.is_dir(follow_symlinks=True):
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=True)
+                except OSError:
+                    # Symlink cycle
+                    is_dir = False
+
+                if is_dir:
                     _LOG.debug("find %s - '%s' -> '%s' is a symlink to a directory - ignoring", group.typ.name, entry.path, points_to)
                     group.num_directory_symlinks += 1
                     return
 
-                group.symlinks[entry.path] = entry
-                group.symlinks_by_abs_points_to[abs_points_to].append(entry)
+                group.add_symlink(entry, points_to, abs_points_to)
                 return
 
             _LOG.debug("find %s - entry name: %s", group.typ.name, entry.name)
@@ -216,7 +350,10 @@ class FileGroups():
 
             group.num_directories += 1
             dir_config = self.config_files.dir_config(Path(abs_dir_path), parent_conf)
+            self._dir_groups[abs_dir_path] = (group, other_group, dir_config)
 
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
             for entry in os.scandir(abs_dir_path):
                 handle_entry(abs_dir_path, group, other_group, dir_config, entry)
 
@@ -233,10 +370,65 @@ class FileGroups():
             else:
                 parent_conf = None
 
+            start = time.monotonic()
             if any_dir in self.must_protect.dirs:
                 find_group(any_dir, self.must_protect, self.may_work_on, parent_conf)
             else:
                 find_group(any_dir, self.may_work_on, self.must_protect, parent_conf)
+            if self.metrics:
+                self.metrics.observe('scan', time.monotonic() - start)
+
+    def _forget(self, path: str, abs_points_to: str|None) -> DirEntry|None:
+        """Remove a deleted or moved file or symlink from the groups, see `_Group.remove`."""
+        return self.must_protect.remove(path, abs_points_to) or self.may_work_on.remove(path, abs_points_to)
+
+    def _change_nlink(self, entry: DirEntry, change: int) -> os.stat_result:
+        """Change the cached link count of the collected names of the file of 'entry' by 'change', return the changed stat result."""
+        st = entry.stat(follow_symlinks=False)
+        new_st = _with_nlink(st, st.st_nlink + change)
+        if st.st_nlink == 1:
+            # Not in the inode index
+            entries = [entry]
+        else:
+            inode = (st.st_dev, st.st_ino)
+            entries = [name for group in (self.must_protect, self.may_work_on) for name in group.files_by_inode.get(inode, ())]
+        for name in entries:
+            self._forget(name.path, None)
+            self._add_moved(name, name.path, None, new_st)
+        return new_st
+
+    def _add_moved(  # pylint: disable=too-many-arguments
+            self, entry: DirEntry, path: str, abs_points_to: str|None, st: os.stat_result|None = None, link_value: str|None = None) -> None:
+        """Add a moved or renamed file or symlink to the group of the directory it was moved to, as `collect` would have done.
+
+        Arguments:
+            entry: The entry of the file or symlink before it was moved.
+            path: The new absolute path.
+            abs_points_to: If the entry is a symlink, the absolute path it points to after the move.
+            st: If not None, the stat result of the file, instead of the cached stat result of 'entry'.
+            link_value: If the entry is a symlink, its value.
+        """
+        dir_groups = self._dir_groups.get(os.path.dirname(path))
+        if not dir_groups:
+            _LOG.debug("'%s' is not in a collected directory", path)
+            return
+
+        group, other_group, dir_config = dir_groups
+        # cast: duck typed DirEntry
+        moved = cast(DirEntry, _MovedEntry(path, entry, st))
+
+        if group.typ is GroupType.MAY_WORK_ON and dir_config.is_protected(moved):
+            group = other_group
+
+        if moved.name in self.config_files.conf_file_names:
+            return
+
+        if abs_points_to is not None:
+            assert link_value is not None
+            group.add_symlink(moved, link_value, abs_points_to)
+            return
+
+        group.add_entry_match(moved)
 
     def dump(self) -> None:
         """Log collected files. This may be A LOT of output for large directories."""
@@ -278,8 +470,27 @@ class FileGroups():
             log.log(lvl, "%s -> %s", lnks, abs_points_to)
         log.log(lvl, "")
 
+        log.log(lvl, "hard linked files by inode:")
+        for group in (self.must_protect, self.may_work_on):
+            for inode, entries in group.files_by_inode.items():
+                log.log(lvl, "%s %s: %s", group.typ.name, inode, [entry.path for entry in entries])
         log.log(lvl, "")
 
+        log.log(lvl, "")
+
+    def stats_counts(self) -> dict[str, int]:
+        """Return the collection numbers logged by `stats`."""
+        return {
+            "protect_directories": self.must_protect.num_directories,
+            "protect_directory_symlinks": self.must_protect.num_directory_symlinks,
+            "work_on_directories": self.may_work_on.num_directories,
+            "work_on_directory_symlinks": self.may_work_on.num_directory_symlinks,
+            "must_protect_files": len(self.must_protect.files),
+            "must_protect_symlinks": len(self.must_protect.symlinks),
+            "may_work_on_files": len(self.may_work_on.files),
+            "may_work_on_symlinks": len(self.may_work_on.symlinks),
+        }
+
     def stats(self) -> None:
         """Log collection numbers."""
         log = _LOG.getChild("stats")
@@ -287,12 +498,7 @@ class FileGroups():
         if not log.isEnabledFor(lvl):
             return
 
-        log.log(lvl, "collected protect_directories: %s", self.must_protect.num_directories)
-        log.log(lvl, "collected protect_directory_symlinks: %s", self.must_protect.num_directory_symlinks)
-        log.log(lvl, "collected work_on_directories: %s", self.may_work_on.num_directories)
-        log.log(lvl, "collected work_on_directory_symlinks: %s", self.may_work_on.num_directory_symlinks)
-
-        log.log(lvl, "collected must_protect_files: %s", len(self.must_protect.files))
-        log.log(lvl, "collected must_protect_symlinks: %s", len(self.must_protect.symlinks))
-        log.log(lvl, "collected may_work_on_files: %s", len(self.may_work_on.files))
-        log.log(lvl, "collected may_work_on_symlinks: %s", len(self.may_work_on.symlinks))
+        for name, num in FileGroups.stats_counts(self).items():
+            log.log(lvl, "collected %s: %s", name, num)
+        if self.rate_limiter:
+            self.rate_limiter.stats()
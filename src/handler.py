@@ -1,72 +1,224 @@
 import os
+from os import DirEntry
 from pathlib import Path
-import shutil
 import re
+import time
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import partial
 import logging
-from typing import Sequence
+from typing import Sequence, Iterable, Iterator, Callable, TypeVar
 
 from .groups import FileGroups
 from .config_files import ConfigFiles
 from .types import FsPath
+from .plan import OpKind, PlannedOp, Plan, BatchResult, execute_op
+from .dir_fds import DirFds
+from .executor import ConcurrentExecutor
+from .symlink_graph import SymlinkGraph
+from .overlay import FsOverlay
+from .journal import Journal
+from .move_engine import MoveEngine
+from .trash import Trash
+from .rate_limiter import RateLimiter
+from .events import EventKind, Event, EventSink, LoggingEventSink
+from .metrics import MetricsExporter
 
 _LOG = logging.getLogger(__name__)
 
+_T = TypeVar('_T')
 
-class FileHandler(FileGroups):
+
+class FileHandler(FileGroups):  # pylint: disable=too-many-instance-attributes
     """Protected files and symlinks safe operations on files in FileGroups.
 
-    Check that files being deleted/renamed/moved are not in the protect files set and that files in protect files are not overwritten.
+    Check that files being deleted/renamed/moved/replaced are not in the protect files set and that files in protect files are not overwritten.
     Re-link symlinks pointing to a file being moved.
     Re-link symlinks when a file being deleted has a corresponding file.
 
+    All file system operations, in both dry run and actual run, are recorded in `plan`.
+    The plan from a dry run may be executed later with `plan.execute()`, instead of doing an actual run.
+
+    The collected groups, `symlink_graph` and `moved_from` are updated by the operations, in both dry run and actual run, so that
+    several passes may be done without collecting the files again. Moved files and symlinks are added to the group of the directory they are
+    moved to, if that directory was collected. `reset` restores the collected groups after a dry run.
+    `overlay` answers exists, readlink and stat for paths after the operations, without file system calls for collected paths.
+
     Arguments:
-        protect_dirs_seq, work_dirs_seq, protect_exclude, work_include, config_files: See `FileGroups` class.
+        protect_dirs_seq, work_dirs_seq, protect_exclude, work_include, config_files, dir_fds, rate_limiter, metrics: See `FileGroups` class.
+            If 'dir_fds' is not None, it is also used for all file system operations.
+            If 'rate_limiter' is not None, it also limits the file system operations, except during dry_run.
+            If 'metrics' is not None, the time of the file system operations is also observed, see `MetricsExporter`.
         dry_run: Don't change any files.
+        executor: If not None, file system operations are executed by the executor, and the `registered_*` methods return before the operations are done.
+           The operations done by one `registered_*` call, e.g. a delete and the resulting symlink relinks, are executed in order.
+           The counters are updated when the operations are done, call `executor.join()` before using them. Failed operations are in `executor.failed`.
+           The `registered_*` methods may be called from multiple threads, both with and without an executor.
+        move_engine: If not None, used to move files, e.g. to copy files across file systems in the kernel. See `MoveEngine`.
+           With an executor, the move engine of the executor is used.
+        journal: If not None, operations are recorded in the journal before they are executed and when they are completed.
+           During dry_run the operations are only recorded as intended, so the planned operations may be executed later by `Journal.resume`.
+        trash: If not None, deleted files and symlinks are renamed into the trash, so that they can be restored. See `Trash`.
+        event_sink: Receives an `Event` for each operation and symlink change. The default logs the events.
+           Use `EventSink()` to skip the formatting of log messages, e.g. for runs with many files.
         delete_symlinks_instead_of_relinking: Normal operation is to re-link to a 'corresponding' or renamed file when renaming or deleting a file.
            If delete_symlinks_instead_of_relinking is true, then symlinks in work_on dirs pointing to renamed/deletes files will be deleted even if
            they could have logically been made to point to a file in a protect dir.
     """
 
-    def __init__(  # pylint: disable=too-many-arguments
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
             self,
             protect_dirs_seq: Sequence[Path], work_dirs_seq: Sequence[Path],
             *,
             protect_exclude: re.Pattern|None = None, work_include: re.Pattern|None = None,
             config_files: ConfigFiles|None = None,
+            dir_fds: DirFds|None = None,
+            rate_limiter: RateLimiter|None = None,
+            metrics: MetricsExporter|None = None,
             dry_run: bool,
+            executor: ConcurrentExecutor|None = None,
+            move_engine: MoveEngine|None = None,
+            journal: Journal|None = None,
+            trash: Trash|None = None,
+            event_sink: EventSink = LoggingEventSink(),
             delete_symlinks_instead_of_relinking: bool =False):
         super().__init__(
             protect_dirs_seq=protect_dirs_seq, work_dirs_seq=work_dirs_seq,
             protect_exclude=protect_exclude, work_include=work_include,
-            config_files=config_files)
+            config_files=config_files, dir_fds=dir_fds, rate_limiter=rate_limiter, metrics=metrics)
 
         self.dry_run = dry_run
+        self.executor = executor
+        self.move_engine = move_engine
+        self.journal = journal
+        self.trash = trash
+        self.event_sink = event_sink
         self.delete_symlinks_instead_of_relinking = delete_symlinks_instead_of_relinking
 
+        # Serializes registered operations
+        self._lock = threading.RLock()
+        # Protects plan and counters, which are updated by executor worker threads
+        self._counter_lock = threading.Lock()
+        # The last file system operation submitted to the executor by the current registered operation
+        self._after: Future|None = None
+
         # Holds paths of deleted symlinks
         self.deleted_symlinks: set[str] = set()
 
-        # Set to point to path of original file when 'registered_move' or 'registered_rename' is called during dry_run
+        # The collected symlinks, updated with relinked and deleted symlinks
+        self.symlink_graph = SymlinkGraph(self)
+
+        # Moved or renamed path -> path of the original file or symlink before the first move or rename
         self.moved_from: dict[str, str] = {}
 
+        # The files after the operations done
+        self.overlay = FsOverlay(self)
+
+        # Group updates done when the current registered operation is done, the checks of the operation use the groups before the operation
+        self._group_updates: list[Callable[[], object]] = []
+        # Copy of the groups before the first change during dry_run, see `reset`
+        self._saved_groups: tuple|None = None
+
+        # Number of deleted names per (st_dev, st_ino) of hard linked files
+        self._deleted_hardlinks: dict[tuple[int, int], int] = {}
+
+        # The file system operations done, or which would have been done in dry_run, in order
+        self.plan = Plan()
+
         self.num_deleted = 0
+        self.num_deleted_hardlinks = 0
         self.num_renamed = 0
         self.num_moved = 0
         self.num_relinked = 0
+        self.num_replaced_with_link = 0
 
     def reset(self) -> None:
         """Reset internal housekeeping of deleted/renamed/moved files.
 
         This makes it possible to do a 'dry_run' and an actual run without collecting files again.
+        The groups changed by the operations in a 'dry_run' are restored. The changes by an actual run are kept, as they reflect the files.
         """
 
+        if self._saved_groups:
+            self.must_protect.restore(self._saved_groups[0])
+            self.may_work_on.restore(self._saved_groups[1])
+            self._saved_groups = None
+
         self.deleted_symlinks = set()
+        self.symlink_graph = SymlinkGraph(self)
         self.moved_from = {}
+        self.overlay = FsOverlay(self)
+        self._deleted_hardlinks = {}
+        self.plan = Plan()
+        if self.trash:
+            self.trash.reset()
 
         self.num_deleted = 0
+        self.num_deleted_hardlinks = 0
         self.num_renamed = 0
         self.num_moved = 0
         self.num_relinked = 0
+        self.num_replaced_with_link = 0
+
+    @contextmanager
+    def _registered_operation(self) -> Iterator[None]:
+        """Serialize registered operations, and chain the file system operations of a registered operation when using an executor."""
+        with self._lock:
+            self._after = None
+            try:
+                yield
+            finally:
+                for update in self._group_updates:
+                    update()
+                self._group_updates = []
+
+    def _changing_groups(self) -> None:
+        """Save a copy of the groups before the first change during dry_run."""
+        if self.dry_run and not self._saved_groups:
+            self._saved_groups = (self.must_protect.save(), self.may_work_on.save())
+
+    def _execute(self, kind: OpKind, path: str, target: str|None = None, deleted_entry: DirEntry|None = None) -> None:
+        """Execute file system operation unless dry_run, or submit it to the executor.
+
+        'deleted_entry' is the may_work_on entry of a deleted file, see `_count_deleted_hardlink`.
+        """
+        op = PlannedOp(kind, path, target)
+        journal_seq = self.journal.intend(op) if self.journal else None
+        if self.dry_run:
+            self._done(op, deleted_entry=deleted_entry, journal_seq=None, started=None)
+            return
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        done = partial(self._done, deleted_entry=deleted_entry, journal_seq=journal_seq, started=time.monotonic() if self.metrics else None)
+        if self.executor:
+            self._after = self.executor.submit(op, after=self._after, on_done=done)
+        else:
+            execute_op(op, self.dir_fds, self.move_engine)
+            done(op)
+
+    def _done(self, op: PlannedOp, *, deleted_entry: DirEntry|None, journal_seq: int|None, started: float|None) -> None:
+        """Record a done file system operation in the plan, counters, journal and metrics. Called from executor worker threads."""
+        if self.journal and journal_seq is not None:
+            self.journal.complete(journal_seq)
+        if self.metrics and started is not None:
+            self.metrics.observe('operation', time.monotonic() - started)
+
+        with self._counter_lock:
+            self.plan.add(op)
+            if op.kind in (OpKind.DELETE, OpKind.TRASH):
+                self.num_deleted += 1
+                self._count_deleted_hardlink(op.path, deleted_entry)
+            elif op.kind is OpKind.RENAME:
+                self.num_renamed += 1
+            elif op.kind is OpKind.MOVE:
+                self.num_moved += 1
+            elif op.kind is OpKind.RELINK:
+                self.num_relinked += 1
+            else:
+                self.num_replaced_with_link += 1
 
     def _no_symlink_check_registered_delete(self, delete_path: str) -> None:
         """Does a registered delete without checking for symlinks, so that we can use this in the symlink handling."""
@@ -74,52 +226,78 @@ class FileHandler(FileGroups):
         assert os.path.isabs(delete_path), f"Expected absolute path, got '{delete_path}'"
         assert delete_path not in self.must_protect.files, f"Oops, trying to delete protected file '{delete_path}'."
         assert delete_path not in self.must_protect.symlinks, f"Oops, trying to delete protected symlink '{delete_path}'."
-
-        _LOG.info("    deleting: %s", delete_path)
-        if not self.dry_run:
-            os.unlink(delete_path)
-        self.num_deleted += 1
+        self._delete(delete_path)
+
+    def _delete(self, delete_path: str) -> None:
+        """Delete without any checks."""
+        deleted_entry = self.may_work_on.files.get(delete_path)
+        if self.trash:
+            trash_path = self.trash.trash_path(delete_path)
+            self.event_sink.emit(Event(EventKind.TRASH, delete_path, trash_path))
+            self._execute(OpKind.TRASH, delete_path, trash_path, deleted_entry=deleted_entry)
+        else:
+            self.event_sink.emit(Event(EventKind.DELETE, delete_path))
+            self._execute(OpKind.DELETE, delete_path, deleted_entry=deleted_entry)
 
         if delete_path in self.may_work_on.symlinks:
             self.deleted_symlinks.add(delete_path)
+        self._changing_groups()
+        self._group_updates.append(partial(self._forget, delete_path, self.symlink_graph.points_to.get(delete_path)))
+        self.symlink_graph.remove(delete_path)
+        self.moved_from.pop(delete_path, None)
+        self.overlay.deleted(delete_path)
+
+    def _count_deleted_hardlink(self, delete_path: str, entry: DirEntry|None) -> None:
+        """Count deletes of hard linked files which do not free any space, because other names of the file remain."""
+        if entry is None:
+            return
+
+        st = entry.stat(follow_symlinks=False)
+        if st.st_nlink == 1:
+            return
+
+        inode = (st.st_dev, st.st_ino)
+        num_deleted = self._deleted_hardlinks.get(inode, 0) + 1
+        self._deleted_hardlinks[inode] = num_deleted
+        if num_deleted < st.st_nlink:
+            self.event_sink.emit(Event(EventKind.HARDLINKS_REMAIN, delete_path, detail=st.st_nlink - num_deleted))
+            self.num_deleted_hardlinks += 1
 
     def _handle_single_symlink_chain(self, symlnk_path: str, keep_path: str|FsPath|None) -> None:
-        """TODO doc - Symlink will only be deleted if it is in self.may_work_on.files."""
+        """Relink 'symlnk_path', which points to a deleted or moved file, to 'keep_path', or delete it.
 
-        assert os.path.isabs(symlnk_path), f"Expected an absolute path, got '{symlnk_path}'"
+        Symlink will only be deleted if it is in self.may_work_on.symlinks. When deleting, symlinks in self.may_work_on pointing to the symlink,
+        directly or through other symlinks, are deleted as well.
+        """
 
-        if symlnk_path in self.deleted_symlinks:
-            _LOG.debug("%s previously deleted.", symlnk_path)
-            return
+        assert os.path.isabs(symlnk_path), f"Expected an absolute path, got '{symlnk_path}'"
 
-        points_to = os.readlink(symlnk_path)
-        abs_points_to = os.path.normpath(os.path.join(os.path.dirname(symlnk_path), points_to))
+        # Deleted symlinks are removed from the graph, so 'symlnk_path' has not been deleted
+        abs_points_to = self.symlink_graph.points_to[symlnk_path]
 
         # Check whether symlink points outside our work files
         if abs_points_to not in self.may_work_on.files and abs_points_to not in self.may_work_on.symlinks:
-            _LOG.info("Keeping symlink pointing outside delete-dirs: '%s' -> '%s' (%s)", symlnk_path, points_to, abs_points_to)
+            self.event_sink.emit(Event(EventKind.KEEP_SYMLINK, symlnk_path, abs_points_to))
             return
 
-        _LOG.info("Symlinked: '%s' -> '%s' (%s)", symlnk_path, points_to, abs_points_to)
+        self.event_sink.emit(Event(EventKind.SYMLINKED, symlnk_path, abs_points_to))
 
-        if self.delete_symlinks_instead_of_relinking or not keep_path:
+        in_may_work_on = symlnk_path in self.may_work_on.symlinks
+        if (self.delete_symlinks_instead_of_relinking or not keep_path) and in_may_work_on:
             # Find symlinks to the symlink which we will delete, and delete those as well
-            symlnk_to_symlinks = self.may_work_on.symlinks_by_abs_points_to.get(symlnk_path, [])
-            for symlnk_to_symlink in symlnk_to_symlinks:
-                abs_points_to_symlnk = os.path.normpath(os.path.join(os.path.dirname(symlnk_to_symlink), symlnk_to_symlink))
-                _LOG.info("Symlink to symlink: '%s' (%s).", symlnk_to_symlink, abs_points_to_symlnk)
-                self._handle_single_symlink_chain(abs_points_to_symlnk, keep_path)
+            for symlnk_to_symlink in reversed(self.symlink_graph.dependents(symlnk_path, self.may_work_on.symlinks)):
+                self.event_sink.emit(Event(EventKind.SYMLINK_TO_SYMLINK, symlnk_to_symlink))
+                self._no_symlink_check_registered_delete(symlnk_to_symlink)
 
-        if self.delete_symlinks_instead_of_relinking and (symlnk_path in self.may_work_on.files or symlnk_path in self.may_work_on.symlinks):
+        if self.delete_symlinks_instead_of_relinking and in_may_work_on:
             self._no_symlink_check_registered_delete(symlnk_path)
             return
 
         if not keep_path:
-            if symlnk_path in self.may_work_on.files or symlnk_path in self.may_work_on.symlinks:
+            if in_may_work_on:
                 self._no_symlink_check_registered_delete(symlnk_path)
             else:
-                # TODO, verify message
-                _LOG.info("Created broken symlink '%s' -> '%s'", symlnk_path, points_to)
+                self.event_sink.emit(Event(EventKind.BROKEN_SYMLINK, symlnk_path, abs_points_to))
             return
 
         abs_keep_path = Path(keep_path).absolute()
@@ -133,12 +311,13 @@ class FileHandler(FileGroups):
             except ValueError:
                 keep_path = abs_keep_path
 
-        _LOG.info("Changing symlink: '%s' -> '%s' (was -> %s)", symlnk_path, keep_path, points_to)
-        if not self.dry_run:
-            os.unlink(symlnk_path)
-            os.symlink(keep_path, symlnk_path)
-
-        self.num_relinked += 1
+        self.event_sink.emit(Event(EventKind.RELINK, symlnk_path, os.fspath(keep_path), abs_points_to))
+        self._execute(OpKind.RELINK, symlnk_path, os.fspath(keep_path))
+        self._changing_groups()
+        group = self.may_work_on if in_may_work_on else self.must_protect
+        group.relink(symlnk_path, abs_points_to, str(abs_keep_path), os.fspath(keep_path))
+        self.symlink_graph.relink(symlnk_path, str(abs_keep_path))
+        self.overlay.link_values[symlnk_path] = os.fspath(keep_path)
 
     def _fix_symlinks_to_deleted_or_moved_files(self, from_path: str, to_path: str|FsPath|None) -> None:
         """Any symlinks pointing to 'from_path' will be change to point to 'to_path' or deleted.
@@ -148,18 +327,16 @@ class FileHandler(FileGroups):
 
         _LOG.debug("_fix_symlinks_to_deleted_or_moved_files(self, %s, %s)", from_path, to_path)
 
-        for symlnk in self.must_protect.symlinks_by_abs_points_to.get(from_path, ()):
-            _LOG.debug("_fix_symlinks_to_deleted_or_moved_files, must protect symlink: '%s'.", symlnk)
-            self._handle_single_symlink_chain(os.fspath(symlnk), to_path)
-
-        for symlnk in self.may_work_on.symlinks_by_abs_points_to.get(from_path, ()):
-            _LOG.debug("_fix_symlinks_to_deleted_or_moved_files, may_work_on symlink: '%s'.", symlnk)
-            self._handle_single_symlink_chain(os.fspath(symlnk), to_path)
+        # Copy, handling the symlinks changes the graph
+        for symlnk in list(self.symlink_graph.pointed_to_by.get(from_path, ())):
+            _LOG.debug("_fix_symlinks_to_deleted_or_moved_files, symlink: '%s'.", symlnk)
+            self._handle_single_symlink_chain(symlnk, to_path)
 
     def registered_delete(self, delete_path: str, corresponding_keep_path: str|FsPath|None) -> Path|None:
         """Return `corresponding_keep_path` as absolute Path"""
-        self._no_symlink_check_registered_delete(delete_path)
-        self._fix_symlinks_to_deleted_or_moved_files(delete_path, corresponding_keep_path)
+        with self._registered_operation():
+            self._no_symlink_check_registered_delete(delete_path)
+            self._fix_symlinks_to_deleted_or_moved_files(delete_path, corresponding_keep_path)
         return Path(corresponding_keep_path).absolute() if corresponding_keep_path else None
 
     def _registered_move_or_rename(self, from_path: str, to_path: str|FsPath, *, is_move: bool) -> Path:
@@ -173,24 +350,43 @@ class FileHandler(FileGroups):
         assert abs_tp not in self.must_protect.files, f"Oops, trying to overwrite protected file '{Path(to_path).absolute()}' with '{from_path}'."
         assert abs_tp not in self.must_protect.symlinks, f"Oops, trying to overwrite protected symlink '{to_path}' with '{from_path}'."
 
-        if self.dry_run:
-            self.moved_from[abs_tp] = from_path
+        with self._registered_operation():
+            self._move_or_rename(from_path, to_path, abs_tp, is_move=is_move)
+            self._fix_symlinks_to_deleted_or_moved_files(from_path, to_path)
+        return res
 
-        if is_move:
-            _LOG.info("    moving: %s to %s", from_path, os.fspath(to_path))
-            if not self.dry_run:
-                shutil.move(from_path, to_path)
+    def _move_or_rename(self, from_path: str, to_path: str|FsPath, abs_tp: str, *, is_move: bool) -> None:
+        """Move or rename without any checks."""
+        abs_points_to = self.symlink_graph.points_to.get(from_path)
+        # The link value must be read before the symlink is moved
+        link_value = self.overlay.readlink(from_path) if abs_points_to is not None else None
 
-            self.num_moved += 1
+        if is_move:
+            self.event_sink.emit(Event(EventKind.MOVE, from_path, os.fspath(to_path)))
+            self._execute(OpKind.MOVE, from_path, abs_tp)
         else:
-            _LOG.info("    renaming: %s to %s", from_path, os.fspath(to_path))
-            if not self.dry_run:
-                os.rename(from_path, to_path)
-
-            self.num_renamed += 1
-
-        self._fix_symlinks_to_deleted_or_moved_files(from_path, to_path)
-        return res
+            self.event_sink.emit(Event(EventKind.RENAME, from_path, os.fspath(to_path)))
+            self._execute(OpKind.RENAME, from_path, abs_tp)
+
+        self.moved_from[abs_tp] = self.moved_from.pop(from_path, from_path)
+        self._changing_groups()
+        self._group_updates.append(partial(self._forget, abs_tp, self.symlink_graph.points_to.get(abs_tp)))
+        self.symlink_graph.remove(abs_tp)
+        self.symlink_graph.remove(from_path)
+        self.overlay.moved(from_path, abs_tp, link_value)
+
+        new_abs_points_to = None
+        if link_value is not None and os.path.dirname(abs_tp) in self._dir_groups:
+            new_abs_points_to = os.path.normpath(os.path.join(os.path.dirname(abs_tp), link_value))
+            self.symlink_graph.add(abs_tp, new_abs_points_to)
+        self._group_updates.append(partial(self._move_in_groups, from_path, abs_points_to, abs_tp, new_abs_points_to, link_value))
+
+    def _move_in_groups(  # pylint: disable=too-many-arguments
+            self, from_path: str, abs_points_to: str|None, abs_tp: str, new_abs_points_to: str|None, link_value: str|None) -> None:
+        """Move the entry of a moved or renamed file or symlink in the groups. The points to and link value arguments are for symlinks."""
+        entry = self._forget(from_path, abs_points_to)
+        if entry is not None:
+            self._add_moved(entry, abs_tp, new_abs_points_to, link_value=link_value)
 
     def registered_move(self, from_path: str, to_path: str|FsPath) -> Path:
         """Return `to_path` as absolute Path"""
@@ -200,6 +396,148 @@ class FileHandler(FileGroups):
         """Return `to_path` as absolute Path"""
         return self._registered_move_or_rename(from_path, to_path, is_move=False)
 
+    def registered_replace_with_link(self, replace_path: str, keep_path: str|FsPath, *, reflink: bool = False) -> Path:
+        """Replace file 'replace_path' with a hard link to 'keep_path', or if 'reflink', with a reflink clone of 'keep_path'.
+
+        This frees the space of a duplicate, while keeping it at its path. The file is replaced atomically, see `plan.replace_with_link`.
+        Symlinks to 'replace_path' are not changed.
+
+        Return `keep_path` as absolute Path
+        """
+        assert isinstance(replace_path, str)
+        assert os.path.isabs(replace_path), f"Expected absolute path, got '{replace_path}'"
+        assert replace_path not in self.must_protect.files, f"Oops, trying to replace protected file '{replace_path}'."
+        assert replace_path not in self.must_protect.symlinks, f"Oops, trying to replace protected symlink '{replace_path}'."
+        assert replace_path not in self.may_work_on.symlinks, f"Oops, trying to replace symlink '{replace_path}' with a link."
+        res = Path(keep_path).absolute()
+        abs_kp = str(res)
+
+        with self._registered_operation():
+            self.event_sink.emit(Event(EventKind.REPLACE, replace_path, abs_kp, "reflink" if reflink else "hard link"))
+            self._execute(OpKind.REFLINK if reflink else OpKind.HARDLINK, replace_path, abs_kp)
+
+            keep_entry = self.must_protect.files.get(abs_kp) or self.may_work_on.files.get(abs_kp)
+            if not reflink and keep_entry is not None and replace_path in self.may_work_on.files:
+                # The replaced file is now the same inode as 'keep_path'
+                self._changing_groups()
+                self._group_updates.append(partial(self._replace_in_groups, replace_path, abs_kp))
+        return res
+
+    def _replace_in_groups(self, replace_path: str, abs_kp: str) -> None:
+        """Replace the entry of a file replaced with a hard link to 'abs_kp', and update the link counts of the files."""
+        replaced_entry = self._forget(replace_path, None)
+        keep_entry = self.must_protect.files.get(abs_kp) or self.may_work_on.files.get(abs_kp)
+        assert replaced_entry is not None and keep_entry is not None
+
+        replaced_st = replaced_entry.stat(follow_symlinks=False)
+        keep_st = keep_entry.stat(follow_symlinks=False)
+        if (replaced_st.st_dev, replaced_st.st_ino) == (keep_st.st_dev, keep_st.st_ino):
+            # Already a hard link
+            self._add_moved(replaced_entry, replace_path, None)
+            return
+
+        if replaced_st.st_nlink > 1:
+            # The other names of the replaced file remain
+            self._change_nlink(replaced_entry, -1)
+        self._add_moved(keep_entry, replace_path, None, self._change_nlink(keep_entry, 1))
+
+    @staticmethod
+    def _by_dir(ops: Iterable[tuple[str, _T]]) -> dict[str, list[tuple[str, _T]]]:
+        """Group operations by parent directory of the first path, keeping the order within each directory."""
+        by_dir: dict[str, list[tuple[str, _T]]] = defaultdict(list)
+        for op in ops:
+            assert isinstance(op[0], str)
+            by_dir[os.path.dirname(op[0])].append(op)
+        return by_dir
+
+    def _check_not_protected(self, paths: set[str], what: str) -> None:
+        """Check a set of absolute paths against the protected files and symlinks."""
+        not_abs = [path for path in paths if not os.path.isabs(path)]
+        assert not not_abs, f"Expected absolute paths, got {not_abs}"
+        protected = paths & self.must_protect.files.keys() | paths & self.must_protect.symlinks.keys()
+        assert not protected, f"Oops, trying to {what} protected files or symlinks {sorted(protected)}."
+
+    def registered_delete_many(self, deletes: Iterable[tuple[str, str|FsPath|None]]) -> BatchResult:
+        """Bulk version of `registered_delete`, taking (delete_path, corresponding_keep_path) pairs.
+
+        The deletes are grouped by directory, and done one directory at a time, in the order of the first delete in each directory.
+        All paths are checked against protected files before anything is deleted.
+        A failing delete does not stop the other deletes, the error is recorded in the returned `BatchResult`.
+        With an executor, `BatchResult.num_done` is the number of submitted operations, and failures are recorded in the executor.
+        """
+        by_dir = self._by_dir(deletes)
+        delete_paths = {path for batch in by_dir.values() for path, _ in batch}
+        self._check_not_protected(delete_paths, "delete")
+
+        res = BatchResult()
+        with self._lock:
+            for batch in by_dir.values():
+                for delete_path, keep_path in batch:
+                    with self._registered_operation():
+                        try:
+                            self._delete(delete_path)
+                        except OSError as ex:
+                            _LOG.warning("Failed to delete '%s': %s", delete_path, ex)
+                            res.failed[delete_path] = ex
+                            continue
+
+                        res.num_done += 1
+                        # Symlinks may have been relinked to 'delete_path' by an earlier operation in the batch
+                        self._fix_symlinks_to_deleted_or_moved_files(delete_path, keep_path)
+                res.num_dirs += 1
+
+        return res
+
+    def _registered_move_or_rename_many(self, moves: Iterable[tuple[str, str|FsPath]], *, is_move: bool) -> BatchResult:
+        by_dir = self._by_dir(moves)
+        from_paths = {path for batch in by_dir.values() for path, _ in batch}
+        to_paths = {batch_op[0]: str(Path(batch_op[1]).absolute()) for batch in by_dir.values() for batch_op in batch}
+        self._check_not_protected(from_paths, "move/rename")
+        self._check_not_protected(set(to_paths.values()), "overwrite")
+
+        res = BatchResult()
+        with self._lock:
+            for batch in by_dir.values():
+                for from_path, to_path in batch:
+                    with self._registered_operation():
+                        try:
+                            self._move_or_rename(from_path, to_path, to_paths[from_path], is_move=is_move)
+                        except OSError as ex:
+                            _LOG.warning("Failed to %s '%s' to '%s': %s", "move" if is_move else "rename", from_path, to_path, ex)
+                            res.failed[from_path] = ex
+                            continue
+
+                        res.num_done += 1
+                        self._fix_symlinks_to_deleted_or_moved_files(from_path, to_path)
+                res.num_dirs += 1
+
+        return res
+
+    def registered_move_many(self, moves: Iterable[tuple[str, str|FsPath]]) -> BatchResult:
+        """Bulk version of `registered_move`, taking (from_path, to_path) pairs. See `registered_delete_many`.
+
+        Moves are grouped by the directory of 'from_path'.
+        """
+        return self._registered_move_or_rename_many(moves, is_move=True)
+
+    def registered_rename_many(self, renames: Iterable[tuple[str, str|FsPath]]) -> BatchResult:
+        """Bulk version of `registered_rename`, taking (from_path, to_path) pairs. See `registered_delete_many`."""
+        return self._registered_move_or_rename_many(renames, is_move=False)
+
+    def stats_counts(self) -> dict[str, int]:
+        """Extend `FileGroups.stats_counts` with the operation numbers logged by `stats`, which are planned numbers in dry_run."""
+        counts = super().stats_counts()
+        counts.update({
+            "dry_run": int(self.dry_run),
+            "deleted": self.num_deleted,
+            "deleted_hardlinks": self.num_deleted_hardlinks,
+            "renamed": self.num_renamed,
+            "moved": self.num_moved,
+            "relinked": self.num_relinked,
+            "replaced_with_link": self.num_replaced_with_link,
+        })
+        return counts
+
     def stats(self) -> None:
         log = _LOG.getChild("stats")
         lvl = logging.INFO
@@ -216,6 +554,10 @@ class FileHandler(FileGroups):
         super().stats()
         log.log(lvl, "")
         log.log(lvl, "%sdeleted: %s", prefix, self.num_deleted)
+        log.log(lvl, "%sdeleted hard links (no space freed): %s", prefix, self.num_deleted_hardlinks)
         log.log(lvl, "%srenamed: %s", prefix, self.num_renamed)
         log.log(lvl, "%smoved: %s", prefix, self.num_moved)
         log.log(lvl, "%srelinked: %s", prefix, self.num_relinked)
+        log.log(lvl, "%sreplaced with link: %s", prefix, self.num_replaced_with_link)
+        if self.move_engine:
+            self.move_engine.stats()
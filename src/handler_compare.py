@@ -1,13 +1,22 @@
 import os
 from pathlib import Path
 import re
+import time
 import logging
-from typing import Sequence
+from typing import Sequence, Iterable, Iterator
 
-from .compare_files import CompareFiles
+from .compare_files import CompareFiles, ComparePair, CompareResult, compare_concurrently
 from .types import FsPath
 from .handler import FileHandler
+from .executor import ConcurrentExecutor
+from .journal import Journal
+from .move_engine import MoveEngine
+from .trash import Trash
+from .rate_limiter import RateLimiter
 from .config_files import ConfigFiles
+from .dir_fds import DirFds
+from .events import EventKind, Event, EventSink, LoggingEventSink
+from .metrics import MetricsExporter
 
 
 _LOG = logging.getLogger(__name__)
@@ -17,44 +26,88 @@ class FileHandlerCompare(FileHandler):
     """Extend `FileHandler` with a compare method
 
     Arguments:
-        protect_dirs_seq, work_dirs_seq, protect_exclude, work_include, config_files: See `FileGroups` class.
-        dry_run, protected_regexes, delete_symlinks_instead_of_relinking: See `FileHandler` class.
+        protect_dirs_seq, work_dirs_seq, protect_exclude, work_include, config_files, dir_fds, rate_limiter, metrics: See `FileGroups` class.
+            If 'metrics' is not None, the time of `compare` is also observed in the 'compare' histogram.
+        dry_run, executor, move_engine, journal, trash, event_sink, delete_symlinks_instead_of_relinking: See `FileHandler` class.
         fcmp: Object providing compare function.
     """
 
-    def __init__(  # pylint: disable=too-many-arguments
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
             self,
             protect_dirs_seq: Sequence[Path], work_dirs_seq: Sequence[Path], fcmp: CompareFiles,
             *,
             protect_exclude: re.Pattern|None = None, work_include: re.Pattern|None = None,
             config_files: ConfigFiles|None = None,
+            dir_fds: DirFds|None = None,
+            rate_limiter: RateLimiter|None = None,
+            metrics: MetricsExporter|None = None,
             dry_run: bool,
+            executor: ConcurrentExecutor|None = None,
+            move_engine: MoveEngine|None = None,
+            journal: Journal|None = None,
+            trash: Trash|None = None,
+            event_sink: EventSink = LoggingEventSink(),
             delete_symlinks_instead_of_relinking: bool = False):
         super().__init__(
             protect_dirs_seq=protect_dirs_seq, work_dirs_seq=work_dirs_seq,
             protect_exclude=protect_exclude, work_include=work_include,
-            config_files=config_files,
+            config_files=config_files, dir_fds=dir_fds, rate_limiter=rate_limiter, metrics=metrics,
             dry_run=dry_run,
+            executor=executor,
+            move_engine=move_engine,
+            journal=journal,
+            trash=trash,
+            event_sink=event_sink,
             delete_symlinks_instead_of_relinking=delete_symlinks_instead_of_relinking)
 
         self._fcmp = fcmp
 
+    def _same_inode(self, fsp1: FsPath, fsp2: FsPath) -> bool:
+        """Use the stat information recorded during collect to check if 'fsp1' and 'fsp2' are hard links to the same inode."""
+        abs_fsp1 = os.path.abspath(fsp1)
+        abs_fsp2 = os.path.abspath(fsp2)
+        entry1 = self.may_work_on.files.get(abs_fsp1) or self.must_protect.files.get(abs_fsp1)
+        entry2 = self.may_work_on.files.get(abs_fsp2) or self.must_protect.files.get(abs_fsp2)
+        if entry1 is None or entry2 is None:
+            return False
+
+        st1 = entry1.stat(follow_symlinks=False)
+        st2 = entry2.stat(follow_symlinks=False)
+        return st1.st_nlink > 1 and st1.st_ino == st2.st_ino and st1.st_dev == st2.st_dev
+
     def compare(self, fsp1: FsPath, fsp2: FsPath) -> bool:
-        """Extends CompareFiles.compare with logic to handle 'renamed/moved' files during dry_run."""
+        """Extends CompareFiles.compare with logic to handle 'renamed/moved' files during dry_run, using `overlay.real_path`.
 
-        if not self.dry_run:
-            if self._fcmp.compare(fsp1, fsp2):
-                _LOG.info("Duplicates: '%s' '%s'", fsp1, fsp2)
-                return True
+        Hard links to the same inode are known from the collect and are considered duplicates without calling the `CompareFiles` object.
+        Raises FileNotFoundError if 'fsp1' or 'fsp2' has been deleted or moved away, also during dry_run.
+        """
 
-            return False
+        real_fsp1 = self.overlay.real_path(fsp1)
+        real_fsp2 = self.overlay.real_path(fsp2)
+        if real_fsp1 is None:
+            raise FileNotFoundError(f"'{fsp1}' has been deleted or moved away.")
+        if real_fsp2 is None:
+            raise FileNotFoundError(f"'{fsp2}' has been deleted or moved away.")
 
-        fsp1_abs = str(Path(fsp1).absolute())
-        existing_fsp1 = Path(self.moved_from.get(os.fspath(fsp1_abs), fsp1))
-        fsp2_abs = str(Path(fsp2).absolute())
-        existing_fsp2 = Path(self.moved_from.get(os.fspath(fsp2_abs), fsp2))
-        if self._fcmp.compare(existing_fsp1, existing_fsp2):
-            _LOG.info("Duplicates: '%s' '%s'", fsp1, fsp2)
+        if self._same_inode(fsp1, fsp2):
+            self.event_sink.emit(Event(EventKind.DUPLICATE_HARDLINK, fsp1, fsp2))
+            return True
+
+        start = time.monotonic()
+        same = self._fcmp.compare(Path(real_fsp1), Path(real_fsp2))
+        if self.metrics:
+            self.metrics.observe('compare', time.monotonic() - start)
+
+        if same:
+            self.event_sink.emit(Event(EventKind.DUPLICATE, fsp1, fsp2))
             return True
 
         return False
+
+    def compare_many(self, pairs: Iterable[ComparePair], *, max_workers: int = 8, ordered: bool = True) -> Iterator[CompareResult]:
+        """Call `compare` concurrently on a bounded thread pool for each pair, yielding (fsp1, fsp2, result).
+
+        The dry_run redirection is applied as in `compare`. Note that comparisons are started ahead of the consumer of the iterator,
+        so a move or rename registered while iterating is not seen by pairs already queued. See `compare_files.compare_concurrently`.
+        """
+        return compare_concurrently(self.compare, pairs, max_workers=max_workers, ordered=ordered)
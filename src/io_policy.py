@@ -0,0 +1,85 @@
+import os
+import logging
+from contextlib import contextmanager
+from typing import Iterator, IO
+
+from .types import FsPath
+from .rate_limiter import RateLimiter
+
+
+_LOG = logging.getLogger(__name__)
+
+_HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+class IoPolicy():
+    """Page cache aware reading of files for comparison and hashing.
+
+    Uses `os.posix_fadvise` where available, so that a scan does not evict the cached data of other processes, and read ahead is increased.
+    Note that dropping the cache of a file also drops pages of the file which were cached before it was read.
+
+    Arguments:
+        sequential: Advise that opened files are read sequentially (POSIX_FADV_SEQUENTIAL).
+        prefetch_size: Advise that the first 'prefetch_size' bytes of files queued for reading will be needed (POSIX_FADV_WILLNEED). Zero disables.
+        drop_cache: Advise that the data of a file is not needed when reading is done (POSIX_FADV_DONTNEED).
+        max_bytes_per_sec: Aggregate limit for bytes read by all users of this policy. None means no limit.
+            Up to one second worth of bytes may be read in a burst.
+        rate_limiter: Limiter of bytes read, shared with other users, e.g. `FileHandler` operations. Can't be combined with 'max_bytes_per_sec'.
+    """
+
+    def __init__(
+            self,
+            *,
+            sequential: bool = True,
+            prefetch_size: int = 8 * 1024 * 1024,
+            drop_cache: bool = True,
+            max_bytes_per_sec: int|None = None,
+            rate_limiter: RateLimiter|None = None):
+        assert not (max_bytes_per_sec and rate_limiter), "Only one of 'max_bytes_per_sec' and 'rate_limiter' may be specified."
+        self.sequential = sequential
+        self.prefetch_size = prefetch_size
+        self.drop_cache = drop_cache
+        self.rate_limiter = rate_limiter or (RateLimiter(bytes_per_sec=max_bytes_per_sec) if max_bytes_per_sec else None)
+
+    def start(self, fd: int) -> None:
+        """Advise about reading of a file which is about to be read."""
+        if not _HAS_FADVISE:  # pragma: no cover
+            return
+
+        if self.sequential:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if self.prefetch_size:
+            os.posix_fadvise(fd, 0, self.prefetch_size, os.POSIX_FADV_WILLNEED)
+
+    def done(self, fd: int) -> None:
+        """Advise that the data of a file which has been read is no longer needed."""
+        if _HAS_FADVISE and self.drop_cache:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def prefetch(self, fsp: FsPath) -> None:
+        """Start read ahead of a file queued for reading."""
+        if not (_HAS_FADVISE and self.prefetch_size):
+            return
+
+        fd = os.open(fsp, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, self.prefetch_size, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def reading(self, *files: IO[bytes]) -> Iterator[None]:
+        """Context manager calling `start` for 'files' on enter and `done` on exit."""
+        for ff in files:
+            self.start(ff.fileno())
+        try:
+            yield
+        finally:
+            for ff in files:
+                if not ff.closed:
+                    self.done(ff.fileno())
+
+    def consume(self, num_bytes: int) -> None:
+        """Register that 'num_bytes' have been read, and sleep if needed to keep within the bytes rate."""
+        if self.rate_limiter:
+            self.rate_limiter.acquire(num_ops=0, num_bytes=num_bytes)
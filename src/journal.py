@@ -0,0 +1,152 @@
+import os
+from pathlib import Path
+import json
+import threading
+import logging
+from typing import Any
+
+from .plan import OpKind, PlannedOp, execute_op
+from .dir_fds import DirFds
+from .move_engine import MoveEngine
+
+
+_LOG = logging.getLogger(__name__)
+
+
+class Journal():
+    """Append only write ahead journal of file system operations, one JSON object per line.
+
+    An operation is written to the journal as intended before it is executed, and marked as completed when it is done.
+    Each record is flushed to the OS when written, so records are not lost if the process is killed. The journal file is synced to disk
+    for every 'sync_every' records, and when closed, so a crash of the OS may lose the last records.
+
+    An existing journal is loaded, and new records are appended. `resume` executes the intended operations which are not completed, e.g.
+    after a killed run, or operations planned during a dry run.
+
+    Arguments:
+        path: The journal file.
+        sync_every: Number of records written between syncs of the journal file.
+    """
+
+    def __init__(self, path: Path|str, *, sync_every: int = 100):
+        self.path = Path(path)
+        self.sync_every = sync_every
+
+        # Intended operations, index is the sequence number
+        self.ops: list[PlannedOp] = []
+        self.completed: set[int] = set()
+        if self.path.exists():
+            self._load()
+
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+        self._num_unsynced = 0
+        self.num_syncs = 0
+
+    def __enter__(self) -> 'Journal':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _load(self) -> None:
+        with open(self.path, encoding='utf-8') as jf:
+            lines = jf.readlines()
+
+        for line_no, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if line_no == len(lines):
+                    # Partially written when the process was killed
+                    _LOG.warning("Ignoring incomplete last record in journal '%s': %s", self.path, line.rstrip())
+                    break
+                raise
+
+            if "done" in record:
+                self.completed.add(record["done"])
+                continue
+
+            assert record["seq"] == len(self.ops), f"Oops, unexpected sequence number in journal '{self.path}' line {line_no}: {record['seq']}."
+            self.ops.append(PlannedOp(OpKind(record["kind"]), record["path"], record["target"]))
+
+        _LOG.info("Loaded journal '%s', %s operations, %s completed", self.path, len(self.ops), len(self.completed))
+
+    def _write(self, record: dict[str, Any]) -> None:
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self._num_unsynced += 1
+        if self._num_unsynced >= self.sync_every:
+            self._sync()
+
+    def _sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._num_unsynced = 0
+        self.num_syncs += 1
+
+    def intend(self, op: PlannedOp) -> int:
+        """Record 'op' as intended, return the sequence number to pass to `complete`."""
+        with self._lock:
+            seq = len(self.ops)
+            self.ops.append(op)
+            self._write({"seq": seq, "kind": op.kind.value, "path": op.path, "target": op.target})
+        return seq
+
+    def complete(self, seq: int) -> None:
+        """Record operation number 'seq' as completed."""
+        with self._lock:
+            self.completed.add(seq)
+            self._write({"done": seq})
+
+    def pending(self) -> list[int]:
+        """Return sequence numbers of intended operations which are not completed, in order."""
+        return [seq for seq in range(len(self.ops)) if seq not in self.completed]
+
+    @staticmethod
+    def _is_done(op: PlannedOp) -> bool:
+        """Check whether an operation, which may have been interrupted, has been done."""
+        if op.kind is OpKind.DELETE:
+            return not os.path.lexists(op.path)
+        if op.kind is OpKind.RELINK:
+            return os.path.islink(op.path) and os.readlink(op.path) == op.target
+        if op.kind is OpKind.HARDLINK:
+            assert op.target is not None
+            return os.path.samefile(op.path, op.target)
+        if op.kind is OpKind.REFLINK:
+            # Can't be checked, but doing it again is harmless
+            return False
+        assert op.target is not None
+        return not os.path.lexists(op.path) and os.path.lexists(op.target)
+
+    def resume(self, dir_fds: DirFds|None = None, move_engine: MoveEngine|None = None) -> int:
+        """Execute the operations which are not completed, in order, and return the number executed.
+
+        Operations which have been done, but not recorded as completed, are recorded as completed without executing them.
+        A relink, where the symlink was deleted but not created, is finished.
+        See `plan.execute_op` for 'dir_fds' and 'move_engine'.
+        """
+        num_executed = 0
+        for seq in self.pending():
+            op = self.ops[seq]
+            if self._is_done(op):
+                _LOG.info("Already done: %s", op)
+            elif op.kind is OpKind.RELINK and not os.path.lexists(op.path):
+                _LOG.info("Finishing: %s", op)
+                assert op.target is not None
+                os.symlink(op.target, op.path)
+                num_executed += 1
+            else:
+                _LOG.debug("Executing: %s", op)
+                execute_op(op, dir_fds, move_engine)
+                num_executed += 1
+            self.complete(seq)
+
+        return num_executed
+
+    def close(self) -> None:
+        """Sync and close the journal file."""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._sync()
+            self._file.close()
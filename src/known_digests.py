@@ -0,0 +1,241 @@
+import os
+import errno
+import hashlib
+import threading
+import logging
+from typing import Sequence
+
+from .types import FsPath
+
+
+_LOG = logging.getLogger(__name__)
+
+_HAS_XATTR = hasattr(os, 'getxattr')
+
+# Errors meaning that extended attributes are not supported or not allowed
+_XATTR_UNAVAILABLE = {errno.ENOTSUP, errno.EPERM, errno.EACCES, errno.EROFS}
+
+# Hash algorithms for which different content with equal digests can be crafted
+WEAK_HASH_NAMES = frozenset(('md5', 'sha1'))
+
+# Manifest name -> hash name, for manifests in the format of e.g. 'sha256sum' output, which are not named after the hash.
+DEFAULT_MANIFEST_NAMES = {
+    "MD5SUMS": "md5",
+    "SHA1SUMS": "sha1",
+    "SHA256SUMS": "sha256",
+    "SHA512SUMS": "sha512",
+}
+
+# Digest and mtime_ns of the sidecar or manifest file it was read from
+_SidecarDigest = tuple[bytes, int]
+
+
+def _parse_digest(value: bytes, hash_name: str) -> bytes|None:
+    """Accept both raw and hex encoded digests."""
+    digest_size = hashlib.new(hash_name).digest_size
+    if len(value) == digest_size:
+        return value
+
+    try:
+        digest = bytes.fromhex(value.decode('ascii').strip())
+    except ValueError:
+        return None
+
+    return digest if len(digest) == digest_size else None
+
+
+class KnownDigests():
+    """Look up pre-computed digests of files in extended attributes and checksum sidecar files, so that files need not be read.
+
+    Sources, in order:
+
+        Extended attribute 'user.<hash_name>', e.g. 'user.sha256', raw or hex encoded.
+            The digest is only trusted if there is also a 'user.<hash_name>.mtime_ns' attribute equal to the st_mtime_ns of the file,
+            unless 'trust_bare_xattr'.
+
+        Sidecar files in the same directory as the file, named '<file name>.<hash_name>', e.g. 'IMG_1234.jpg.sha256',
+        and manifest files named '*.<hash_name>' or one of 'manifest_names', e.g. 'SHA256SUMS'.
+            The format is the output of e.g. 'sha256sum', '<hex digest>  <file name>' lines. A sidecar may also contain only the digest.
+            A sidecar or manifest is stale, and not used, if it is older (by mtime) than the file.
+
+    Sidecar and manifest files are read once per directory.
+
+    Files with equal known digests are considered duplicates by `CompareFiles` without comparing the content, and may then be deleted.
+    A wrong digest therefore means loss of data. An extended attribute without the mtime_ns is not updated by tools modifying the file,
+    and for the `WEAK_HASH_NAMES`, e.g. md5, files with different content and equal digests can be crafted. Only enable 'trust_bare_xattr'
+    or weak hash algorithms in 'hash_names' for files where this is not a concern. A warning is logged for weak hash algorithms.
+
+    Arguments:
+        hash_names: Hash algorithms to look for, in order of preference.
+        manifest_names: Map of manifest file name to hash name, for manifests not named '*.<hash_name>'.
+        write_xattr: Store digests passed to `store` as extended attributes, together with the mtime_ns of the file.
+        trust_bare_xattr: Trust digest extended attributes without a 'user.<hash_name>.mtime_ns' attribute, see above.
+    """
+
+    def __init__(
+            self,
+            *,
+            hash_names: Sequence[str] = ('sha256',),
+            manifest_names: dict[str, str]|None = None,
+            write_xattr: bool = False,
+            trust_bare_xattr: bool = False):
+        self.hash_names = hash_names
+        self.manifest_names = DEFAULT_MANIFEST_NAMES if manifest_names is None else manifest_names
+        self.write_xattr = write_xattr
+        self.trust_bare_xattr = trust_bare_xattr
+
+        weak_hash_names = [hash_name for hash_name in hash_names if hash_name in WEAK_HASH_NAMES]
+        if weak_hash_names:
+            _LOG.warning("Files with equal %s digests are considered duplicates without comparing the content", ", ".join(weak_hash_names))
+
+        self._lock = threading.Lock()
+        # Directory -> hash name -> file name -> digest
+        self._sidecars: dict[str, dict[str, dict[str, _SidecarDigest]]] = {}
+
+        self.num_xattr_found = 0
+        self.num_sidecar_found = 0
+        self.num_stale = 0
+        self.num_untrusted = 0
+        self.num_xattr_written = 0
+
+    def _xattr_digest(self, path: str, st: os.stat_result, hash_name: str) -> bytes|None:
+        if not _HAS_XATTR:  # pragma: no cover
+            return None
+
+        attr = f"user.{hash_name}"
+        try:
+            value = os.getxattr(path, attr)
+        except OSError as ex:
+            if ex.errno == errno.ENODATA or ex.errno in _XATTR_UNAVAILABLE:
+                return None
+            raise
+
+        try:
+            mtime_ns = int(os.getxattr(path, f"{attr}.mtime_ns"))
+        except OSError:
+            mtime_ns = None
+        except ValueError:
+            mtime_ns = -1
+
+        if mtime_ns is None:
+            if not self.trust_bare_xattr:
+                _LOG.debug("Not trusting xattr %s without mtime_ns on '%s'", attr, path)
+                self.num_untrusted += 1
+                return None
+        elif mtime_ns != st.st_mtime_ns:
+            _LOG.debug("Stale xattr %s on '%s'", attr, path)
+            self.num_stale += 1
+            return None
+
+        return _parse_digest(value, hash_name)
+
+    def _parse_sidecar(self, sidecar_path: str, sidecar_name: str, hash_name: str, digests: dict[str, _SidecarDigest]) -> None:
+        try:
+            with open(sidecar_path, 'rb') as ff:
+                content = ff.read()
+            mtime_ns = os.stat(sidecar_path).st_mtime_ns
+        except OSError as ex:
+            _LOG.debug("Could not read '%s': %s", sidecar_path, ex)
+            return
+
+        for line in content.splitlines():
+            hex_digest, _, name = line.decode(errors='replace').strip().partition(' ')
+            name = name.strip().lstrip('*')
+            if not name:
+                # Sidecar with only the digest, named after the file
+                name = sidecar_name.removesuffix('.' + hash_name)
+            digest = _parse_digest(hex_digest.encode(), hash_name)
+            if digest:
+                digests[name] = (digest, mtime_ns)
+
+    def _dir_sidecars(self, dir_path: str) -> dict[str, dict[str, _SidecarDigest]]:
+        with self._lock:
+            sidecars = self._sidecars.get(dir_path)
+            if sidecars is not None:
+                return sidecars
+
+            sidecars = {hash_name: {} for hash_name in self.hash_names}
+            try:
+                entries = list(os.scandir(dir_path))
+            except OSError:
+                entries = []
+
+            for entry in entries:
+                hash_name = self.manifest_names.get(entry.name) or entry.name.rpartition('.')[2]
+                if hash_name in sidecars and entry.is_file():
+                    self._parse_sidecar(entry.path, entry.name, hash_name, sidecars[hash_name])
+
+            self._sidecars[dir_path] = sidecars
+            return sidecars
+
+    def _sidecar_digest(self, path: str, st: os.stat_result, hash_name: str) -> bytes|None:
+        dir_path, name = os.path.split(path)
+        found = self._dir_sidecars(dir_path).get(hash_name, {}).get(name)
+        if found is None:
+            return None
+
+        digest, mtime_ns = found
+        if mtime_ns < st.st_mtime_ns:
+            _LOG.debug("Stale %s sidecar for '%s'", hash_name, path)
+            self.num_stale += 1
+            return None
+
+        return digest
+
+    def get(self, fsp: FsPath, hash_name: str, st: os.stat_result|None = None) -> bytes|None:
+        """Return the known 'hash_name' digest of 'fsp' or None if not known or stale. 'st' is the stat result of 'fsp', if already known."""
+        path = os.path.abspath(fsp)
+        st = st or os.stat(path)
+
+        digest = self._xattr_digest(path, st, hash_name)
+        if digest is not None:
+            self.num_xattr_found += 1
+            return digest
+
+        digest = self._sidecar_digest(path, st, hash_name)
+        if digest is not None:
+            self.num_sidecar_found += 1
+        return digest
+
+    def lookup(self, fsp: FsPath, st: os.stat_result|None = None) -> tuple[str, bytes]|None:
+        """Return (hash_name, digest) for the first of 'hash_names' with a known digest for 'fsp', or None."""
+        for hash_name in self.hash_names:
+            digest = self.get(fsp, hash_name, st)
+            if digest is not None:
+                return hash_name, digest
+        return None
+
+    def compare(self, fsp1: FsPath, fsp2: FsPath, st1: os.stat_result|None = None, st2: os.stat_result|None = None) -> bool|None:
+        """Compare known digests of two files. Return None if there is no hash algorithm with a known digest for both files.
+
+        'st1' and 'st2' are the stat results of the files, if already known.
+        """
+        st1 = st1 or os.stat(fsp1)
+        st2 = st2 or os.stat(fsp2)
+        for hash_name in self.hash_names:
+            digest1 = self.get(fsp1, hash_name, st1)
+            if digest1 is None:
+                continue
+            digest2 = self.get(fsp2, hash_name, st2)
+            if digest2 is not None:
+                return digest1 == digest2
+        return None
+
+    def store(self, fsp: FsPath, hash_name: str, digest: bytes, st: os.stat_result) -> None:
+        """Store a computed digest of 'fsp' with stat result 'st' (from before the digest was computed) as extended attributes, if 'write_xattr'.
+
+        Errors are logged and ignored.
+        """
+        if not (self.write_xattr and _HAS_XATTR):
+            return
+
+        path = os.path.abspath(fsp)
+        try:
+            if os.stat(path).st_mtime_ns != st.st_mtime_ns:
+                _LOG.debug("Not storing digest of '%s', file modified while hashing", path)
+                return
+            os.setxattr(path, f"user.{hash_name}", digest.hex().encode())
+            os.setxattr(path, f"user.{hash_name}.mtime_ns", str(st.st_mtime_ns).encode())
+            self.num_xattr_written += 1
+        except OSError as ex:
+            _LOG.debug("Could not store digest of '%s' as xattr: %s", path, ex)
@@ -0,0 +1,156 @@
+import os
+import math
+import time
+import tempfile
+import threading
+import logging
+from pathlib import Path
+from typing import Any, Protocol, Sequence
+
+
+_LOG = logging.getLogger(__name__)
+
+# Seconds
+DEFAULT_BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, 100.0)
+
+
+class StatsCounts(Protocol):  # pylint: disable=too-few-public-methods
+    """Provider of counts, e.g. `FileGroups` and `FileHandler`."""
+
+    def stats_counts(self) -> dict[str, int]:
+        """Return name -> count."""
+
+
+class Histogram():
+    """Thread safe histogram of observed values, with cumulative bucket counts as in OpenMetrics.
+
+    Arguments:
+        buckets: Increasing upper bounds of the buckets. A bucket for +Inf is added.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._lock = threading.Lock()
+        self.bucket_counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add 'value' to the histogram."""
+        with self._lock:
+            for index, upper in enumerate(self.buckets):
+                if value <= upper:
+                    self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def lines(self, name: str) -> list[str]:
+        """Return OpenMetrics text lines for histogram 'name'."""
+        with self._lock:
+            lines = [f"# TYPE {name} histogram"]
+            for upper, num in zip(self.buckets, self.bucket_counts):
+                lines.append(f'{name}_bucket{{le="{_format_float(upper)}"}} {num}')
+            lines.append(f"{name}_sum {_format_float(self.sum)}")
+            lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+def _format_float(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(float(value))
+
+
+class MetricsExporter():
+    """Write counts and timing histograms to a file in OpenMetrics text format, e.g. for the node_exporter textfile collector.
+
+    The counts are the `stats_counts` of the sources added with `add`, as gauges named '<prefix>_<count name>'.
+    The histograms '<prefix>_<name>_seconds' are 'scan' (collect of each protect or work directory), 'compare' (`FileHandlerCompare.compare`)
+    and 'operation' (file system operations done by `FileHandler`, with an executor including the time queued).
+
+    The file is written atomically, by renaming a completely written temporary file in the same directory. When used as a context manager,
+    the file is written every 'interval' seconds by a background thread, and when the context is exited.
+
+    Arguments:
+        path: The metrics file, e.g. '<textfile collector directory>/file_groups.prom'.
+        interval: Seconds between writes when used as a context manager. None means only write on exit.
+        prefix: Prefix of metric names.
+        buckets: Upper bounds, in seconds, of the histogram buckets.
+    """
+
+    HISTOGRAMS = ('scan', 'compare', 'operation')
+
+    def __init__(self, path: Path|str, *, interval: float|None = 60.0, prefix: str = 'file_groups', buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.path = Path(path)
+        self.interval = interval
+        self.prefix = prefix
+        self.histograms = {name: Histogram(buckets) for name in self.HISTOGRAMS}
+        self.sources: list[StatsCounts] = []
+
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread|None = None
+        self.num_writes = 0
+
+    def __enter__(self) -> 'MetricsExporter':
+        if self.interval:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._write_periodically, args=(self.interval,), name="metrics", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def _write_periodically(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.write()
+            except OSError as ex:
+                _LOG.warning("Failed to write metrics to '%s': %s", self.path, ex)
+
+    def add(self, source: StatsCounts) -> None:
+        """Add a source of counts."""
+        self.sources.append(source)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Add 'seconds' to histogram 'name', see class description."""
+        self.histograms[name].observe(seconds)
+
+    def text(self) -> str:
+        """Return the metrics in OpenMetrics text format."""
+        lines = []
+        for source in self.sources:
+            for count_name, num in source.stats_counts().items():
+                name = f"{self.prefix}_{count_name}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {num}")
+
+        for hist_name, hist in self.histograms.items():
+            lines.extend(hist.lines(f"{self.prefix}_{hist_name}_seconds"))
+
+        name = f"{self.prefix}_export_timestamp_seconds"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_float(time.time())}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        """Write the metrics file atomically."""
+        text = self.text()
+        with self._write_lock:
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp", dir=self.path.parent)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as ff:
+                    ff.write(text)
+                    ff.flush()
+                    os.fsync(ff.fileno())
+                # mkstemp creates the file readable only by the owner
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self.num_writes += 1
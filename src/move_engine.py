@@ -0,0 +1,167 @@
+import os
+import errno
+import hashlib
+import shutil
+import tempfile
+import time
+import threading
+import logging
+from typing import Callable
+
+from .io_policy import IoPolicy
+
+
+_LOG = logging.getLogger(__name__)
+
+_HAS_COPY_FILE_RANGE = hasattr(os, 'copy_file_range')
+_HAS_SENDFILE = hasattr(os, 'sendfile')
+
+# Errors from copy_file_range meaning that it can not be used for the files, e.g. across file systems on older kernels
+_COPY_FILE_RANGE_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
+
+
+class MoveEngine():
+    """Move files by renaming, or by copying in the kernel and deleting the source when moving across file systems.
+
+    Data is copied with `os.copy_file_range` where available, falling back to `os.sendfile`. The copy is written to a temporary file in the
+    destination directory, which is renamed to the destination when the copy is complete, so an interrupted copy never leaves a partial
+    destination file. Permission bits, times and extended attributes are copied as by `shutil.copystat`. The ownership is not changed.
+
+    Symlinks are recreated with the same value. Directories are moved by `shutil.move`.
+
+    Arguments:
+        verify: Before deleting the source, compare size and 'hash_name' digest of the copy with the source. If they differ the copy is
+            deleted and an OSError (EIO) is raised.
+        hash_name: Name of `hashlib` algorithm used for verification.
+        chunk_size: Maximum number of bytes copied per system call.
+        io_policy: If not None, the copied bytes are throttled and the page cache advised as for reading files for comparison.
+        progress: If not None, called with (path, bytes copied, size) after each copied chunk.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            *,
+            verify: bool = False,
+            hash_name: str = 'sha256',
+            chunk_size: int = 64 * 1024 * 1024,
+            io_policy: IoPolicy|None = None,
+            progress: Callable[[str, int, int], None]|None = None):
+        self.verify = verify
+        self.hash_name = hash_name
+        self.chunk_size = chunk_size
+        self.io_policy = io_policy
+        self.progress = progress
+
+        self._lock = threading.Lock()
+        self.num_renamed = 0
+        self.num_copied = 0
+        self.num_bytes_copied = 0
+        self.copy_seconds = 0.0
+
+    def move(self, src: str, dst: str) -> None:
+        """Move 'src' to 'dst'. If 'dst' is a directory, 'src' is moved into it, as by `shutil.move`."""
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+
+        try:
+            os.rename(src, dst)
+            with self._lock:
+                self.num_renamed += 1
+            return
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                raise
+
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+        elif os.path.isdir(src):
+            shutil.move(src, dst)
+            return
+        else:
+            self.copy(src, dst)
+        os.unlink(src)
+
+    def copy(self, src: str, dst: str) -> None:
+        """Copy regular file 'src' to 'dst', see class description."""
+        _LOG.debug("Copying '%s' to '%s'", src, dst)
+        start = time.monotonic()
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(dst)}.", suffix=".part", dir=os.path.dirname(dst))
+        try:
+            with open(src, 'rb') as fsrc, os.fdopen(fd, 'wb') as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                if self.io_policy:
+                    self.io_policy.start(fsrc.fileno())
+                num_copied = self._copy_data(src, fsrc.fileno(), fdst.fileno(), size)
+                if self.io_policy:
+                    self.io_policy.done(fsrc.fileno())
+
+            shutil.copystat(src, tmp_path)
+            if self.verify:
+                self._verify(src, tmp_path)
+            os.rename(tmp_path, dst)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self.num_copied += 1
+            self.num_bytes_copied += num_copied
+            self.copy_seconds += time.monotonic() - start
+
+    def _copy_data(self, src: str, in_fd: int, out_fd: int, size: int) -> int:
+        use_copy_file_range = _HAS_COPY_FILE_RANGE
+        num_copied = 0
+        while num_copied < size:
+            count = min(self.chunk_size, size - num_copied)
+            if use_copy_file_range:
+                try:
+                    num = os.copy_file_range(in_fd, out_fd, count)
+                except OSError as ex:
+                    if ex.errno not in _COPY_FILE_RANGE_UNSUPPORTED or num_copied:
+                        raise
+                    _LOG.debug("copy_file_range not supported for '%s', using sendfile: %s", src, ex)
+                    use_copy_file_range = False
+                    continue
+            elif _HAS_SENDFILE:
+                num = os.sendfile(out_fd, in_fd, None, count)
+            else:  # pragma: no cover
+                num = os.write(out_fd, os.read(in_fd, count))
+
+            if not num:
+                # Truncated while copying
+                break
+
+            num_copied += num
+            if self.io_policy:
+                self.io_policy.consume(num)
+            if self.progress:
+                self.progress(src, num_copied, size)
+
+        return num_copied
+
+    def _verify(self, src: str, copy_path: str) -> None:
+        """Compare size and digest of 'copy_path' with 'src'."""
+        size = os.stat(src).st_size
+        copy_size = os.stat(copy_path).st_size
+        if copy_size != size:
+            raise OSError(errno.EIO, f"Copy verification failed, size {copy_size} of copy differs from size {size} of '{src}'", copy_path)
+
+        with open(src, 'rb') as fsrc, open(copy_path, 'rb') as fcopy:
+            if hashlib.file_digest(fsrc, self.hash_name).digest() != hashlib.file_digest(fcopy, self.hash_name).digest():
+                raise OSError(errno.EIO, f"Copy verification failed, {self.hash_name} digest of copy differs from '{src}'", copy_path)
+
+    def throughput(self) -> float:
+        """Return the average number of bytes copied per second."""
+        return self.num_bytes_copied / self.copy_seconds if self.copy_seconds else 0.0
+
+    def stats(self) -> None:
+        """Log move numbers."""
+        log = _LOG.getChild("stats")
+        lvl = logging.INFO
+        if not log.isEnabledFor(lvl):
+            return
+
+        log.log(lvl, "moved by rename: %s", self.num_renamed)
+        log.log(lvl, "moved by copy: %s", self.num_copied)
+        log.log(lvl, "copied bytes: %s", self.num_bytes_copied)
+        log.log(lvl, "copy throughput: %.1f MB/s", self.throughput() / 1_000_000)
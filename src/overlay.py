@@ -0,0 +1,123 @@
+import os
+from os import DirEntry
+import errno
+from typing import TYPE_CHECKING
+
+from .types import FsPath
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .handler import FileHandler
+
+
+class FsOverlay():
+    """View of the files after the operations done by a `FileHandler`, also during dry_run.
+
+    Collected files and symlinks are looked up in the groups, symlink chains are resolved with the symlink graph, and moved or renamed files are
+    redirected to their original location during dry_run, so no file system calls are needed for collected paths.
+    Paths which are not collected and not changed by any operation are looked up on the file system.
+
+    Arguments:
+        fh: The handler doing the operations. The overlay is updated by the handler.
+    """
+
+    def __init__(self, fh: 'FileHandler'):
+        self._fh = fh
+
+        # Deleted paths, and paths moved or renamed away
+        self.removed: set[str] = set()
+        # Link values of symlinks changed or moved by the operations, the values of other collected symlinks are kept by the groups
+        self.link_values: dict[str, str] = {}
+
+    def deleted(self, path: str) -> None:
+        """Register 'path' as deleted."""
+        self.removed.add(path)
+        self.link_values.pop(path, None)
+
+    def moved(self, from_path: str, to_path: str, link_value: str|None) -> None:
+        """Register 'from_path' as moved or renamed to 'to_path'. 'link_value' is the value if 'from_path' is a symlink."""
+        self.removed.add(from_path)
+        self.removed.discard(to_path)
+        self.link_values.pop(from_path, None)
+        self.link_values.pop(to_path, None)
+        if link_value is not None:
+            self.link_values[to_path] = link_value
+
+    def _entry(self, abs_path: str) -> DirEntry|None:
+        for group in (self._fh.must_protect, self._fh.may_work_on):
+            entry = group.files.get(abs_path) or group.symlinks.get(abs_path)
+            if entry is not None:
+                return entry
+        return None
+
+    def _final(self, abs_path: str, follow_symlinks: bool) -> str|None:
+        """Return 'abs_path', or the end of the symlink chain if 'follow_symlinks'. None if the path does not exist."""
+        if abs_path in self.removed:
+            return None
+
+        if follow_symlinks and abs_path in self._fh.symlink_graph.points_to:
+            final = self._fh.symlink_graph.final_target(abs_path)
+            if final is None or final in self.removed:
+                return None
+            return final
+
+        return abs_path
+
+    def real_path(self, path: str|FsPath) -> str|None:
+        """Return the absolute path of the file on disk, which is at 'path' after the operations, or None if 'path' is deleted or moved away.
+
+        This is the original path of a file moved or renamed during dry_run.
+        """
+        abs_path = os.path.abspath(path)
+        if abs_path in self.removed:
+            return None
+        if self._fh.dry_run:
+            return self._fh.moved_from.get(abs_path, abs_path)
+        return abs_path
+
+    def exists(self, path: str|FsPath, *, follow_symlinks: bool = True) -> bool:
+        """Return True if 'path' exists after the operations. Symlinks to deleted files do not exist, unless not 'follow_symlinks'."""
+        final = self._final(os.path.abspath(path), follow_symlinks)
+        if final is None:
+            return False
+
+        if self._entry(final) is not None or final in self._fh.moved_from:
+            return True
+
+        real = self.real_path(final)
+        assert real is not None
+        return os.path.exists(real) if follow_symlinks else os.path.lexists(real)
+
+    def readlink(self, path: str|FsPath) -> str:
+        """Return the value of symlink 'path' after the operations, see `os.readlink`."""
+        abs_path = os.path.abspath(path)
+        link_value = self.link_values.get(abs_path)
+        if link_value is not None:
+            return link_value
+
+        real = self.real_path(abs_path)
+        if real is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), os.fspath(path))
+
+        for group in (self._fh.must_protect, self._fh.may_work_on):
+            link_value = group.link_values.get(abs_path)
+            if link_value is not None:
+                return link_value
+
+        return self._fh.dir_fds.readlink(real) if self._fh.dir_fds else os.readlink(real)
+
+    def stat(self, path: str|FsPath, *, follow_symlinks: bool = True) -> os.stat_result:
+        """Return the stat result of 'path' after the operations, see `os.stat`.
+
+        The result for collected files and symlinks is the one cached during collect, i.e. the original file for moved or renamed files.
+        """
+        final = self._final(os.path.abspath(path), follow_symlinks)
+        if final is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), os.fspath(path))
+
+        entry = self._entry(final)
+        if entry is not None:
+            return entry.stat(follow_symlinks=False)
+
+        real = self.real_path(final)
+        assert real is not None
+        return os.stat(real, follow_symlinks=follow_symlinks)
@@ -0,0 +1,181 @@
+import os
+import shutil
+from contextlib import suppress
+from dataclasses import dataclass, field
+from enum import Enum
+import logging
+from typing import Iterator, NamedTuple
+
+try:
+    import fcntl
+    _HAS_FCNTL = True
+except ImportError:  # pragma: no cover
+    _HAS_FCNTL = False
+
+from .dir_fds import DirFds
+from .move_engine import MoveEngine
+
+
+_LOG = logging.getLogger(__name__)
+
+# From linux/fs.h
+_FICLONE = 0x40049409
+
+
+class OpKind(Enum):
+    """Kind of file system operation."""
+    DELETE = "delete"
+    RENAME = "rename"
+    MOVE = "move"
+    RELINK = "relink"
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
+    TRASH = "trash"
+
+
+class PlannedOp(NamedTuple):
+    """A file system operation on absolute 'path'.
+
+    'target' is the absolute destination path for RENAME and MOVE, and the new value of the symlink 'path' for RELINK.
+    For HARDLINK and REFLINK, 'target' is the absolute path of the file which 'path' is replaced with a hard link to or a reflink clone of.
+    For TRASH, 'target' is the absolute path in a trash directory which 'path' is renamed to, see `trash.Trash`.
+    """
+    kind: OpKind
+    path: str
+    target: str|None = None
+
+
+@dataclass
+class BatchResult():
+    """Outcome of a bulk operation, see `FileHandler.registered_delete_many`."""
+    num_done: int = 0
+    num_dirs: int = 0
+    failed: dict[str, OSError] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        """True if all operations succeeded."""
+        return not self.failed
+
+
+def execute_op(op: PlannedOp, dir_fds: DirFds|None = None, move_engine: MoveEngine|None = None) -> None:
+    """Execute a single file system operation.
+
+    If 'dir_fds' is not None, the operation is done relative to the cached parent directory fds.
+    If 'move_engine' is not None, it is used for MOVE operations.
+    The trash directory of a TRASH operation is created if it does not exist.
+    """
+    if op.kind is OpKind.TRASH:
+        assert op.target is not None
+        os.makedirs(os.path.dirname(op.target), exist_ok=True)
+
+    if move_engine and op.kind is OpKind.MOVE:
+        assert op.target is not None
+        move_engine.move(op.path, op.target)
+    elif op.kind in (OpKind.HARDLINK, OpKind.REFLINK):
+        assert op.target is not None
+        replace_with_link(op.path, op.target, reflink=op.kind is OpKind.REFLINK)
+    elif dir_fds:
+        _execute_op_dir_fds(op, dir_fds)
+    elif op.kind is OpKind.DELETE:
+        os.unlink(op.path)
+    elif op.kind in (OpKind.RENAME, OpKind.TRASH):
+        assert op.target is not None
+        os.rename(op.path, op.target)
+    elif op.kind is OpKind.MOVE:
+        assert op.target is not None
+        shutil.move(op.path, op.target)
+    else:
+        assert op.target is not None
+        os.unlink(op.path)
+        os.symlink(op.target, op.path)
+
+
+def replace_with_link(path: str, target: str, *, reflink: bool) -> None:
+    """Atomically replace file 'path' with a hard link to 'target', or if 'reflink', with a reflink clone of 'target'.
+
+    The link is created with a temporary name in the directory of 'path', and renamed to 'path'. A reflink clone gets the permission bits and
+    times of the replaced file. Creating a reflink raises an OSError, e.g. EOPNOTSUPP, if not supported by the file system.
+    """
+    if not reflink and os.path.samefile(path, target):
+        # Already a hard link, renaming a link to the same file would do nothing and leave the temporary link
+        return
+
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.link.tmp")
+    with suppress(FileNotFoundError):
+        # Left over from an interrupted operation
+        os.unlink(tmp_path)
+
+    try:
+        if reflink:
+            if not _HAS_FCNTL:  # pragma: no cover
+                raise NotImplementedError("Reflink clones are not supported on this platform.")
+            with open(target, 'rb') as fsrc, open(tmp_path, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            shutil.copystat(path, tmp_path)
+        else:
+            os.link(target, tmp_path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+
+def _execute_op_dir_fds(op: PlannedOp, dir_fds: DirFds) -> None:
+    if op.kind is OpKind.DELETE:
+        dir_fds.unlink(op.path)
+    elif op.kind in (OpKind.RENAME, OpKind.TRASH):
+        assert op.target is not None
+        dir_fds.rename(op.path, op.target)
+    elif op.kind is OpKind.MOVE:
+        assert op.target is not None
+        try:
+            dir_fds.rename(op.path, op.target)
+        except OSError:
+            # E.g. across file systems, shutil.move handles this, or raises the error
+            shutil.move(op.path, op.target)
+    else:
+        assert op.target is not None
+        dir_fds.unlink(op.path)
+        dir_fds.symlink(op.target, op.path)
+
+
+class Plan():
+    """Ordered file system operations recorded by a `FileHandler`, including the symlink relinks and deletes caused by deleting or moving files.
+
+    A plan produced by a dry run can be executed later, without evaluating comparisons and symlink chains again.
+    The operations are executed as recorded, so the files must not have been changed since the dry run.
+
+    If executing an operation fails, the exception is propagated and `num_executed` is the number of operations done, so that
+    execution can be resumed with `execute(start=num_executed)` when the problem has been fixed.
+    """
+
+    def __init__(self) -> None:
+        self.ops: list[PlannedOp] = []
+        self.num_executed = 0
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def __iter__(self) -> Iterator[PlannedOp]:
+        return iter(self.ops)
+
+    def add(self, op: PlannedOp) -> None:
+        """Append an operation to the plan."""
+        self.ops.append(op)
+
+    def counts(self) -> dict[OpKind, int]:
+        """Return number of operations of each kind."""
+        counts = {kind: 0 for kind in OpKind}
+        for op in self.ops:
+            counts[op.kind] += 1
+        return counts
+
+    def execute(self, *, start: int = 0, dir_fds: DirFds|None = None, move_engine: MoveEngine|None = None) -> None:
+        """Execute the operations, starting with operation number 'start'. See `execute_op` for 'dir_fds' and 'move_engine'."""
+        self.num_executed = start
+        for op in self.ops[start:]:
+            _LOG.debug("Executing: %s", op)
+            execute_op(op, dir_fds, move_engine)
+            self.num_executed += 1
@@ -0,0 +1,84 @@
+import time
+import threading
+import logging
+
+
+_LOG = logging.getLogger(__name__)
+
+
+class RateLimiter():
+    """Token bucket limiting the rate of file system operations and of bytes read or written, shared by all users and threads.
+
+    A rate of None means no limit. Up to 'burst_seconds' worth of operations or bytes may be done without waiting.
+    The rates may be changed with `configure` while the limiter is in use, e.g. from another thread. A waiting caller is not woken up,
+    but the waits of the following calls are computed from the new rates, including the debt left from calls before the change.
+
+    Arguments:
+        ops_per_sec: Aggregate limit for operations, e.g. directory scans, deletes and renames.
+        bytes_per_sec: Aggregate limit for bytes, e.g. read for comparison or copied.
+        burst_seconds: Size of the buckets in seconds of the rates.
+    """
+
+    def __init__(self, *, ops_per_sec: float|None = None, bytes_per_sec: float|None = None, burst_seconds: float = 1.0):
+        self.ops_per_sec = ops_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self.burst_seconds = burst_seconds
+
+        self._lock = threading.Lock()
+        # Time when the bucket is empty, after the operations/bytes acquired, per rate
+        self._ops_empty_time = 0.0
+        self._bytes_empty_time = 0.0
+
+        self.num_waits = 0
+        self.wait_seconds = 0.0
+
+    def configure(self, *, ops_per_sec: float|None, bytes_per_sec: float|None) -> None:
+        """Change the rates. Waits not yet done because of calls before the change are scaled to the new rates."""
+        with self._lock:
+            now = time.monotonic()
+            self._ops_empty_time = self._rescale(self._ops_empty_time, now, self.ops_per_sec, ops_per_sec)
+            self._bytes_empty_time = self._rescale(self._bytes_empty_time, now, self.bytes_per_sec, bytes_per_sec)
+            self.ops_per_sec = ops_per_sec
+            self.bytes_per_sec = bytes_per_sec
+        _LOG.info("Rate limits: %s ops/s, %s bytes/s", ops_per_sec, bytes_per_sec)
+
+    @staticmethod
+    def _rescale(empty_time: float, now: float, old_rate: float|None, new_rate: float|None) -> float:
+        if old_rate and new_rate:
+            return now + (empty_time - now) * old_rate / new_rate
+        return empty_time
+
+    def _take(self, empty_time: float, now: float, amount: float, rate: float) -> float:
+        # An idle bucket holds at most burst_seconds worth
+        return max(empty_time, now - self.burst_seconds) + amount / rate
+
+    def acquire(self, num_ops: int = 1, num_bytes: int = 0) -> None:
+        """Take 'num_ops' operations and 'num_bytes' bytes from the buckets, and sleep if needed to keep within the rates."""
+        if not (self.ops_per_sec or self.bytes_per_sec):
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            if self.ops_per_sec and num_ops:
+                self._ops_empty_time = self._take(self._ops_empty_time, now, num_ops, self.ops_per_sec)
+                delay = self._ops_empty_time - now
+            if self.bytes_per_sec and num_bytes:
+                self._bytes_empty_time = self._take(self._bytes_empty_time, now, num_bytes, self.bytes_per_sec)
+                delay = max(delay, self._bytes_empty_time - now)
+            if delay > 0:
+                self.num_waits += 1
+                self.wait_seconds += delay
+
+        if delay > 0:
+            _LOG.debug("Throttling for %.3f seconds", delay)
+            time.sleep(delay)
+
+    def stats(self) -> None:
+        """Log throttling numbers."""
+        log = _LOG.getChild("stats")
+        lvl = logging.INFO
+        if not log.isEnabledFor(lvl):
+            return
+
+        log.log(lvl, "throttled: %s times, %.1f seconds", self.num_waits, self.wait_seconds)
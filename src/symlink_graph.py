@@ -0,0 +1,121 @@
+from collections import defaultdict
+import logging
+from typing import Container
+
+from .groups import FileGroups
+
+
+_LOG = logging.getLogger(__name__)
+
+
+class SymlinkGraph():
+    """Dependency graph of the symlinks collected by `FileGroups`, built without any file system access.
+
+    Forward edges are from a symlink to the absolute path it points to, reverse edges from a path to the symlinks pointing to it.
+    The final target of each symlink chain is precomputed, and symlinks in cycles are detected.
+
+    The graph is updated by `relink`, `add` and `remove`, so that it reflects the planned state, also in a dry run.
+
+    Arguments:
+        fg: The collected files and symlinks.
+    """
+
+    def __init__(self, fg: FileGroups):
+        # Symlink -> absolute path pointed to
+        self.points_to: dict[str, str] = {}
+        # Absolute path -> symlinks pointing to it
+        self.pointed_to_by: dict[str, list[str]] = defaultdict(list)
+
+        for group in (fg.must_protect, fg.may_work_on):
+            for abs_points_to, entries in group.symlinks_by_abs_points_to.items():
+                for entry in entries:
+                    self.points_to[entry.path] = abs_points_to
+                    self.pointed_to_by[abs_points_to].append(entry.path)
+
+        # Symlink -> path at the end of the chain, which is not a symlink. None for symlinks in or leading to a cycle.
+        self._final_targets: dict[str, str|None] = {}
+        self.cycles: set[str] = set()
+        for symlnk in self.points_to:
+            self._resolve(symlnk)
+
+        if self.cycles:
+            _LOG.warning("Symlink cycles: %s", sorted(self.cycles))
+
+    def _resolve(self, symlnk: str) -> str|None:
+        """Follow chain from 'symlnk', and set the final target of all symlinks on the chain."""
+        chain: dict[str, None] = {}
+        node = symlnk
+        while node in self.points_to and node not in self._final_targets and node not in chain:
+            chain[node] = None
+            node = self.points_to[node]
+
+        final: str|None
+        if node in chain:
+            cycle = list(chain)
+            self.cycles.update(cycle[cycle.index(node):])
+            final = None
+        else:
+            final = self._final_targets.get(node, node)
+
+        for link in chain:
+            self._final_targets[link] = final
+        return final
+
+    def final_target(self, symlnk: str) -> str|None:
+        """Return the absolute path at the end of the chain starting at 'symlnk', or None if the chain has a cycle."""
+        return self._final_targets[symlnk]
+
+    def dependents(self, path: str, within: Container[str]|None = None) -> list[str]:
+        """Return symlinks pointing to 'path', directly or through other symlinks, each symlink once, nearest first.
+
+        If 'within' is not None, only symlinks in 'within' are returned and followed.
+        """
+        seen = {path}
+        found: list[str] = []
+        idx = -1
+        node = path
+        while True:
+            for symlnk in self.pointed_to_by.get(node, ()):
+                if symlnk not in seen and (within is None or symlnk in within):
+                    seen.add(symlnk)
+                    found.append(symlnk)
+
+            idx += 1
+            if idx == len(found):
+                return found
+            node = found[idx]
+
+    def relink(self, symlnk: str, abs_points_to: str) -> None:
+        """Change 'symlnk' to point to 'abs_points_to'."""
+        self.pointed_to_by[self.points_to[symlnk]].remove(symlnk)
+        self.points_to[symlnk] = abs_points_to
+        self.pointed_to_by[abs_points_to].append(symlnk)
+        self._update(symlnk)
+
+    def add(self, symlnk: str, abs_points_to: str) -> None:
+        """Add moved or renamed 'symlnk' pointing to 'abs_points_to'."""
+        self.points_to[symlnk] = abs_points_to
+        self.pointed_to_by[abs_points_to].append(symlnk)
+        self._update(symlnk)
+
+    def _update(self, symlnk: str) -> None:
+        """Resolve the chains through changed 'symlnk' again."""
+        links = [symlnk] + self.dependents(symlnk)
+        for link in links:
+            self._final_targets.pop(link, None)
+            self.cycles.discard(link)
+        for link in links:
+            if link not in self._final_targets:
+                self._resolve(link)
+
+    def remove(self, path: str) -> None:
+        """Remove deleted or moved 'path'. Symlinks pointing to it become broken, with 'path' as final target."""
+        if path not in self.points_to:
+            return
+
+        self.pointed_to_by[self.points_to.pop(path)].remove(path)
+        del self._final_targets[path]
+        self.cycles.discard(path)
+        for link in self.dependents(path):
+            self._final_targets[link] = path
+            self.cycles.discard(link)
@@ -0,0 +1,165 @@
+import os
+from pathlib import Path
+import re
+import time
+from contextlib import suppress
+import logging
+from typing import Iterator, Sequence
+
+from .plan import BatchResult
+
+
+_LOG = logging.getLogger(__name__)
+
+# Directories with this name are not collected by `FileGroups`
+TRASH_DIR_NAME = '.file_groups_trash'
+
+
+class Trash():
+    """Per file system trash directories, so that a delete can be done as an atomic rename and undone.
+
+    A trashed file is renamed to '<top>/<name>/<run>/<path relative to top>', where 'top' is the closest of 'top_dirs' containing the file on
+    the same file system, or else the mount point of the file system of the file. Since a trash directory is on the same file system as the
+    trashed files, trashing is a rename.
+    If the trash path exists, or has been used by this run, the file is trashed in the run directory '<run>.~<n>~' instead, with the first
+    free 'n', so that the trashed files keep their names.
+
+    Directories named `TRASH_DIR_NAME`, the default 'name', are skipped when collecting files, so the trash directory may be in a collected
+    directory, e.g. a work directory. A trash directory with another name must not be in a collected directory, as the trashed files would
+    be collected.
+
+    Arguments:
+        top_dirs: Directories where trash directories are created, e.g. the work directories. Must be writable.
+        name: Name of the trash directory in each top directory.
+        run: Name of the subdirectory for this run in the trash directories. Default is the current time.
+    """
+
+    def __init__(self, top_dirs: Sequence[Path|str] = (), *, name: str = TRASH_DIR_NAME, run: str|None = None):
+        self.name = name
+        self.run = run or time.strftime('%Y-%m-%dT%H-%M-%S')
+
+        # Top directory -> st_dev
+        self.top_dirs: dict[str, int] = {}
+        for top_dir in top_dirs:
+            abs_top_dir = os.path.abspath(top_dir)
+            self.top_dirs[abs_top_dir] = os.stat(abs_top_dir).st_dev
+
+        # Trash paths used by this run
+        self._used: set[str] = set()
+        # Directory -> top directory, for directories of trashed files and their parents up to the top directory
+        self._dir_top_dirs: dict[str, str] = {}
+
+    def _top_dir(self, path: str) -> str:
+        dir_path = os.path.dirname(path)
+        top_dir = self._dir_top_dirs.get(dir_path)
+        if top_dir is not None:
+            return top_dir
+
+        st_dev = os.stat(dir_path).st_dev
+        walked = []
+        parent = dir_path
+        while top_dir is None:
+            walked.append(parent)
+            if self.top_dirs.get(parent) == st_dev:
+                top_dir = parent
+            elif os.path.ismount(parent):
+                self.top_dirs[parent] = st_dev
+                top_dir = parent
+            else:
+                parent = os.path.dirname(parent)
+                top_dir = self._dir_top_dirs.get(parent)
+
+        for walked_dir in walked:
+            self._dir_top_dirs[walked_dir] = top_dir
+        return top_dir
+
+    def trash_path(self, path: str) -> str:
+        """Return the path in the trash for absolute 'path', see class description."""
+        assert os.path.isabs(path), f"Expected absolute path, got '{path}'"
+        top_dir = self._top_dir(path)
+        rel_path = os.path.relpath(path, top_dir)
+
+        run = self.run
+        num = 0
+        while True:
+            trash_path = os.path.join(top_dir, self.name, run, rel_path)
+            if trash_path not in self._used and not os.path.lexists(trash_path):
+                break
+            num += 1
+            run = f"{self.run}.~{num}~"
+        self._used.add(trash_path)
+        return trash_path
+
+    def reset(self) -> None:
+        """Forget the trash paths used, e.g. after a dry run."""
+        self._used = set()
+
+    def _run_dirs(self, run: str|None) -> Iterator[tuple[str, str]]:
+        """Yield (top_dir, run_dir) for trashed runs, all runs if 'run' is None. Empty trash directories are removed."""
+        run_name_re = re.compile(re.escape(run) + r'(\.~[0-9]+~)?') if run is not None else None
+        for top_dir in self.top_dirs:
+            trash_dir = os.path.join(top_dir, self.name)
+            if not os.path.isdir(trash_dir):
+                continue
+            for run_name in sorted(os.listdir(trash_dir)):
+                run_dir = os.path.join(trash_dir, run_name)
+                if (run_name_re is None or run_name_re.fullmatch(run_name)) and os.path.isdir(run_dir):
+                    yield top_dir, run_dir
+            self._rmdir_if_empty(trash_dir)
+
+    @staticmethod
+    def _walk(run_dir: str) -> Iterator[tuple[str, list[str]]]:
+        """Yield (directory, names of files and symlinks), bottom up."""
+        for dir_path, dir_names, file_names in os.walk(run_dir, topdown=False):
+            yield dir_path, file_names + [dn for dn in dir_names if os.path.islink(os.path.join(dir_path, dn))]
+
+    def restore(self, run: str|None = None) -> BatchResult:
+        """Rename trashed files back to their original paths. Files are not restored if the original path exists, the failures are returned.
+
+        Arguments:
+            run: Restore files from this run only. Default all runs in the trash directories of 'top_dirs'.
+        """
+        res = BatchResult()
+        for top_dir, run_dir in self._run_dirs(run):
+            for dir_path, names in self._walk(run_dir):
+                for name in names:
+                    trashed = os.path.join(dir_path, name)
+                    orig = os.path.join(top_dir, os.path.relpath(trashed, run_dir))
+                    try:
+                        if os.path.lexists(orig):
+                            raise FileExistsError(f"Not restoring '{trashed}', '{orig}' exists")
+                        os.makedirs(os.path.dirname(orig), exist_ok=True)
+                        os.rename(trashed, orig)
+                        res.num_done += 1
+                    except OSError as ex:
+                        _LOG.warning("Failed to restore '%s': %s", trashed, ex)
+                        res.failed[trashed] = ex
+                self._rmdir_if_empty(dir_path)
+            res.num_dirs += 1
+        return res
+
+    def purge(self, run: str|None = None) -> BatchResult:
+        """Delete trashed files.
+
+        Arguments:
+            run: Delete files from this run only. Default all runs in the trash directories of 'top_dirs'.
+        """
+        res = BatchResult()
+        for _, run_dir in self._run_dirs(run):
+            for dir_path, names in self._walk(run_dir):
+                for name in names:
+                    trashed = os.path.join(dir_path, name)
+                    try:
+                        os.unlink(trashed)
+                        res.num_done += 1
+                    except OSError as ex:
+                        _LOG.warning("Failed to purge '%s': %s", trashed, ex)
+                        res.failed[trashed] = ex
+                self._rmdir_if_empty(dir_path)
+            res.num_dirs += 1
+        return res
+
+    @staticmethod
+    def _rmdir_if_empty(dir_path: str) -> None:
+        with suppress(OSError):
+            os.rmdir(dir_path)
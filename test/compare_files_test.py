@@ -1,8 +1,15 @@
+import os
+import errno
+import filecmp
+import threading
 from pathlib import Path
 
-from file_groups.compare_files import CompareFiles
+import pytest
 
-from .conftest import same_content_files, different_content_files
+import file_groups.compare_files
+from file_groups.compare_files import compare_concurrently, CompareFiles, BufferedCompareFiles, SparseCompareFiles, SampleCompareFiles, data_extents
+
+from .conftest import same_content_files, different_content_files, hardlink_files
 
 
 @same_content_files("Hi", 'df/f11', 'ki/f12')
@@ -22,3 +29,254 @@ def test_compare_different_different_size_files(duplicates_dir):
     # Test framework puts filename in files, so size is different when length is different
     fcmp = CompareFiles()
     assert not fcmp.compare(Path('df/f11'), Path('ki/f123'))
+
+
+@same_content_files("Hi", 'df/f11')
+@hardlink_files([('df/f11', 'ki/f12')])
+def test_compare_hardlinks_does_not_read_data(duplicates_dir, monkeypatch):
+    def no_cmp(*args, **kwargs):
+        raise AssertionError("Hard links should not be compared by content")
+
+    monkeypatch.setattr(CompareFiles, "_compare_content", no_cmp)
+    fcmp = CompareFiles()
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+@different_content_files("Hello", 'df/f21', 'ki/f22', 'ki/f223')
+def test_buffered_compare(duplicates_dir):
+    fcmp = BufferedCompareFiles(block_size=4)
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert not fcmp.compare(Path('df/f21'), Path('ki/f22'))
+    assert not fcmp.compare(Path('df/f21'), Path('ki/f223'))
+
+    # Multiple blocks
+    Path('df/f31').write_bytes(b"0123456789abcdef" * 3)
+    Path('ki/f32').write_bytes(b"0123456789abcdef" * 3)
+    Path('ki/f33').write_bytes(b"0123456789abcdef" * 2 + b"0123456789abcdeF")
+    Path('ki/f34').write_bytes(b"0123456789abcdef" + b"0123456789Abcdef" * 2)
+    assert fcmp.compare(Path('df/f31'), Path('ki/f32'))
+    assert not fcmp.compare(Path('df/f31'), Path('ki/f33'))
+    assert not fcmp.compare(Path('df/f31'), Path('ki/f34'))
+
+    # Last block not full
+    fcmp = BufferedCompareFiles(block_size=5)
+    assert fcmp.compare(Path('df/f31'), Path('ki/f32'))
+    assert not fcmp.compare(Path('df/f31'), Path('ki/f33'))
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+def test_buffered_compare_file_changed_size(duplicates_dir, monkeypatch):
+    fcmp = BufferedCompareFiles(block_size=4)
+    # File grows after size check
+    monkeypatch.setattr(CompareFiles, 'compare', lambda self, fsp1, fsp2: self._compare_content(fsp1, fsp2))
+    Path('ki/f12').write_text("Hello", encoding='utf-8')
+    assert not fcmp.compare(Path('df/f11'), Path('ki/f12'))
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12', 'ki/f13')
+@different_content_files("Hello", 'df/f21', 'ki/f22')
+def test_compare_cache(duplicates_dir):
+    filecmp.clear_cache()
+    fcmp = CompareFiles(cache_size=2)
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert fcmp.compare(Path('ki/f12'), Path('df/f11'))
+    assert not fcmp.compare(Path('df/f21'), Path('ki/f22'))
+    assert not fcmp.compare(Path('df/f21'), Path('ki/f22'))
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (2, 2)
+    assert not filecmp._cache  # pylint: disable=protected-access
+
+    # Evict least recently used
+    assert fcmp.compare(Path('df/f11'), Path('ki/f13'))
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (2, 3)
+    assert fcmp.compare(Path('df/f11'), Path('ki/f13'))
+    assert not fcmp.compare(Path('df/f21'), Path('ki/f22'))
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (4, 3)
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (4, 4)
+
+    # Changed file is compared again
+    Path('ki/f12').write_text("Ho", encoding='utf-8')
+    os.utime('ki/f12', ns=(0, 0))
+    assert not fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (4, 5)
+
+    fcmp.clear_cache()
+    assert fcmp.compare(Path('df/f11'), Path('ki/f13'))
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (4, 6)
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+def test_compare_no_cache(duplicates_dir):
+    fcmp = CompareFiles(cache_size=0)
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (0, 0)
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+@different_content_files("Hello", 'df/f21', 'ki/f22', 'ki/f23', 'ki/f24')
+def test_compare_many(duplicates_dir):
+    pairs = [(Path('df/f11'), Path('ki/f12'))] + [(Path('df/f21'), Path(f'ki/f2{num}')) for num in range(2, 5)] + [(Path('ki/f12'), Path('df/f11'))]
+    exp = [(fsp1, fsp2, fsp1.name[1] == '1') for fsp1, fsp2 in pairs]
+
+    for fcmp in CompareFiles(), BufferedCompareFiles(block_size=4):
+        assert list(fcmp.compare_many(iter(pairs), max_workers=2)) == exp
+        assert sorted(fcmp.compare_many(iter(pairs), max_workers=1, ordered=False)) == sorted(exp)
+        assert sorted(fcmp.compare_many(iter(pairs), max_workers=4, ordered=False)) == sorted(exp)
+
+
+def test_compare_concurrently_unordered_completion_order():
+    # The first pair completes after the result of the second pair has been yielded, also when draining the last pairs
+    second_yielded = threading.Event()
+
+    def compare(fsp1, fsp2):
+        if fsp1 == 'a':
+            assert second_yielded.wait(timeout=10)
+        return fsp1 == fsp2
+
+    for pairs in ([('a', 'a'), ('b', 'c')], [('x', 'x')] * 4 + [('a', 'a'), ('b', 'c')]):
+        second_yielded.clear()
+        res = compare_concurrently(compare, iter(pairs), max_workers=2, ordered=False)
+        got = []
+        for item in res:
+            got.append(item)
+            if item[0] == 'b':
+                second_yielded.set()
+        assert got.index(('b', 'c', False)) < got.index(('a', 'a', True))
+        assert sorted(got) == sorted((fsp1, fsp2, fsp1 == fsp2) for fsp1, fsp2 in pairs)
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+def test_compare_many_stop_early(duplicates_dir):
+    pairs = [(Path('df/f11'), Path('ki/f12'))] * 100
+    res = CompareFiles().compare_many(pairs, max_workers=2)
+    assert next(res) == (Path('df/f11'), Path('ki/f12'), True)
+    res.close()
+
+
+@same_content_files("Hi", 'df/f11')
+def test_compare_many_error(duplicates_dir):
+    pairs = [(Path('df/f11'), Path('ki/nonexisting'))]
+    with pytest.raises(FileNotFoundError):
+        list(CompareFiles().compare_many(pairs))
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12', 'ki/f13', 'ki/f14')
+@different_content_files("Hi", 'ki/f3')
+@hardlink_files([('df/f11', 'ki/f11hard')])
+def test_compare_one_to_many(duplicates_dir):
+    Path('ki/f21').write_text("Hx", encoding='utf-8')
+    Path('ki/f22').write_text("xi", encoding='utf-8')
+    candidates = [Path(fn) for fn in ('ki/f12', 'ki/f21', 'ki/f3', 'ki/f11hard', 'ki/f13', 'ki/f22', 'ki/f14')]
+    exp = [Path('ki/f12'), Path('ki/f11hard'), Path('ki/f13'), Path('ki/f14')]
+
+    fcmp = CompareFiles()
+    assert fcmp.compare_one_to_many(Path('df/f11'), iter(candidates)) == exp
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (0, 5)
+    assert fcmp.compare_one_to_many(Path('df/f11'), candidates, max_open_files=2) == exp
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (5, 5)
+    assert fcmp.compare(Path('ki/f22'), Path('df/f11')) is False
+    assert (fcmp.cache_hits, fcmp.cache_misses) == (6, 5)
+
+    for fcmp in CompareFiles(cache_size=0), BufferedCompareFiles(cache_size=0, block_size=1):
+        assert fcmp.compare_one_to_many(Path('df/f11'), candidates, max_open_files=2) == exp
+        assert fcmp.compare_one_to_many(Path('df/f11'), []) == []
+        assert fcmp.compare_one_to_many(Path('ki/f21'), [Path('ki/f22')]) == []
+
+
+_MIB = 1024 * 1024
+
+
+def _sparse_file(fn, size, *data_at):
+    with open(fn, 'wb') as ff:
+        ff.truncate(size)
+        for offset, data in data_at:
+            ff.seek(offset)
+            ff.write(data)
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+@different_content_files("Hello", 'df/f21', 'ki/f22')
+def test_sparse_compare(duplicates_dir):
+    fcmp = SparseCompareFiles(block_size=1024)
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert not fcmp.compare(Path('df/f21'), Path('ki/f22'))
+
+    _sparse_file('df/s1', 10 * _MIB, (5 * _MIB, b'x' * 10), (8 * _MIB, b'y'))
+    _sparse_file('ki/s1', 10 * _MIB, (5 * _MIB, b'x' * 10), (8 * _MIB, b'y'))
+    _sparse_file('ki/s2', 10 * _MIB, (5 * _MIB, b'x' * 10), (8 * _MIB, b'z'))
+    _sparse_file('ki/s3', 10 * _MIB, (5 * _MIB, b'x' * 10))
+    _sparse_file('ki/s4', 10 * _MIB, (5 * _MIB, b'x' * 10), (8 * _MIB, b'y'), (10 * _MIB - 1, b'\0'))
+    with open('ki/dense', 'wb') as ff:
+        with open('df/s1', 'rb') as sf:
+            ff.write(sf.read())
+
+    with open('df/s1', 'rb') as ff:
+        extents = data_extents(ff.fileno(), 10 * _MIB)
+    if extents != [(0, 10 * _MIB)]:
+        # Filesystem supports holes
+        assert len(extents) == 2
+        assert extents[0][0] <= 5 * _MIB < extents[0][1] <= 8 * _MIB <= extents[1][0] < extents[1][1] < 10 * _MIB
+
+    assert fcmp.compare(Path('df/s1'), Path('ki/s1'))
+    assert not fcmp.compare(Path('df/s1'), Path('ki/s2'))
+    assert not fcmp.compare(Path('df/s1'), Path('ki/s3'))
+    assert not fcmp.compare(Path('ki/s3'), Path('df/s1'))
+    assert fcmp.compare(Path('df/s1'), Path('ki/s4'))
+    assert fcmp.compare(Path('df/s1'), Path('ki/dense'))
+
+    # All hole
+    _sparse_file('df/h1', _MIB)
+    _sparse_file('ki/h2', _MIB)
+    assert fcmp.compare(Path('df/h1'), Path('ki/h2'))
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+def test_sparse_compare_file_truncated(duplicates_dir, monkeypatch):
+    _sparse_file('df/s1', 2 * _MIB, (_MIB, b'x'))
+    _sparse_file('ki/s1', 2 * _MIB, (_MIB, b'x'))
+    monkeypatch.setattr(file_groups.compare_files, 'data_extents', lambda fd, size: [(0, size + 1)])
+    assert not SparseCompareFiles().compare(Path('df/s1'), Path('ki/s1'))
+
+
+@pytest.mark.parametrize("err", [errno.EINVAL, errno.EIO])
+def test_data_extents_errors(err, monkeypatch):
+    def lseek(*args):
+        raise OSError(err, os.strerror(err))
+
+    monkeypatch.setattr(os, 'lseek', lseek)
+    if err == errno.EINVAL:
+        assert data_extents(0, 17) == [(0, 17)]
+    else:
+        with pytest.raises(OSError):
+            data_extents(0, 17)
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+def test_sample_compare(duplicates_dir):
+    fcmp = SampleCompareFiles(block_size=16, sample_size=4)
+    # Small files are not sampled
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert (fcmp.num_sample_rejected, fcmp.num_sample_passed) == (0, 0)
+
+    content = "0123456789abcdefghijklmnopqrstuvwxyz"
+    Path('df/f1').write_text(content, encoding='utf-8')
+    Path('ki/f1').write_text(content, encoding='utf-8')
+    Path('ki/head').write_text("X" + content[1:], encoding='utf-8')
+    Path('ki/tail').write_text(content[:-1] + "X", encoding='utf-8')
+    Path('ki/middle').write_text(content[:16] + "X" + content[17:], encoding='utf-8')
+    Path('ki/other').write_text(content[:8] + "X" + content[9:], encoding='utf-8')
+
+    assert fcmp.compare(Path('df/f1'), Path('ki/f1'))
+    assert (fcmp.num_sample_rejected, fcmp.num_sample_passed) == (0, 1)
+    for fn in 'head', 'tail', 'middle':
+        assert not fcmp.compare(Path('df/f1'), Path('ki') / fn)
+    assert (fcmp.num_sample_rejected, fcmp.num_sample_passed) == (3, 1)
+    assert not fcmp.compare(Path('df/f1'), Path('ki/other'))
+    assert (fcmp.num_sample_rejected, fcmp.num_sample_passed) == (3, 2)
+
+    fcmp = SampleCompareFiles(sample_size=4, sample_offsets=(0.25,))
+    assert not fcmp.compare(Path('df/f1'), Path('ki/other'))
+    assert not fcmp.compare(Path('df/f1'), Path('ki/middle'))
+    assert (fcmp.num_sample_rejected, fcmp.num_sample_passed) == (1, 1)
@@ -54,6 +54,11 @@ class TestSetupException(Exception):
     pass
 
 
+def abs_path(fn):
+    """Return absolute path of 'fn' as str."""
+    return str(Path(fn).absolute())
+
+
 def count_files(dir_eq_count):
     found_files = []
     def count_one_dir(path):
@@ -0,0 +1,117 @@
+import os
+import hashlib
+import threading
+from pathlib import Path
+
+from file_groups.digest_cache import DigestCache, _i64
+from file_groups.groups import FileGroups
+from file_groups.duplicates import FindDuplicates
+
+from .conftest import same_content_files, different_content_files, hardlink_files
+
+
+@same_content_files("Hi", 'df/f11', 'df/f12')
+def test_digest_cache_get_put(duplicates_dir):
+    with DigestCache('cache.db') as cache:
+        st = os.stat('df/f11')
+        assert cache.get(st, 'sha256') is None
+        digest = cache.digest(Path('df/f11'), 'sha256')
+        assert digest == hashlib.sha256(b"Hi").digest()
+        assert cache.get(st, 'sha256') == digest
+        assert cache.get(st, 'md5') is None
+        assert cache.num_hits == 1
+        assert cache.num_misses == 3
+
+    # Persistent
+    with DigestCache('cache.db') as cache:
+        assert cache.digest(Path('df/f11'), 'sha256') == digest
+        assert cache.num_hits == 1
+
+
+@same_content_files("Hi", 'df/f11')
+def test_digest_cache_put_same_key(duplicates_dir):
+    st = os.stat('df/f11')
+    with DigestCache('cache.db', max_entries=1) as cache:
+        for num in range(5):
+            cache.put(st, 'sha256', bytes([num]))
+        assert cache._num_entries == 1  # pylint: disable=protected-access
+        assert cache.get(st, 'sha256') == bytes([4])
+        assert cache.num_evicted == 0
+
+    with DigestCache('cache.db') as cache:
+        assert cache._num_entries == 1  # pylint: disable=protected-access
+
+
+@same_content_files("Hi", 'df/f11')
+@hardlink_files([('df/f11', 'df/f11hard')])
+def test_digest_cache_identity(duplicates_dir):
+    with DigestCache('cache.db') as cache:
+        digest = cache.digest(Path('df/f11'), 'sha256')
+        # Same inode
+        assert cache.get(os.stat('df/f11hard'), 'sha256') == digest
+
+        # Changed content
+        Path('df/f11').write_text("Hello", encoding='utf-8')
+        assert cache.get(os.stat('df/f11hard'), 'sha256') is None
+        assert cache.num_invalidated == 1
+        assert cache.digest(Path('df/f11hard'), 'sha256') == hashlib.sha256(b"Hello").digest()
+
+        # Changed ctime only
+        os.chmod('df/f11', 0o600)
+        assert cache.get(os.stat('df/f11'), 'sha256') is None
+        assert cache.num_invalidated == 2
+
+
+@different_content_files("Hi", 'df/f1', 'df/f2', 'df/f3', 'df/f4')
+def test_digest_cache_lru_eviction(duplicates_dir):
+    with DigestCache('cache.db', max_entries=3) as cache:
+        for fn in ('df/f1', 'df/f2', 'df/f3'):
+            cache.digest(Path(fn), 'sha256')
+        assert cache.get(os.stat('df/f1'), 'sha256')
+        assert cache.num_evicted == 0
+
+        cache.digest(Path('df/f4'), 'sha256')
+        assert cache.num_evicted == 1
+        assert cache.get(os.stat('df/f2'), 'sha256') is None
+        assert cache.get(os.stat('df/f1'), 'sha256')
+        assert cache.get(os.stat('df/f4'), 'sha256')
+
+        # Other process has evicted entries meanwhile
+        cache._num_entries = 5  # pylint: disable=protected-access
+        cache._evict()  # pylint: disable=protected-access
+        assert cache.num_evicted == 1
+
+
+@different_content_files("Hi", 'df/f1', 'df/f2', 'df/f3', 'df/f4')
+def test_digest_cache_concurrent(duplicates_dir):
+    with DigestCache('cache.db') as cache1, DigestCache('cache.db') as cache2:
+        def digests(cache):
+            for fn in ('df/f1', 'df/f2', 'df/f3', 'df/f4'):
+                cache.digest(Path(fn), 'sha256')
+
+        threads = [threading.Thread(target=digests, args=(cache,)) for cache in (cache1, cache1, cache2, cache2)]
+        for thr in threads:
+            thr.start()
+        for thr in threads:
+            thr.join()
+
+        for fn in ('df/f1', 'df/f2', 'df/f3', 'df/f4'):
+            assert cache2.get(os.stat(fn), 'sha256') == hashlib.sha256(f"Hi{fn}".encode()).digest()
+
+
+def test_i64():
+    assert _i64(2**63 - 1) == 2**63 - 1
+    assert _i64(2**64 - 1) == -1
+
+
+@same_content_files("A longer content, more than twice the sample size", 'ki/f11', 'df/f11')
+def test_find_duplicates_digest_cache(duplicates_dir):
+    with DigestCache('cache.db') as cache:
+        finder = FindDuplicates(FileGroups(['ki'], ['df']), sample_size=4, digest_cache=cache)
+        assert len(list(finder.find())) == 1
+        assert finder.num_full_hashed == 2
+
+        finder = FindDuplicates(FileGroups(['ki'], ['df']), sample_size=4, digest_cache=cache)
+        assert len(list(finder.find())) == 1
+        assert finder.num_full_hashed == 0
+        assert cache.num_hits == 2
@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from file_groups.dir_fds import DirFds
+from file_groups.handler import FileHandler
+from file_groups.plan import Plan, PlannedOp, OpKind
+
+from .conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'df/a/f11', 'df/a/f12', 'df/b/f21', 'df/c/f31')
+def test_dir_fds_operations(duplicates_dir):
+    with DirFds(max_open=2) as dir_fds:
+        dir_fds.symlink('f11', abs_path('df/a/f11sym'))
+        assert dir_fds.readlink(abs_path('df/a/f11sym')) == 'f11'
+        dir_fds.unlink(abs_path('df/a/f12'))
+        assert dir_fds.num_opened == 1
+        assert dir_fds.num_hits == 2
+
+        dir_fds.rename(abs_path('df/a/f11'), abs_path('df/b/f11'))
+        dir_fds.rename(abs_path('df/b/f21'), abs_path('df/c/f21'))
+        assert dir_fds.num_opened == 3
+        assert dir_fds.num_hits == 4
+
+        # Evicted
+        dir_fds.unlink(abs_path('df/a/f11sym'))
+        assert dir_fds.num_opened == 4
+
+        with pytest.raises(FileNotFoundError):
+            dir_fds.unlink(abs_path('df/a/f12'))
+        assert dir_fds.num_hits == 5
+
+    # Closed directories are opened again
+    dir_fds.rename(abs_path('df/c/f21'), abs_path('df/c/f21'))
+    assert dir_fds.num_opened == 5
+    assert dir_fds.num_hits == 6
+    dir_fds.close()
+
+    assert count_files({'df/a': 0, 'df/b': 1, 'df/c': 2})
+
+
+@same_content_files('Hi', 'df/a/f11', 'df/b/f21', 'df/c/f31')
+def test_dir_fds_in_use_not_evicted(duplicates_dir):
+    with DirFds(max_open=1) as dir_fds:
+        # The source directory is in use, and not closed, while the destination directory is opened
+        dir_fds.rename(abs_path('df/a/f11'), abs_path('df/b/f11'))
+        dir_fds.rename(abs_path('df/b/f11'), abs_path('df/c/f11'))
+        assert dir_fds.num_opened == 3
+        assert dir_fds.num_hits == 1
+
+        # Directories no longer in use are evicted
+        dir_fds.rename(abs_path('df/c/f11'), abs_path('df/a/f11'))
+        assert dir_fds.num_opened == 4
+        dir_fds.unlink(abs_path('df/b/f21'))
+        assert dir_fds.num_opened == 5
+        assert dir_fds.num_hits == 2
+
+    assert count_files({'df/a': 1, 'df/b': 0, 'df/c': 1})
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+@symlink_files([('../df/f11', 'ki/f11sym'), ('f11', 'df/f11sym'), ('f12', 'df/f12sym')])
+def test_dir_fds_handler(duplicates_dir, log_debug):
+    with DirFds() as dir_fds:
+        fh = FileHandler(['ki'], ['df'], dir_fds=dir_fds, dry_run=True)
+        assert len(fh.must_protect.symlinks_by_abs_points_to[abs_path('df/f11')]) == 1
+        fh.registered_move(abs_path('df/f11'), 'ki/f21')
+        fh.registered_delete(abs_path('df/f12'), None)
+        assert count_files({'ki': 2, 'df': 4})
+
+        fh.plan.execute(dir_fds=dir_fds)
+        assert count_files({'ki': 3, 'df': 1})
+        assert os.readlink('df/f11sym') == abs_path('ki/f21')
+        assert os.readlink('ki/f11sym') == 'f21'
+
+        fh = FileHandler(['ki'], ['df'], dir_fds=dir_fds, dry_run=False)
+        fh.registered_rename(abs_path('df/f11sym'), 'df/f13sym')
+        assert count_files({'df': 1})
+        assert os.readlink('df/f13sym') == abs_path('ki/f21')
+
+
+@same_content_files('Hi', 'df/f11')
+def test_dir_fds_move_fallback(duplicates_dir):
+    os.mkdir('df/d')
+    plan = Plan()
+    plan.add(PlannedOp(OpKind.MOVE, abs_path('df/f11'), abs_path('df/d')))
+    with DirFds() as dir_fds:
+        # Renaming a file to an existing directory fails, shutil.move moves into the directory
+        plan.execute(dir_fds=dir_fds)
+    assert Path('df/d/f11').exists()
@@ -0,0 +1,105 @@
+from pathlib import Path
+
+from file_groups.groups import FileGroups
+from file_groups.compare_files import CompareFiles
+from file_groups.duplicates import FindDuplicates
+
+from .conftest import same_content_files, different_content_files, empty_files, hardlink_files
+
+
+def _rel(paths):
+    cwd = str(Path.cwd()) + '/'
+    return sorted(path.replace(cwd, '') for path in paths)
+
+
+def _dups(finder):
+    return sorted((_rel(dup.must_protect), _rel(dup.may_work_on)) for dup in finder.find())
+
+
+@same_content_files("Hi", 'ki/f11', 'df/f11', 'df/f12')
+@same_content_files("Hello", 'ki/f21', 'ki/f22')
+@same_content_files("Hej", 'df/f31', 'df/f32')
+@different_content_files("base", 'ki/f41', 'df/f42')
+@different_content_files("unique size", 'df/f5')
+def test_find_duplicates(duplicates_dir):
+    finder = FindDuplicates(FileGroups(['ki'], ['df']))
+    assert _dups(finder) == [
+        ([], ['df/f31', 'df/f32']),
+        (['ki/f11'], ['df/f11', 'df/f12']),
+    ]
+    assert finder.num_duplicate_sets == 2
+    assert finder.num_full_hashed == 0
+
+
+@same_content_files("A longer content, more than twice the sample size", 'ki/f11', 'df/f11')
+@different_content_files("Same size head and tail", 'ki/f21', 'df/f21')
+def test_find_duplicates_full_hash(duplicates_dir):
+    Path('ki/f21').write_text("Head xxxxx tail", encoding='utf-8')
+    Path('df/f21').write_text("Head yyyyy tail", encoding='utf-8')
+
+    finder = FindDuplicates(FileGroups(['ki'], ['df']), sample_size=4)
+    assert _dups(finder) == [(['ki/f11'], ['df/f11'])]
+    assert finder.num_sample_hashed == 4
+    assert finder.num_full_hashed == 4
+    assert finder.num_bytes_read == 4 * 2 * 4 + 2 * len("Head xxxxx tail") + 2 * Path('ki/f11').stat().st_size
+
+
+@same_content_files("Hi", 'ki/f11')
+@hardlink_files([('ki/f11', 'df/f11'), ('ki/f11', 'df/f12')])
+@same_content_files("Hi", 'df/f21')
+@hardlink_files([('df/f21', 'df/f22')])
+def test_find_duplicates_hardlinks(duplicates_dir):
+    finder = FindDuplicates(FileGroups(['ki'], ['df']))
+    assert _dups(finder) == [(['ki/f11'], ['df/f11', 'df/f12', 'df/f21', 'df/f22'])]
+    assert finder.num_sample_hashed == 2
+
+
+@same_content_files("Hi", 'ki/f11')
+@hardlink_files([('ki/f11', 'df/f11')])
+@same_content_files("Hello", 'df/f21')
+@hardlink_files([('df/f21', 'df/f22')])
+@different_content_files("Hel", 'df/f3')
+def test_find_duplicates_hardlinks_only_do_not_read_data(duplicates_dir):
+    finder = FindDuplicates(FileGroups(['ki'], ['df']))
+    assert _dups(finder) == [([], ['df/f21', 'df/f22']), (['ki/f11'], ['df/f11'])]
+    assert finder.num_bytes_read == 0
+
+
+@same_content_files("Hi", 'ki/f11', 'ki/f12')
+@different_content_files("Hi", 'df/f1')
+@empty_files('ki/e1', 'df/e1', 'df/e2')
+def test_find_duplicates_protected_only_and_empty(duplicates_dir):
+    finder = FindDuplicates(FileGroups(['ki'], ['df']))
+    assert not _dups(finder)
+    assert finder.num_bytes_read == 0
+
+    finder = FindDuplicates(FileGroups(['ki'], ['df']), min_size=0)
+    assert _dups(finder) == [(['ki/e1'], ['df/e1', 'df/e2'])]
+
+
+class _FalseCompareFiles(CompareFiles):
+    def compare(self, fsp1, fsp2):
+        return fsp1.name[-1] == fsp2.name[-1]
+
+
+@same_content_files("Hi", 'ki/f11', 'df/f11', 'df/f12', 'df/f22')
+def test_find_duplicates_confirm(duplicates_dir, log_debug):
+    finder = FindDuplicates(FileGroups(['ki'], ['df']), fcmp=CompareFiles())
+    assert _dups(finder) == [(['ki/f11'], ['df/f11', 'df/f12', 'df/f22'])]
+    assert finder.num_compared == 3
+
+    finder = FindDuplicates(FileGroups(['ki'], ['df']), fcmp=_FalseCompareFiles())
+    assert _dups(finder) == [([], ['df/f12', 'df/f22']), (['ki/f11'], ['df/f11'])]
+    assert finder.num_compared == 3 + 1
+
+    finder.stats()
+    assert "duplicate sets: 2" in log_debug.text
+    assert "compared files: 4" in log_debug.text
+
+
+@same_content_files("Hi", 'ki/f11', 'df/f11')
+def test_find_duplicates_no_info_log_stats(duplicates_dir, caplog):
+    finder = FindDuplicates(FileGroups(['ki'], ['df']))
+    assert _dups(finder)
+    finder.stats()
+    assert "duplicate sets" not in caplog.text
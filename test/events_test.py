@@ -0,0 +1,76 @@
+import logging
+
+from file_groups.handler import FileHandler
+from file_groups.handler_compare import FileHandlerCompare
+from file_groups.compare_files import CompareFiles
+from file_groups.events import EventKind, Event, EventSink, LoggingEventSink
+from file_groups.trash import Trash
+
+from .conftest import same_content_files, symlink_files, hardlink_files, abs_path
+
+
+class _ListEventSink(EventSink):
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12', 'df/f13')
+@symlink_files([('f11', 'df/f11sym'), ('f11sym', 'df/f11symsym'), ('f12', 'df/f12sym'), ('../ki/f11', 'df/kisym')])
+def test_events_handler(duplicates_dir, caplog):
+    caplog.set_level(logging.DEBUG)
+    sink = _ListEventSink()
+    fh = FileHandler(['ki'], ['df'], dry_run=True, event_sink=sink)
+    fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+    fh.registered_delete(abs_path('df/f12'), None)
+    fh.registered_rename(abs_path('df/f13'), 'df/f23')
+    fh.registered_replace_with_link(abs_path('df/f23'), 'ki/f11')
+
+    assert sink.events == [
+        Event(EventKind.DELETE, abs_path('df/f11')),
+        Event(EventKind.SYMLINKED, abs_path('df/f11sym'), abs_path('df/f11')),
+        Event(EventKind.RELINK, abs_path('df/f11sym'), abs_path('ki/f11'), abs_path('df/f11')),
+        Event(EventKind.DELETE, abs_path('df/f12')),
+        Event(EventKind.SYMLINKED, abs_path('df/f12sym'), abs_path('df/f12')),
+        Event(EventKind.DELETE, abs_path('df/f12sym')),
+        Event(EventKind.RENAME, abs_path('df/f13'), 'df/f23'),
+        Event(EventKind.REPLACE, abs_path('df/f23'), abs_path('ki/f11'), "hard link"),
+    ]
+    # Nothing is logged by the handler
+    assert not [rec for rec in caplog.records if rec.name == 'file_groups.handler' and rec.levelno == logging.INFO]
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+@symlink_files([('f11', 'df/f11sym')])
+def test_events_logging(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=True, trash=Trash(['.'], run='run1'))
+    fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+    fh.registered_move(abs_path('df/f12'), 'ki/f22')
+
+    assert f"    deleting: {abs_path('df/f11')} (to trash {abs_path('.file_groups_trash/run1/df/f11')})" in log_debug.text
+    assert f"Changing symlink: '{abs_path('df/f11sym')}' -> '{abs_path('ki/f11')}' (was -> {abs_path('df/f11')})" in log_debug.text
+    assert f"    moving: {abs_path('df/f12')} to ki/f22" in log_debug.text
+    assert "file_groups.handler" in [rec.name for rec in log_debug.records]
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f12')
+@hardlink_files([('ki/f11', 'df/f11')])
+def test_events_compare(duplicates_dir, caplog):
+    sink = _ListEventSink()
+    fh = FileHandlerCompare(['ki'], ['df'], CompareFiles(), dry_run=True, event_sink=sink)
+    assert fh.compare('df/f11', 'ki/f11')
+    assert fh.compare('df/f12', 'ki/f11')
+    assert sink.events == [
+        Event(EventKind.DUPLICATE_HARDLINK, 'df/f11', 'ki/f11'),
+        Event(EventKind.DUPLICATE, 'df/f12', 'ki/f11'),
+    ]
+
+    caplog.set_level(logging.WARNING)
+    LoggingEventSink().emit(sink.events[0])
+    assert not caplog.text
+    caplog.set_level(logging.INFO)
+    LoggingEventSink().emit(sink.events[0])
+    assert caplog.records[-1].name == 'file_groups.handler_compare'
+    assert caplog.records[-1].getMessage() == "Duplicates (hard links): 'df/f11' 'ki/f11'"
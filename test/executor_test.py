@@ -0,0 +1,86 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import pytest
+
+from file_groups.executor import ConcurrentExecutor
+from file_groups.handler import FileHandler
+from file_groups.plan import PlannedOp, OpKind
+from file_groups.dir_fds import DirFds
+
+from .conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'df/a/f1', 'df/a/f2', 'df/b/f3')
+def test_executor_order(duplicates_dir):
+    with ConcurrentExecutor(max_workers=4, max_pending=2) as executor:
+        # Renames in the same directory must be done in order
+        for idx in range(20):
+            executor.submit(PlannedOp(OpKind.RENAME, abs_path(f'df/a/f{1 + idx % 2}'), abs_path(f'df/a/t{idx}')))
+            executor.submit(PlannedOp(OpKind.RENAME, abs_path(f'df/a/t{idx}'), abs_path(f'df/a/f{1 + idx % 2}')))
+        # Across directories
+        executor.submit(PlannedOp(OpKind.MOVE, abs_path('df/b/f3'), abs_path('df/a/f3')))
+        executor.submit(PlannedOp(OpKind.MOVE, abs_path('df/a/f3'), abs_path('df/b/f4')))
+        executor.join()
+        assert executor.num_executed == 42
+        assert not executor.failed
+
+    assert count_files({'df/a': 2, 'df/b': 1})
+
+
+@same_content_files('Hi', 'df/f1', 'df/f2')
+def test_executor_failed_and_skipped(duplicates_dir):
+    done = []
+    with ConcurrentExecutor(max_workers=2, dir_fds=DirFds()) as executor:
+        fut = executor.submit(PlannedOp(OpKind.DELETE, abs_path('df/nosuchfile')))
+        fut = executor.submit(PlannedOp(OpKind.DELETE, abs_path('df/f1')), after=fut, on_done=done.append)
+        fut = executor.submit(PlannedOp(OpKind.DELETE, abs_path('df/f2')), after=fut, on_done=done.append)
+        with pytest.raises(RuntimeError):
+            fut.result()
+        executor.join()
+
+    assert isinstance(executor.failed[0][1], FileNotFoundError)
+    assert [op.path for op, _ in executor.failed] == [abs_path('df/nosuchfile'), abs_path('df/f1'), abs_path('df/f2')]
+    assert executor.num_skipped == 2
+    assert not done
+    assert count_files({'df': 2})
+
+
+@same_content_files('Hi', 'df/a', 'df2/x')
+def test_executor_hardlink_order(duplicates_dir):
+    with ConcurrentExecutor() as executor:
+        # The file linked to is created by an operation in another directory
+        before = Future()
+        executor.submit(PlannedOp(OpKind.RENAME, abs_path('df2/x'), abs_path('df2/k')), after=before)
+        fut = executor.submit(PlannedOp(OpKind.HARDLINK, abs_path('df/a'), abs_path('df2/k')))
+        threading.Timer(0.05, before.set_result, [None]).start()
+        fut.result()
+        executor.join()
+        assert not executor.failed
+
+    assert os.path.samefile('df/a', 'df2/k')
+    assert count_files({'df': 1, 'df2': 1})
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12', 'df/f13', 'df/f14', 'df/f15', 'df/f16')
+@symlink_files([('f11', 'df/f11sym'), ('f12', 'df/f12sym'), ('f13', 'df/f13sym'), ('f14', 'df/f14sym'), ('f11sym', 'df/f11symsym')])
+def test_executor_handler(duplicates_dir, log_debug):
+    with ConcurrentExecutor(max_workers=4) as executor:
+        fh = FileHandler(['ki'], ['df'], dry_run=False, executor=executor)
+        with ThreadPoolExecutor(3) as pool:
+            list(pool.map(lambda fn: fh.registered_delete(abs_path(fn), 'ki/f11'), ['df/f11', 'df/f12', 'df/f13']))
+        fh.registered_delete_many([(abs_path('df/f14'), None)])
+        fh.registered_move_many([(abs_path('df/f15'), 'df/f25')])
+        fh.registered_rename(abs_path('df/f16'), 'df/f26')
+        executor.join()
+
+    assert not executor.failed
+    assert fh.num_deleted == 5
+    assert fh.num_relinked == 3
+    assert fh.num_moved == 1
+    assert fh.num_renamed == 1
+    assert len(fh.plan) == 10
+    for fn in ('df/f11sym', 'df/f12sym', 'df/f13sym'):
+        assert os.readlink(fn) == abs_path('ki/f11')
+    assert count_files({'ki': 1, 'df': 6})
@@ -225,6 +225,29 @@ def test_file_groups_unrelated_dirs_hardlinks_within_work_on(duplicates_dir):
     with FGC(FileGroups(["ki"], ["df"]), duplicates_dir) as ck:
         assert ck.ckfl('must_protect.files', 'ki/f12', 'ki/f22', 'ki/f32')
         assert ck.ckfl('may_work_on.files', 'df/f11', 'df/f21', 'df/f31', 'df/f41', 'df/f41hard')
+        assert not ck.fg.must_protect.files_by_inode
+        assert len(ck.fg.may_work_on.files_by_inode) == 1
+        assert ckfl('may_work_on.files_by_inode', [entry.path for entry in ck.fg.may_work_on.files_by_inode.popitem()[1]], 'df/f41', 'df/f41hard')
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+@same_content_files('Whatever', 'ki/f41')
+@hardlink_files([('ki/f41', 'df/f41hard'), ('ki/f41', 'ki/f41hard')])
+def test_file_groups_unrelated_dirs_hardlinks_across_groups(duplicates_dir, log_debug):
+    """Unrelated work_on and protect dirs - hardlinks to protected file in both protect and work_on dirs"""
+    with FGC(FileGroups(["ki"], ["df"]), duplicates_dir) as ck:
+        assert ck.ckfl('must_protect.files', 'ki/f12', 'ki/f41', 'ki/f41hard')
+        assert ck.ckfl('may_work_on.files', 'df/f11', 'df/f41hard')
+
+        (prot_inode, prot_entries), = ck.fg.must_protect.files_by_inode.items()
+        (work_inode, work_entries), = ck.fg.may_work_on.files_by_inode.items()
+        assert prot_inode == work_inode
+        assert ckfl('must_protect.files_by_inode', [entry.path for entry in prot_entries], 'ki/f41', 'ki/f41hard')
+        assert ckfl('may_work_on.files_by_inode', [entry.path for entry in work_entries], 'df/f41hard')
+
+        ck.fg.dump()
+        assert "hard linked files by inode:" in log_debug.text
+        assert f"MAY_WORK_ON {work_inode}: ['{duplicates_dir}/df/f41hard']" in log_debug.text
 
 
 @same_content_files("Hejsa", 'ki1/df/f11', 'ki1/df/ki12/f11', 'ki1/df/ki13/f11', 'ki1/df/ki13/ki14/f11', 'ki1/df/ki13/df12/f11', 'ki1/f11', 'df2/f11')
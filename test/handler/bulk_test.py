@@ -0,0 +1,106 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from file_groups.handler import FileHandler
+
+from ..conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'ki/f11', 'df/a/f11', 'df/b/f12', 'df/a/f13', 'df/b/f14')
+@symlink_files([('f11', 'df/a/f11sym'), ('f12', 'df/b/f12sym')])
+def test_registered_delete_many(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=True)
+    deletes = [(abs_path('df/a/f11'), 'ki/f11'), (abs_path('df/b/f12'), None), (abs_path('df/a/f13'), None), (abs_path('df/b/f14'), 'ki/f11')]
+
+    res = fh.registered_delete_many(deletes)
+    assert res.ok
+    assert res.num_done == 4
+    assert res.num_dirs == 2
+    assert fh.num_deleted == 5
+    assert fh.num_relinked == 1
+    assert count_files({'ki': 1, 'df': 6})
+
+    fh.dry_run = False
+    fh.reset()
+    res = fh.registered_delete_many(iter(deletes))
+    assert res.ok
+    assert fh.num_deleted == 5
+    assert os.readlink('df/a/f11sym') == abs_path('ki/f11')
+    assert count_files({'ki': 1, 'df': 1})
+    # Grouped by directory
+    assert [op.path for op in fh.plan][:3] == [abs_path('df/a/f11'), abs_path('df/a/f11sym'), abs_path('df/a/f13')]
+
+
+@same_content_files('Hi', 'df/a', 'df/b')
+@symlink_files([('a', 'df/s')])
+def test_registered_delete_many_chained(duplicates_dir, log_debug):
+    # The symlink is relinked to 'b' by the first delete, and must be deleted with 'b'
+    fh = FileHandler([], ['df'], dry_run=True)
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+        res = fh.registered_delete_many([(abs_path('df/a'), 'df/b'), (abs_path('df/b'), None)])
+        assert res.ok
+        assert fh.num_relinked == 1
+        assert fh.num_deleted == 3
+        assert abs_path('df/s') not in fh.symlink_graph.points_to
+
+    assert count_files({'df': 0})
+    assert not os.path.lexists('df/s')
+
+
+@same_content_files('Hi', 'df/a', 'df/b')
+@symlink_files([('a', 'df/s')])
+def test_registered_rename_many_chained(duplicates_dir, log_debug):
+    fh = FileHandler([], ['df'], dry_run=False)
+    res = fh.registered_rename_many([(abs_path('df/a'), 'df/c'), (abs_path('df/c'), 'df/d')])
+    assert res.ok
+    assert fh.num_relinked == 2
+    assert os.readlink('df/s') == 'd'
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+def test_registered_delete_many_failed(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=False)
+    os.unlink('df/f11')
+    res = fh.registered_delete_many([(abs_path('df/f11'), None), (abs_path('df/f12'), None)])
+    assert not res.ok
+    assert res.num_done == 1
+    assert list(res.failed) == [abs_path('df/f11')]
+    assert isinstance(res.failed[abs_path('df/f11')], FileNotFoundError)
+    assert len(fh.plan) == 1
+    assert count_files({'df': 0})
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+def test_registered_delete_many_protected(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=False)
+    with pytest.raises(AssertionError, match="Oops, trying to delete protected"):
+        fh.registered_delete_many([(abs_path('df/f11'), None), (abs_path('ki/f11'), None)])
+    # Nothing done
+    assert count_files({'ki': 1, 'df': 2})
+
+    with pytest.raises(AssertionError, match="Expected absolute paths"):
+        fh.registered_delete_many([('df/f11', None)])
+
+
+@same_content_files('Hi', 'ki/f11', 'df/a/f11', 'df/b/f12')
+@symlink_files([('f11', 'df/a/f11sym')])
+def test_registered_rename_and_move_many(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=False)
+    res = fh.registered_rename_many([(abs_path('df/a/f11'), 'df/a/f21'), (abs_path('df/b/f12'), 'df/b/f22')])
+    assert res.ok
+    assert res.num_done == 2
+    assert fh.num_renamed == 2
+    assert os.readlink('df/a/f11sym') == 'f21'
+
+    res = fh.registered_move_many([(abs_path('df/a/f21'), Path('ki/f31')), (abs_path('df/b/f22'), 'ki/f32'), (abs_path('df/b/nosuchfile'), 'ki/f33')])
+    assert fh.num_moved == 2
+    assert list(res.failed) == [abs_path('df/b/nosuchfile')]
+    assert count_files({'ki': 3, 'df': 1})
+    assert os.readlink('df/a/f11sym') == abs_path('ki/f31')
+
+    with pytest.raises(AssertionError, match="Oops, trying to overwrite protected"):
+        fh.registered_move_many([(abs_path('df/a/f11sym'), 'ki/f11')])
@@ -0,0 +1,92 @@
+import os
+import re
+from pathlib import Path
+
+import pytest
+
+from file_groups.handler import FileHandler
+from file_groups.config_files import ConfigFiles
+
+from ..conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+@symlink_files([('f11', 'df/f11sym'), ('../df/f12', 'ki/f12sym')])
+def test_chained_passes(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=True)
+
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+        assert abs_path('df/f11') in fh.may_work_on.files
+
+        # Dedupe pass
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        assert abs_path('df/f11') not in fh.may_work_on.files
+        assert [entry.path for entry in fh.may_work_on.symlinks_by_abs_points_to[abs_path('ki/f11')]] == [abs_path('df/f11sym')]
+        assert abs_path('df/f11') not in fh.may_work_on.symlinks_by_abs_points_to
+
+        # Rename pass
+        fh.registered_rename(abs_path('df/f12'), 'df/f22')
+        assert fh.may_work_on.files[abs_path('df/f22')].name == 'f22'
+        assert [entry.path for entry in fh.must_protect.symlinks_by_abs_points_to[abs_path('df/f22')]] == [abs_path('ki/f12sym')]
+
+        # Move pass, the moved file is protected
+        fh.registered_move(abs_path('df/f22'), 'ki/f32')
+        assert abs_path('df/f22') not in fh.may_work_on.files
+        assert abs_path('ki/f32') in fh.must_protect.files
+        assert fh.moved_from == {abs_path('ki/f32'): abs_path('df/f12')}
+        with pytest.raises(AssertionError, match="Oops, trying to delete protected file"):
+            fh.registered_delete(abs_path('ki/f32'), None)
+
+    assert os.readlink('ki/f12sym') == 'f32'
+    assert count_files({'ki': 3, 'df': 1})
+
+
+@same_content_files('Hi', 'df/a/f11', 'df/b/f21')
+@symlink_files([('f11', 'df/a/f11sym'), ('f11sym', 'df/a/f11symsym')])
+def test_chained_moved_symlinks(duplicates_dir, log_debug):
+    fh = FileHandler([], ['df'], dry_run=True)
+
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+
+        # Relative symlink moved to another directory points to a file in that directory
+        fh.registered_rename(abs_path('df/a/f11sym'), 'df/a/f12sym')
+        fh.registered_move(abs_path('df/a/f12sym'), 'df/b/f11sym')
+        assert fh.symlink_graph.points_to[abs_path('df/b/f11sym')] == abs_path('df/b/f11')
+        assert [entry.path for entry in fh.may_work_on.symlinks_by_abs_points_to[abs_path('df/b/f11')]] == [abs_path('df/b/f11sym')]
+        assert fh.symlink_graph.final_target(abs_path('df/a/f11symsym')) == abs_path('df/b/f11')
+
+        fh.registered_rename(abs_path('df/b/f21'), 'df/b/f11')
+        assert fh.symlink_graph.final_target(abs_path('df/a/f11symsym')) == abs_path('df/b/f11')
+        assert os.fspath(fh.may_work_on.files[abs_path('df/b/f11')]) == abs_path('df/b/f11')
+        assert fh.may_work_on.symlinks[abs_path('df/b/f11sym')].is_symlink()
+        assert repr(fh.may_work_on.symlinks[abs_path('df/b/f11sym')]) == "<_MovedEntry 'f11sym'>"
+
+    assert os.readlink('df/b/f11sym') == 'f11'
+    assert os.readlink('df/a/f11symsym') == abs_path('df/b/f11sym')
+    assert Path('df/a/f11symsym').read_text(encoding='utf-8') == 'Hi'
+
+
+@same_content_files('Hi', 'df/f11', 'df/x.txt', 'df/f12')
+@symlink_files([('x.txt', 'df/xsym')])
+def test_chained_not_collected(duplicates_dir, log_debug):
+    fh = FileHandler([], ['df'], dry_run=False, work_include=re.compile(r'f1'),
+                     config_files=ConfigFiles(protect=[re.compile('p.*')]))
+    assert abs_path('df/x.txt') not in fh.may_work_on.files
+
+    # Not collected
+    fh.registered_rename(abs_path('df/x.txt'), 'df/f13')
+    assert "Keeping symlink pointing outside delete-dirs" in log_debug.text
+    assert abs_path('df/f13') not in fh.may_work_on.files
+
+    # Protected by config
+    fh.registered_rename(abs_path('df/f11'), 'df/p11')
+    assert abs_path('df/p11') in fh.must_protect.files
+
+    # Config file
+    fh.registered_rename(abs_path('df/f12'), 'df/file_groups.conf')
+    assert abs_path('df/file_groups.conf') not in fh.must_protect.files
+    assert abs_path('df/file_groups.conf') not in fh.may_work_on.files
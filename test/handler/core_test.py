@@ -6,7 +6,7 @@ import pytest
 
 from file_groups.handler import FileHandler
 
-from ..conftest import same_content_files, symlink_files, count_files
+from ..conftest import same_content_files, symlink_files, hardlink_files, count_files
 from .utils import FP
 
 
@@ -441,3 +441,29 @@ def test_no_info_log_stats(duplicates_dir, caplog):
     out = caplog.text
     assert "DRY" not in out
     assert "deleted: " not in out
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11')
+@hardlink_files([('df/f11', 'df/f11hard1'), ('df/f11', 'df/f11hard2')])
+def test_delete_hardlinked(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=True)
+
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+        fh.registered_delete(str(Path('df/f11hard1').absolute()), 'ki/f11')
+        assert "2 other hard link(s) to" in log_debug.text
+        fh.registered_delete(str(Path('df/f11').absolute()), 'ki/f11')
+        assert "1 other hard link(s) to" in log_debug.text
+        assert fh.num_deleted == 2
+        assert fh.num_deleted_hardlinks == 2
+
+        log_debug.clear()
+        fh.registered_delete(str(Path('df/f11hard2').absolute()), 'ki/f11')
+        assert "other hard link(s)" not in log_debug.text
+        assert fh.num_deleted == 3
+        assert fh.num_deleted_hardlinks == 2
+
+    fh.stats()
+    assert "deleted hard links (no space freed): 2" in log_debug.text
+    assert count_files({'df': 0})
@@ -0,0 +1,133 @@
+import os
+import errno
+import fcntl
+import shutil
+from pathlib import Path
+
+import pytest
+
+from file_groups.handler import FileHandler
+from file_groups.plan import OpKind
+from file_groups.journal import Journal
+
+from ..conftest import same_content_files, symlink_files, hardlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+@symlink_files([('f11', 'df/f11sym')])
+def test_replace_with_hardlink(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=True)
+
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+        res = fh.registered_replace_with_link(abs_path('df/f11'), 'ki/f11')
+        assert res == Path(abs_path('ki/f11'))
+        assert fh.num_replaced_with_link == 1
+        assert fh.num_relinked == 0
+        assert [op.kind for op in fh.plan] == [OpKind.HARDLINK]
+        assert os.path.samefile('df/f11', 'ki/f11') != dry
+
+        # The groups know that the files are hard links
+        st = fh.may_work_on.files[abs_path('df/f11')].stat(follow_symlinks=False)
+        assert st.st_ino == os.stat('ki/f11').st_ino
+
+    assert os.readlink('df/f11sym') == 'f11'
+    assert Path('df/f11sym').read_text(encoding='utf-8') == 'Hi'
+    assert not Path('df/.f11.link.tmp').exists()
+    assert count_files({'ki': 1, 'df': 3})
+
+    fh.stats()
+    assert "replaced with link: 1" in log_debug.text
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+@hardlink_files([('df/f12', 'df/f13')])
+def test_replace_with_hardlink_link_counts(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=True)
+
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+        fh.registered_replace_with_link(abs_path('df/f11'), 'ki/f11')
+        fh.registered_replace_with_link(abs_path('df/f12'), 'ki/f11')
+
+        # Both names of the linked file are known as hard links
+        ki_st = os.stat('ki/f11')
+        inode = (ki_st.st_dev, ki_st.st_ino)
+        assert sorted(entry.path for entry in fh.must_protect.files_by_inode[inode]) == [abs_path('ki/f11')]
+        assert sorted(entry.path for entry in fh.may_work_on.files_by_inode[inode]) == [abs_path('df/f11'), abs_path('df/f12')]
+        assert fh.must_protect.files[abs_path('ki/f11')].stat(follow_symlinks=False).st_nlink == 3
+        assert fh.may_work_on.files[abs_path('df/f11')].stat(follow_symlinks=False).st_nlink == 3
+
+        # The remaining name of the replaced file is no longer a hard link
+        f13_st = fh.may_work_on.files[abs_path('df/f13')].stat(follow_symlinks=False)
+        assert f13_st.st_nlink == 1
+        assert not fh.may_work_on.files_by_inode.get((f13_st.st_dev, f13_st.st_ino))
+
+        # Replacing a hard link to the file changes nothing
+        fh.registered_replace_with_link(abs_path('df/f11'), 'ki/f11')
+        assert fh.may_work_on.files[abs_path('df/f11')].stat(follow_symlinks=False).st_nlink == 3
+
+        # Deleting a name of the linked file frees no space
+        fh.registered_delete(abs_path('df/f11'), None)
+        assert fh.num_deleted_hardlinks == 1
+
+    assert count_files({'ki': 1, 'df': 2})
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11')
+@symlink_files([('f11', 'df/f11sym')])
+def test_replace_with_link_protected(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=False)
+    with pytest.raises(AssertionError, match="Oops, trying to replace protected file"):
+        fh.registered_replace_with_link(abs_path('ki/f11'), 'df/f11')
+    with pytest.raises(AssertionError, match="Oops, trying to replace symlink"):
+        fh.registered_replace_with_link(abs_path('df/f11sym'), 'ki/f11')
+    assert count_files({'ki': 1, 'df': 2})
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11')
+def test_replace_with_reflink(duplicates_dir, log_debug):
+    os.chmod('df/f11', 0o640)
+    fh = FileHandler(['ki'], ['df'], dry_run=False)
+    try:
+        fh.registered_replace_with_link(abs_path('df/f11'), 'ki/f11', reflink=True)
+    except OSError as ex:
+        # Not supported by the file system
+        assert ex.errno in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY)
+        assert fh.num_replaced_with_link == 0
+    else:
+        assert fh.num_replaced_with_link == 1
+        assert not os.path.samefile('df/f11', 'ki/f11')
+
+    assert os.stat('df/f11').st_mode & 0o777 == 0o640
+    assert Path('df/f11').read_text(encoding='utf-8') == 'Hi'
+    assert count_files({'ki': 1, 'df': 1})
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11')
+def test_replace_with_reflink_emulated(duplicates_dir, log_debug, monkeypatch):
+    def ficlone(fd, request, src_fd):
+        with os.fdopen(os.dup(src_fd), 'rb') as fsrc, os.fdopen(os.dup(fd), 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst)
+
+    monkeypatch.setattr(fcntl, 'ioctl', ficlone)
+    # Left over from interrupted operation
+    Path('df/.f11.link.tmp').write_text('Oops', encoding='utf-8')
+
+    with Journal('journal.jsonl') as journal:
+        fh = FileHandler(['ki'], ['df'], dry_run=True, journal=journal)
+        fh.registered_replace_with_link(abs_path('df/f11'), 'ki/f11', reflink=True)
+        fh.registered_replace_with_link(abs_path('df/f11'), 'ki/f11')
+        assert journal.resume() == 2
+        assert os.path.samefile('df/f11', 'ki/f11')
+
+        # Done operations not recorded as completed, the hard link is detected as done, the reflink is done again
+        journal.completed.discard(1)
+        assert journal.resume() == 0
+        journal.completed.discard(0)
+        assert journal.resume() == 1
+        assert not os.path.samefile('df/f11', 'ki/f11')
+
+    assert count_files({'ki': 1, 'df': 1})
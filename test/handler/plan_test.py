@@ -0,0 +1,64 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from file_groups.handler import FileHandler
+from file_groups.plan import OpKind, PlannedOp, Plan
+
+from ..conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12', 'df/f13')
+@symlink_files([('f11', 'df/f11sym'), ('f12', 'df/f12sym')])
+def test_plan_dry_run_execute_later(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=True)
+    fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+    fh.registered_delete(abs_path('df/f12'), None)
+    fh.registered_rename(abs_path('df/f13'), 'df/f14')
+    fh.registered_move(abs_path('df/f14'), 'ki/f15')
+
+    assert list(fh.plan) == [
+        PlannedOp(OpKind.DELETE, abs_path('df/f11')),
+        PlannedOp(OpKind.RELINK, abs_path('df/f11sym'), abs_path('ki/f11')),
+        PlannedOp(OpKind.DELETE, abs_path('df/f12')),
+        PlannedOp(OpKind.DELETE, abs_path('df/f12sym')),
+        PlannedOp(OpKind.RENAME, abs_path('df/f13'), abs_path('df/f14')),
+        PlannedOp(OpKind.MOVE, abs_path('df/f14'), abs_path('ki/f15')),
+    ]
+    assert fh.plan.counts() == {OpKind.DELETE: 3, OpKind.RENAME: 1, OpKind.MOVE: 1, OpKind.RELINK: 1, OpKind.HARDLINK: 0, OpKind.REFLINK: 0, OpKind.TRASH: 0}
+    assert count_files({'ki': 1, 'df': 5})
+
+    fh.plan.execute()
+    assert fh.plan.num_executed == 6
+    assert count_files({'ki': 2, 'df': 1})
+    assert os.readlink('df/f11sym') == abs_path('ki/f11')
+    assert Path('ki/f15').read_text(encoding='utf-8') == 'Hi'
+
+    fh.reset()
+    assert not fh.plan
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11')
+def test_plan_recorded_in_actual_run(duplicates_dir, log_debug):
+    fh = FileHandler(['ki'], ['df'], dry_run=False)
+    fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+    assert list(fh.plan) == [PlannedOp(OpKind.DELETE, abs_path('df/f11'))]
+    assert count_files({'ki': 1, 'df': 0})
+
+
+@same_content_files('Hi', 'df/f11', 'df/f12', 'df/f13')
+def test_plan_resume(duplicates_dir, log_debug):
+    plan = Plan()
+    for fn in ('df/f11', 'df/f12', 'df/f13'):
+        plan.add(PlannedOp(OpKind.DELETE, abs_path(fn)))
+    assert len(plan) == 3
+
+    os.unlink('df/f12')
+    with pytest.raises(FileNotFoundError):
+        plan.execute()
+    assert plan.num_executed == 1
+
+    plan.execute(start=plan.num_executed + 1)
+    assert plan.num_executed == 3
+    assert count_files({'df': 0})
@@ -1,9 +1,15 @@
 from pathlib import Path
 
+import pytest
+
 from file_groups.compare_files import CompareFiles
 from file_groups.handler_compare import FileHandlerCompare
+from file_groups.executor import ConcurrentExecutor
+from file_groups.rate_limiter import RateLimiter
+from file_groups.trash import Trash
+from file_groups.plan import OpKind
 
-from .conftest import same_content_files, different_content_files
+from .conftest import same_content_files, different_content_files, hardlink_files, count_files
 from .handler.utils import FP
 
 
@@ -43,3 +49,77 @@ def test_file_handler_compare_different_moved_files(duplicates_dir, log_debug):
     assert not fh.compare(Path('ki/x'), Path('ki/z'))
     ck.check_move(dry=False)
     assert not fh.compare(Path('ki/x'), Path('ki/z'))
+
+
+class _NoCompareFiles(CompareFiles):
+    def compare(self, fsp1, fsp2):
+        raise AssertionError("Hard links should not be compared by content")
+
+
+@same_content_files('Hi', 'ki/x')
+@hardlink_files([('ki/x', 'df/y')])
+def test_file_handler_compare_hardlinked_files(duplicates_dir, log_debug):
+    fh = FileHandlerCompare(['ki'], ['df'], _NoCompareFiles(), dry_run=True)
+    assert fh.compare(Path('df/y'), Path('ki/x'))
+    fh.dry_run = False
+    assert fh.compare(Path('df/y'), Path('ki/x'))
+    assert "Duplicates (hard links): 'df/y' 'ki/x'" in log_debug.text
+
+
+@same_content_files('Hi', 'ki/x', 'df/y', 'outside/z')
+def test_file_handler_compare_not_collected_files(duplicates_dir):
+    fh = FileHandlerCompare(['ki'], ['df'], CompareFiles(), dry_run=False)
+    assert fh.compare(Path('df/y'), Path('outside/z'))
+    assert fh.compare(Path('df/y'), Path('ki/x'))
+
+
+@same_content_files('Hi', 'ki/x', 'df/y')
+@different_content_files("oops", 'ki/a', 'df/b')
+def test_file_handler_compare_many(duplicates_dir, log_debug):
+    fh = FileHandlerCompare(['ki'], ['df'], CompareFiles(), dry_run=True)
+    ck = FP(fh, str(Path('df/y').absolute()), 'ki/z', log_debug)
+    ck.check_move(dry=True)
+    pairs = [(Path('ki/x'), Path('ki/z')), (Path('ki/a'), Path('df/b'))]
+    assert list(fh.compare_many(pairs, max_workers=2)) == [(Path('ki/x'), Path('ki/z'), True), (Path('ki/a'), Path('df/b'), False)]
+    assert "Duplicates: 'ki/x' 'ki/z'" in log_debug.text
+
+
+@same_content_files('Hi', 'ki/x', 'df/y', 'df/z')
+def test_file_handler_compare_deleted_or_moved_files(duplicates_dir, log_debug):
+    fh = FileHandlerCompare(['ki'], ['df'], CompareFiles(), dry_run=True)
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+        fh.registered_delete(str(Path('df/y').absolute()), 'ki/x')
+        fh.registered_rename(str(Path('df/z').absolute()), 'df/z2')
+        with pytest.raises(FileNotFoundError, match="'df/y' has been deleted or moved away"):
+            fh.compare(Path('df/y'), Path('ki/x'))
+        with pytest.raises(FileNotFoundError, match="'df/z' has been deleted or moved away"):
+            fh.compare(Path('ki/x'), Path('df/z'))
+        assert fh.compare(Path('ki/x'), Path('df/z2'))
+
+
+@same_content_files('Hi', 'ki/x', 'df/y', 'df/z')
+def test_file_handler_compare_executor(duplicates_dir):
+    with ConcurrentExecutor() as executor:
+        fh = FileHandlerCompare(['ki'], ['df'], CompareFiles(), dry_run=False, executor=executor)
+        assert fh.executor is executor
+        assert fh.compare(Path('df/y'), Path('ki/x'))
+        fh.registered_delete(str(Path('df/y').absolute()), 'ki/x')
+        fh.registered_rename(str(Path('df/z').absolute()), 'df/z2')
+        executor.join()
+        assert not executor.failed
+        assert fh.compare(Path('ki/x'), Path('df/z2'))
+
+    assert count_files({'ki': 1, 'df': 1})
+
+
+@same_content_files('Hi', 'ki/x', 'df/y')
+def test_file_handler_compare_trash_rate_limiter(duplicates_dir):
+    rate_limiter = RateLimiter(ops_per_sec=1000.0, burst_seconds=0.0)
+    fh = FileHandlerCompare(['ki'], ['df'], CompareFiles(), dry_run=False, trash=Trash(['.'], run='run1'), rate_limiter=rate_limiter)
+    assert fh.compare(Path('df/y'), Path('ki/x'))
+    fh.registered_delete(str(Path('df/y').absolute()), 'ki/x')
+    assert [op.kind for op in fh.plan] == [OpKind.TRASH]
+    assert rate_limiter.num_waits > 0
+    assert count_files({'ki': 1, 'df': 0, '.file_groups_trash/run1/df': 1})
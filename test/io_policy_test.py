@@ -0,0 +1,111 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from file_groups import rate_limiter
+from file_groups.io_policy import IoPolicy
+from file_groups.compare_files import CompareFiles, BufferedCompareFiles, SparseCompareFiles, SampleCompareFiles
+from file_groups.groups import FileGroups
+from file_groups.duplicates import FindDuplicates
+from file_groups.digest_cache import DigestCache
+
+from .conftest import same_content_files
+
+
+@pytest.fixture(name="fadvise")
+def _fixture_fadvise(monkeypatch):
+    calls = []
+    real_fadvise = os.posix_fadvise
+
+    def fadvise(fd, offset, length, advice):
+        calls.append((os.readlink(f'/proc/self/fd/{fd}').split('/')[-1], offset, length, advice))
+        real_fadvise(fd, offset, length, advice)
+
+    monkeypatch.setattr(os, 'posix_fadvise', fadvise)
+    return calls
+
+
+def _advice(calls, name):
+    return [call[1:] for call in calls if call[0] == name]
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+def test_io_policy_advice(duplicates_dir, fadvise):
+    policy = IoPolicy(prefetch_size=1024)
+    fcmp = CompareFiles(io_policy=policy)
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    assert _advice(fadvise, 'f11') == [(0, 0, os.POSIX_FADV_SEQUENTIAL), (0, 1024, os.POSIX_FADV_WILLNEED), (0, 0, os.POSIX_FADV_DONTNEED)]
+    assert _advice(fadvise, 'f12') == _advice(fadvise, 'f11')
+
+    fadvise.clear()
+    policy = IoPolicy(sequential=False, prefetch_size=0, drop_cache=False)
+    fcmp = CompareFiles(io_policy=policy, cache_size=0)
+    assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+    policy.prefetch(Path('df/f11'))
+    assert not fadvise
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12', 'ki/f13')
+def test_io_policy_compare_variants(duplicates_dir, fadvise):
+    Path('ki/f14').write_text("Ho", encoding='utf-8')
+    for fcmp_cls in CompareFiles, BufferedCompareFiles, SparseCompareFiles, SampleCompareFiles:
+        fadvise.clear()
+        fcmp = fcmp_cls(io_policy=IoPolicy())
+        assert fcmp.compare(Path('df/f11'), Path('ki/f12'))
+        assert fcmp.compare_one_to_many(Path('df/f11'), [Path('ki/f13'), Path('ki/f14')]) == [Path('ki/f13')]
+        for name in 'f11', 'f12', 'f13', 'f14':
+            assert _advice(fadvise, name)[-1] == (0, 0, os.POSIX_FADV_DONTNEED)
+
+
+@same_content_files("Hi", 'df/f11', 'ki/f12')
+def test_io_policy_compare_many_prefetch(duplicates_dir, fadvise):
+    fcmp = CompareFiles(io_policy=IoPolicy(prefetch_size=4096, sequential=False, drop_cache=False))
+    assert list(fcmp.compare_many([(Path('df/f11'), Path('ki/f12'))])) == [(Path('df/f11'), Path('ki/f12'), True)]
+    # Prefetch when queued and when opened
+    assert _advice(fadvise, 'f11') == [(0, 4096, os.POSIX_FADV_WILLNEED)] * 2
+
+    fadvise.clear()
+    fcmp = CompareFiles(io_policy=IoPolicy(prefetch_size=0, sequential=False, drop_cache=False), cache_size=0)
+    assert list(fcmp.compare_many([(Path('df/f11'), Path('ki/f12'))])) == [(Path('df/f11'), Path('ki/f12'), True)]
+    assert not fadvise
+
+
+def test_io_policy_bandwidth_limit(monkeypatch):
+    now = [100.0]
+    sleeps = []
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(rate_limiter.time, 'sleep', sleeps.append)
+
+    policy = IoPolicy(max_bytes_per_sec=1000)
+    # Burst of one second
+    policy.consume(1000)
+    assert not sleeps
+    policy.consume(500)
+    assert sleeps == [0.5]
+
+    # Idle time does not accumulate more than one second of burst
+    now[0] += 10
+    policy.consume(1500)
+    assert sleeps == [0.5, 0.5]
+
+    IoPolicy().consume(10**12)
+    assert sleeps == [0.5, 0.5]
+
+
+@same_content_files("A longer content, more than twice the sample size", 'ki/f11', 'df/f11')
+def test_io_policy_hashing(duplicates_dir, fadvise, monkeypatch):
+    consumed = []
+    monkeypatch.setattr(IoPolicy, 'consume', lambda self, num_bytes: consumed.append(num_bytes))
+    size = Path('ki/f11').stat().st_size
+
+    finder = FindDuplicates(FileGroups(['ki'], ['df']), sample_size=4, io_policy=IoPolicy())
+    assert len(list(finder.find())) == 1
+    assert sum(consumed) == finder.num_bytes_read == 2 * 8 + 2 * size
+    assert _advice(fadvise, 'f11')[-1] == (0, 0, os.POSIX_FADV_DONTNEED)
+
+    consumed.clear()
+    with DigestCache('cache.db') as cache:
+        cache.digest(Path('ki/f11'), 'sha256', io_policy=IoPolicy())
+        cache.digest(Path('ki/f11'), 'sha256', io_policy=IoPolicy())
+    assert consumed == [size]
@@ -0,0 +1,88 @@
+import os
+import json
+from pathlib import Path
+
+import pytest
+
+from file_groups.handler import FileHandler
+from file_groups.journal import Journal
+from file_groups.plan import PlannedOp, OpKind
+
+from .conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+@symlink_files([('f11', 'df/f11sym')])
+def test_journal_handler(duplicates_dir, log_debug):
+    with Journal('journal.jsonl', sync_every=2) as journal:
+        fh = FileHandler(['ki'], ['df'], dry_run=False, journal=journal)
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        fh.registered_rename(abs_path('df/f12'), 'df/f22')
+        assert journal.pending() == []
+        assert journal.num_syncs == 3
+
+    # Closing again does nothing
+    journal.close()
+    assert journal.num_syncs == 4
+
+    records = [json.loads(line) for line in Path('journal.jsonl').read_text(encoding='utf-8').splitlines()]
+    assert records[:2] == [{"seq": 0, "kind": "delete", "path": abs_path('df/f11'), "target": None}, {"done": 0}]
+    assert len(records) == 6
+
+    with Journal('journal.jsonl') as journal:
+        assert len(journal.ops) == 3
+        assert journal.resume() == 0
+    assert count_files({'ki': 1, 'df': 2})
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+@symlink_files([('f11', 'df/f11sym')])
+def test_journal_dry_run_resume(duplicates_dir, log_debug):
+    with Journal('journal.jsonl') as journal:
+        fh = FileHandler(['ki'], ['df'], dry_run=True, journal=journal)
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        fh.registered_move(abs_path('df/f12'), 'ki/f22')
+        assert journal.pending() == [0, 1, 2]
+    assert count_files({'ki': 1, 'df': 3})
+
+    with Journal('journal.jsonl') as journal:
+        assert journal.resume() == 3
+        assert journal.resume() == 0
+    assert count_files({'ki': 2, 'df': 1})
+    assert os.readlink('df/f11sym') == abs_path('ki/f11')
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12', 'df/f13')
+@symlink_files([('f12', 'df/f12sym'), ('f13', 'df/f13sym')])
+def test_journal_resume_interrupted(duplicates_dir, log_debug):
+    with Journal('journal.jsonl') as journal:
+        # Done, not recorded as completed
+        journal.intend(PlannedOp(OpKind.DELETE, abs_path('df/f11')))
+        os.unlink('df/f11')
+        # Half done relink
+        journal.intend(PlannedOp(OpKind.RELINK, abs_path('df/f12sym'), '../ki/f11'))
+        os.unlink('df/f12sym')
+        # Done relink
+        journal.intend(PlannedOp(OpKind.RELINK, abs_path('df/f13sym'), 'f12'))
+        os.unlink('df/f13sym')
+        os.symlink('f12', 'df/f13sym')
+        # Not done
+        journal.intend(PlannedOp(OpKind.RENAME, abs_path('df/f12'), abs_path('df/f22')))
+
+    with open('journal.jsonl', 'a', encoding='utf-8') as jf:
+        jf.write('{"seq": 4, "ki')
+
+    with Journal('journal.jsonl') as journal:
+        assert journal.pending() == [0, 1, 2, 3]
+        assert journal.resume() == 2
+    assert "Ignoring incomplete last record" in log_debug.text
+    assert os.readlink('df/f12sym') == '../ki/f11'
+    assert count_files({'df': 4})
+    assert Path('df/f22').exists()
+
+
+@same_content_files('Hi', 'df/f11')
+def test_journal_corrupt(duplicates_dir):
+    Path('journal.jsonl').write_text('{"seq": 0, "ki\n{"done": 0}\n', encoding='utf-8')
+    with pytest.raises(json.JSONDecodeError):
+        Journal('journal.jsonl')
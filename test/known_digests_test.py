@@ -0,0 +1,224 @@
+import os
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from file_groups import known_digests as known_digests_module
+from file_groups.known_digests import KnownDigests
+from file_groups.compare_files import CompareFiles
+from file_groups.groups import FileGroups
+from file_groups.duplicates import FindDuplicates
+
+from .conftest import same_content_files, different_content_files
+
+
+def _sha256(content):
+    return hashlib.sha256(content.encode()).digest()
+
+
+def _make_older(*paths):
+    for path in paths:
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - 10**9))
+
+
+@different_content_files("Hi", 'df/f1', 'df/f2', 'df/f3', 'df/f4', 'df/f5')
+def test_known_digests_xattr(duplicates_dir):
+    digest = _sha256("Hi")
+    os.setxattr('df/f1', 'user.sha256', digest)
+    os.setxattr('df/f2', 'user.sha256', digest.hex().encode())
+    os.setxattr('df/f3', 'user.sha256', digest.hex().encode())
+    os.setxattr('df/f3', 'user.sha256.mtime_ns', str(os.stat('df/f3').st_mtime_ns).encode())
+    os.setxattr('df/f4', 'user.sha256', digest)
+    os.setxattr('df/f4', 'user.sha256.mtime_ns', b"12345")
+    os.setxattr('df/f5', 'user.sha256', b"Not a digest")
+
+    kd = KnownDigests()
+    assert kd.get('df/f1', 'sha256') is None
+    assert kd.get(Path('df/f2'), 'sha256') is None
+    assert kd.num_untrusted == 2
+    assert kd.get('df/f3', 'sha256', os.stat('df/f3')) == digest
+    assert kd.num_xattr_found == 1
+
+    kd = KnownDigests(trust_bare_xattr=True)
+    assert kd.get('df/f1', 'sha256') == digest
+    assert kd.get(Path('df/f2'), 'sha256') == digest
+    assert kd.get('df/f3', 'sha256', os.stat('df/f3')) == digest
+    assert kd.num_xattr_found == 3
+    assert kd.num_untrusted == 0
+
+    assert kd.get('df/f4', 'sha256') is None
+    assert kd.num_stale == 1
+    os.setxattr('df/f4', 'user.sha256.mtime_ns', b"garbage")
+    assert kd.get('df/f4', 'sha256') is None
+    assert kd.num_stale == 2
+
+    assert kd.get('df/f5', 'sha256') is None
+    assert kd.get('df/f1', 'md5') is None
+
+
+@different_content_files("Hi", 'df/f1')
+def test_known_digests_xattr_error(duplicates_dir):
+    with pytest.raises(FileNotFoundError):
+        KnownDigests().get('df/nosuchfile', 'sha256', os.stat('df/f1'))
+
+
+@different_content_files("Hi", 'df/f1', 'df/f2', 'df/f3', 'df/f4', 'df/f5')
+def test_known_digests_sidecar_and_manifest(duplicates_dir, log_debug):
+    Path('df/f1.sha256').write_text(_sha256("Hi1").hex() + '\n', encoding='utf-8')
+    Path('df/SHA256SUMS').write_text(
+        f"{_sha256('Hi2').hex()}  f2\n"
+        f"{_sha256('Hi3').hex()} *f3\n"
+        "Not a digest  f4\n", encoding='utf-8')
+    Path('df/other.md5').write_text(f"{hashlib.md5(b'Hi4').hexdigest()}  f4\n", encoding='utf-8')
+    os.mkdir('df/dir.sha256')
+
+    assert KnownDigests().lookup('df/f4') is None
+    assert "considered duplicates" not in log_debug.text
+
+    kd = KnownDigests(hash_names=('sha256', 'md5'))
+    assert "Files with equal md5 digests are considered duplicates without comparing the content" in log_debug.text
+    assert kd.get('df/f1', 'sha256') == _sha256("Hi1")
+    assert kd.get('df/f2', 'sha256') == _sha256("Hi2")
+    assert kd.get('df/f3', 'sha256') == _sha256("Hi3")
+    assert kd.get('df/f4', 'sha256') is None
+    assert kd.get('df/f4', 'md5') == hashlib.md5(b'Hi4').digest()
+    assert kd.get('df/f5', 'sha256') is None
+    assert kd.get('df/f1', 'sha512') is None
+    assert kd.num_sidecar_found == 4
+
+    assert kd.lookup('df/f4') == ('md5', hashlib.md5(b'Hi4').digest())
+    assert kd.lookup('df/f5') is None
+
+
+@different_content_files("Hi", 'df/f1', 'df/f2')
+def test_known_digests_stale_sidecar(duplicates_dir):
+    Path('df/f1.sha256').write_text(_sha256("Hi1").hex(), encoding='utf-8')
+    Path('df/f2.sha256').write_text(_sha256("Hi2").hex(), encoding='utf-8')
+    _make_older('df/f1.sha256')
+
+    kd = KnownDigests()
+    assert kd.get('df/f1', 'sha256') is None
+    assert kd.num_stale == 1
+    assert kd.get('df/f2', 'sha256') == _sha256("Hi2")
+
+    # Sidecars are only read once per directory
+    Path('df/f2.sha256').write_text(_sha256("Hi").hex(), encoding='utf-8')
+    assert kd.get('df/f2', 'sha256') == _sha256("Hi2")
+
+
+@different_content_files("Hi", 'df/f1')
+def test_known_digests_unreadable_sidecar(duplicates_dir, monkeypatch):
+    Path('df/f1.sha256').write_text(_sha256("Hi1").hex(), encoding='utf-8')
+
+    def _open(*args):
+        raise PermissionError(*args)
+
+    monkeypatch.setattr(known_digests_module, 'open', _open, raising=False)
+    kd = KnownDigests()
+    assert kd.get('df/f1', 'sha256') is None
+    assert kd._dir_sidecars('nosuchdir') == {'sha256': {}}
+
+
+@different_content_files("Hi", 'df/f1', 'df/f2')
+@same_content_files("Hi", 'df/f3')
+def test_known_digests_compare(duplicates_dir):
+    Path('df/f1.md5').write_text(hashlib.md5(b"Hi1").hexdigest(), encoding='utf-8')
+    Path('df/f2.md5').write_text(hashlib.md5(b"Hi2").hexdigest(), encoding='utf-8')
+    Path('df/f3.md5').write_text(hashlib.md5(b"Hi1").hexdigest(), encoding='utf-8')
+    Path('df/f1.sha256').write_text(_sha256("Hi1").hex(), encoding='utf-8')
+
+    kd = KnownDigests(hash_names=['sha256', 'md5'])
+    assert kd.compare('df/f1', 'df/f2') is False
+    assert kd.compare('df/f1', 'df/f3') is True
+    assert kd.compare('df/f1', 'df/f3', os.stat('df/f1'), os.stat('df/f3')) is True
+
+    kd = KnownDigests(hash_names=['sha256'])
+    assert kd.compare('df/f1', 'df/f3') is None
+    assert kd.compare('df/f3', 'df/f1') is None
+
+
+@different_content_files("Hi", 'df/f1', 'df/f2')
+def test_known_digests_store(duplicates_dir):
+    st = os.stat('df/f1')
+    digest = _sha256("Hi1")
+
+    kd = KnownDigests()
+    kd.store('df/f1', 'sha256', digest, st)
+    assert kd.num_xattr_written == 0
+
+    kd = KnownDigests(write_xattr=True)
+    kd.store('df/f1', 'sha256', digest, st)
+    assert kd.num_xattr_written == 1
+    assert os.getxattr('df/f1', 'user.sha256') == digest.hex().encode()
+    assert kd.get('df/f1', 'sha256') == digest
+
+    # Modified while hashing
+    st = os.stat('df/f2')
+    Path('df/f2').write_text("Changed", encoding='utf-8')
+    _make_older('df/f2')
+    kd.store('df/f2', 'sha256', digest, st)
+    assert kd.num_xattr_written == 1
+
+    # Errors are ignored
+    kd.store('df/nosuchfile', 'sha256', digest, st)
+    assert kd.num_xattr_written == 1
+
+    # Stale after modification
+    Path('df/f1').write_text("Hi", encoding='utf-8')
+    _make_older('df/f1')
+    assert kd.get('df/f1', 'sha256') is None
+
+
+@different_content_files("Hi", 'df/f1', 'df/f2', 'df/f3')
+def test_compare_files_known_digests(duplicates_dir):
+    # The digests are deliberately wrong, to show that the content is not read
+    Path('df/f1.sha256').write_text(_sha256("A").hex(), encoding='utf-8')
+    Path('df/f2.sha256').write_text(_sha256("A").hex(), encoding='utf-8')
+    Path('df/f3.sha256').write_text(_sha256("B").hex(), encoding='utf-8')
+
+    fcmp = CompareFiles(known_digests=KnownDigests())
+    assert fcmp.compare(Path('df/f1'), Path('df/f2'))
+    assert not fcmp.compare(Path('df/f1'), Path('df/f3'))
+    assert not fcmp.compare(Path('df/f1'), Path('df/f1.sha256'))
+    assert fcmp.cache_misses == 0
+
+    assert fcmp.compare_one_to_many(Path('df/f1'), [Path('df/f2'), Path('df/f3')]) == [Path('df/f2')]
+    assert fcmp.cache_misses == 0
+
+    fcmp = CompareFiles(known_digests=KnownDigests(hash_names=['md5']))
+    assert not fcmp.compare(Path('df/f1'), Path('df/f2'))
+    assert fcmp.compare_one_to_many(Path('df/f1'), [Path('df/f2')]) == []
+
+
+@same_content_files("Hi", 'ki/f11', 'df/f11', 'df/f12')
+@different_content_files("Hello", 'df/f21', 'df/f22')
+def test_find_duplicates_known_digests(duplicates_dir):
+    Path('ki/SHA256SUMS').write_text(f"{_sha256('Hi').hex()}  f11\n", encoding='utf-8')
+    Path('df/SHA256SUMS').write_text(f"{_sha256('Hi').hex()}  f11\n{_sha256('Hi').hex()}  f12\n", encoding='utf-8')
+    # Same head and tail
+    Path('df/f21').write_text("Hello A!", encoding='utf-8')
+    Path('df/f22').write_text("Hello B!", encoding='utf-8')
+
+    finder = FindDuplicates(FileGroups(['ki'], ['df']), known_digests=KnownDigests(write_xattr=True))
+    dups = list(finder.find())
+    assert len(dups) == 1
+    assert len(dups[0].must_protect) == 1
+    assert len(dups[0].may_work_on) == 2
+    assert finder.num_known_digests == 3
+    assert finder.num_sample_hashed == 2
+    assert finder.num_full_hashed == 0
+
+    finder = FindDuplicates(FileGroups(['ki'], ['df']), known_digests=KnownDigests(write_xattr=True), sample_size=1)
+    assert len(list(finder.find())) == 1
+    assert finder.num_full_hashed == 2
+    assert finder.known_digests.num_xattr_written == 2
+    assert os.getxattr('df/f21', 'user.sha256') == _sha256("Hello A!").hex().encode()
+
+    # Now all digests are known
+    finder = FindDuplicates(FileGroups(['ki'], ['df']), known_digests=KnownDigests(), sample_size=1)
+    assert len(list(finder.find())) == 1
+    assert finder.num_known_digests == 5
+    assert finder.num_sample_hashed == 0
+    assert finder.num_full_hashed == 0
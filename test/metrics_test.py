@@ -0,0 +1,117 @@
+import os
+import errno
+from pathlib import Path
+
+import pytest
+
+from file_groups.metrics import MetricsExporter, Histogram
+from file_groups.groups import FileGroups
+from file_groups.handler import FileHandler
+from file_groups.handler_compare import FileHandlerCompare
+from file_groups.compare_files import CompareFiles
+from file_groups.executor import ConcurrentExecutor
+
+from .conftest import same_content_files, abs_path
+
+
+def _values(text):
+    """Return metric line name -> value, without comments."""
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+
+def test_histogram():
+    hist = Histogram([0.1, 1.0])
+    for value in (0.05, 0.1, 0.5, 2.0):
+        hist.observe(value)
+    assert hist.lines('x_seconds') == [
+        '# TYPE x_seconds histogram',
+        'x_seconds_bucket{le="0.1"} 2',
+        'x_seconds_bucket{le="1.0"} 3',
+        'x_seconds_bucket{le="+Inf"} 4',
+        'x_seconds_sum 2.65',
+        'x_seconds_count 4',
+    ]
+
+
+@same_content_files('Hi', 'ki/f11', 'ki/d/f12', 'df/f11', 'df/f12')
+def test_metrics_handler(duplicates_dir, log_debug):
+    with MetricsExporter('metrics.prom', interval=None) as exporter:
+        fh = FileHandlerCompare(['ki'], ['df'], CompareFiles(), dry_run=False, metrics=exporter)
+        exporter.add(fh)
+        assert fh.compare(abs_path('df/f11'), abs_path('ki/f11'))
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        fh.registered_rename(abs_path('df/f12'), 'df/f22')
+        assert not os.path.exists('metrics.prom')
+
+    assert exporter.num_writes == 1
+    text = Path('metrics.prom').read_text(encoding='utf-8')
+    assert text.endswith('\n# EOF\n')
+    assert '# TYPE file_groups_deleted gauge\n' in text
+    assert '# TYPE file_groups_operation_seconds histogram\n' in text
+    assert os.stat('metrics.prom').st_mode & 0o777 == 0o644
+
+    values = _values(text)
+    # Updated by the delete
+    assert values['file_groups_may_work_on_files'] == '1'
+    assert values['file_groups_must_protect_files'] == '2'
+    assert values['file_groups_protect_directories'] == '2'
+    assert values['file_groups_dry_run'] == '0'
+    assert values['file_groups_deleted'] == '1'
+    assert values['file_groups_renamed'] == '1'
+    assert values['file_groups_scan_seconds_count'] == '2'
+    assert values['file_groups_compare_seconds_count'] == '1'
+    assert values['file_groups_operation_seconds_count'] == '2'
+    assert values['file_groups_operation_seconds_bucket{le="+Inf"}'] == '2'
+    assert float(values['file_groups_export_timestamp_seconds']) > 0
+
+    # The stats log the same counts
+    fh.stats()
+    assert "collected may_work_on_files: 1" in log_debug.text
+    assert fh.stats_counts()['deleted'] == fh.num_deleted == 1
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+def test_metrics_executor_dry_run(duplicates_dir):
+    exporter = MetricsExporter('metrics.prom', prefix='fg')
+    with ConcurrentExecutor() as executor:
+        fh = FileHandler(['ki'], ['df'], dry_run=True, executor=executor, metrics=exporter)
+        exporter.add(fh)
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        assert exporter.histograms['operation'].count == 0
+
+        fh.dry_run = False
+        fh.reset()
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        executor.join()
+
+    values = _values(exporter.text())
+    assert values['fg_deleted'] == '1'
+    assert values['fg_operation_seconds_count'] == '1'
+
+
+@same_content_files('Hi', 'ki/f11')
+def test_metrics_periodic(duplicates_dir, monkeypatch, log_debug):
+    fg = FileGroups(['ki'], [])
+    with MetricsExporter('metrics.prom', interval=0.01) as exporter:
+        exporter.add(fg)
+        while exporter.num_writes < 2:
+            exporter._stop.wait(0.01)  # pylint: disable=protected-access
+
+        def replace(*args):
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+        real_replace = os.replace
+        monkeypatch.setattr(os, 'replace', replace)
+        num_writes = exporter.num_writes
+        while "Failed to write metrics" not in log_debug.text:
+            exporter._stop.wait(0.01)  # pylint: disable=protected-access
+
+        # The final write fails
+        with pytest.raises(OSError):
+            exporter.__exit__(None, None, None)
+        monkeypatch.setattr(os, 'replace', real_replace)
+
+    assert exporter.num_writes >= num_writes + 1
+    assert _values(Path('metrics.prom').read_text(encoding='utf-8'))['file_groups_must_protect_files'] == '1'
+    # No temporary files left
+    assert sorted(os.listdir('.')) == ['ki', 'metrics.prom']
@@ -0,0 +1,130 @@
+import os
+import errno
+import logging
+from pathlib import Path
+
+import pytest
+
+from file_groups.move_engine import MoveEngine
+from file_groups.io_policy import IoPolicy
+from file_groups.handler import FileHandler
+
+from .conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@pytest.fixture()
+def cross_fs(monkeypatch):
+    """Make renames, except of the temporary copies, fail as if across file systems."""
+    real_rename = os.rename
+
+    def rename(src, dst):
+        if not os.fspath(src).endswith('.part'):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV), src)
+        real_rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', rename)
+
+
+@same_content_files('Hi', 'df/f11', 'df/f12')
+def test_move_engine_rename(duplicates_dir, caplog):
+    os.mkdir('df/d')
+    engine = MoveEngine()
+    engine.move(abs_path('df/f11'), abs_path('df/f21'))
+    engine.move(abs_path('df/f12'), abs_path('df/d'))
+    assert engine.num_renamed == 2
+    assert engine.num_copied == 0
+    assert engine.throughput() == 0.0
+    assert count_files({'df': 2, 'df/d': 1})
+
+    with pytest.raises(FileNotFoundError):
+        engine.move(abs_path('df/f11'), abs_path('df/f31'))
+
+    caplog.set_level(logging.WARNING)
+    engine.stats()
+    assert "moved by rename" not in caplog.text
+
+
+@same_content_files('Hi', 'df/f11', 'df/d/f12')
+@symlink_files([('f11', 'df/f11sym')])
+def test_move_engine_copy(duplicates_dir, cross_fs, log_debug):
+    os.chmod('df/f11', 0o640)
+    os.utime('df/f11', ns=(1_000_000_000, 2_000_000_000))
+    progress = []
+    engine = MoveEngine(verify=True, chunk_size=1, io_policy=IoPolicy(), progress=lambda *args: progress.append(args))
+
+    engine.move(abs_path('df/f11'), abs_path('df/f21'))
+    st = os.stat('df/f21')
+    assert st.st_mode & 0o777 == 0o640
+    assert st.st_mtime_ns == 2_000_000_000
+    assert Path('df/f21').read_text(encoding='utf-8') == 'Hi'
+    assert progress == [(abs_path('df/f11'), 1, 2), (abs_path('df/f11'), 2, 2)]
+
+    engine.move(abs_path('df/f11sym'), abs_path('df/f21sym'))
+    assert os.readlink('df/f21sym') == 'f11'
+    engine.move(abs_path('df/d'), abs_path('df/e'))
+
+    assert engine.num_copied == 1
+    assert engine.num_bytes_copied == 2
+    assert engine.throughput() > 0
+    assert count_files({'df': 3, 'df/e': 1})
+
+    engine.stats()
+    assert "moved by copy: 1" in log_debug.text
+
+
+@same_content_files('Hi', 'df/f11', 'df/f12')
+def test_move_engine_sendfile(duplicates_dir, cross_fs, monkeypatch, log_debug):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(os, 'copy_file_range', unsupported)
+    engine = MoveEngine()
+    engine.move(abs_path('df/f11'), abs_path('df/f21'))
+    assert Path('df/f21').read_text(encoding='utf-8') == 'Hi'
+    assert "using sendfile" in log_debug.text
+
+    def failing(*args):
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+    monkeypatch.setattr(os, 'copy_file_range', failing)
+    with pytest.raises(OSError, match="Input/output error"):
+        engine.move(abs_path('df/f12'), abs_path('df/f22'))
+    # Temporary copy deleted, source kept
+    assert count_files({'df': 2})
+
+
+@same_content_files('Hi', 'df/f11')
+def test_move_engine_verify_failed(duplicates_dir, cross_fs):
+    def append(src, num_copied, size):
+        with open(src, 'a', encoding='utf-8') as ff:
+            ff.write('!')
+
+    with pytest.raises(OSError, match="size 2 of copy differs from size 3"):
+        MoveEngine(verify=True, progress=append).move(abs_path('df/f11'), abs_path('df/f21'))
+
+    def overwrite(src, num_copied, size):
+        Path(src).write_text('Ho!', encoding='utf-8')
+
+    with pytest.raises(OSError, match="sha256 digest of copy differs"):
+        MoveEngine(verify=True, progress=overwrite).move(abs_path('df/f11'), abs_path('df/f21'))
+
+    def truncate(src, num_copied, size):
+        os.truncate(src, 0)
+
+    with pytest.raises(OSError, match="size 1 of copy differs from size 0"):
+        MoveEngine(verify=True, chunk_size=1, progress=truncate).move(abs_path('df/f11'), abs_path('df/f21'))
+
+    assert count_files({'df': 1})
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11')
+@symlink_files([('f11', 'df/f11sym')])
+def test_move_engine_handler(duplicates_dir, log_debug):
+    engine = MoveEngine()
+    fh = FileHandler(['ki'], ['df'], dry_run=False, move_engine=engine)
+    fh.registered_move(abs_path('df/f11'), 'ki/f21')
+    assert engine.num_renamed == 1
+    assert os.readlink('df/f11sym') == abs_path('ki/f21')
+
+    fh.stats()
+    assert "moved by rename: 1" in log_debug.text
@@ -0,0 +1 @@
+Hi
\ No newline at end of file
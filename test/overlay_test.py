@@ -0,0 +1,103 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from file_groups.handler import FileHandler
+from file_groups.dir_fds import DirFds
+
+from .conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12', 'df/f13', 'df/f14', 'outside/o1')
+@symlink_files([('f11', 'df/f11sym'), ('cyc2', 'df/cyc1'), ('cyc1', 'df/cyc2'), ('../outside/o1', 'df/osym'), ('../df/f14', 'ki/f14sym'), ('o1', 'outside/osym')])
+def test_overlay(duplicates_dir, log_debug):
+    with DirFds() as dir_fds:
+        fh = FileHandler(['ki'], ['df'], dir_fds=dir_fds, dry_run=True)
+
+        for dry in (True, False):
+            fh.dry_run = dry
+            fh.reset()
+            overlay = fh.overlay
+
+            fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+            assert not overlay.exists('df/f11')
+            assert overlay.real_path('df/f11') is None
+            with pytest.raises(FileNotFoundError):
+                overlay.readlink('df/f11')
+            with pytest.raises(FileNotFoundError):
+                overlay.stat('df/f11')
+            assert overlay.exists('df/f11sym')
+            assert overlay.readlink('df/f11sym') == abs_path('ki/f11')
+            assert overlay.stat('df/f11sym').st_size == 2
+
+            # Broken symlink in protect dir
+            fh.registered_delete(abs_path('df/f14'), None)
+            assert not overlay.exists('ki/f14sym')
+            assert overlay.exists('ki/f14sym', follow_symlinks=False)
+            assert overlay.readlink('ki/f14sym') == '../df/f14'
+
+            fh.registered_rename(abs_path('df/f12'), 'df/f22')
+            assert not overlay.exists('df/f12')
+            assert overlay.exists(Path('df/f22'))
+            assert overlay.real_path('df/f22') == abs_path('df/f12' if dry else 'df/f22')
+            assert overlay.stat('df/f22').st_size == 2
+
+            # Moved out of the collected dirs
+            fh.registered_move(abs_path('df/f13'), 'outside/f13')
+            assert overlay.exists('outside/f13')
+            assert overlay.stat('outside/f13').st_size == 2
+
+            # Not collected
+            assert overlay.exists('outside/o1')
+            assert overlay.exists('df/osym')
+            assert overlay.readlink('df/osym') == '../outside/o1'
+            assert overlay.stat('df/osym', follow_symlinks=False).st_size == len('../outside/o1')
+            assert not overlay.exists('outside/nosuchfile', follow_symlinks=False)
+            assert overlay.readlink('outside/osym') == 'o1'
+
+            # Cycle
+            assert not overlay.exists('df/cyc1')
+            assert overlay.exists('df/cyc1', follow_symlinks=False)
+
+            assert count_files({'df': 8, 'outside': 2} if dry else {'df': 5, 'outside': 3})
+
+    assert FileHandler(['ki'], ['df'], dry_run=True).overlay.readlink('outside/osym') == 'o1'
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+@symlink_files([('f11', 'df/f11sym'), ('../df/f12', 'ki/f12sym'), ('f12', 'df/f12sym')])
+def test_overlay_readlink_collected(duplicates_dir, monkeypatch):
+    with DirFds() as dir_fds:
+        fh = FileHandler(['ki'], ['df'], dir_fds=dir_fds, dry_run=True)
+
+    os_readlink = os.readlink
+
+    def readlink(path, *args, **kwargs):
+        raise AssertionError(f"Unexpected readlink of '{path}'")
+
+    monkeypatch.setattr(os, 'readlink', readlink)
+    monkeypatch.setattr(dir_fds, 'readlink', readlink)
+
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+        overlay = fh.overlay
+        assert overlay.readlink('ki/f12sym') == '../df/f12'
+
+        # Moved symlinks keep their value, relinked symlinks get the new value
+        fh.registered_rename(abs_path('df/f12sym'), 'df/f22sym')
+        assert overlay.readlink('df/f22sym') == 'f12'
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        assert overlay.readlink('df/f11sym') == abs_path('ki/f11')
+
+        # Values from the groups, after the operations, also in a new overlay
+        fh.registered_rename(abs_path('df/f12'), 'df/f22')
+        assert overlay.readlink('df/f22sym') == 'f22'
+        assert overlay.readlink('ki/f12sym') == abs_path('df/f22')
+        assert os_readlink('df/f12sym' if dry else 'df/f22sym') == ('f12' if dry else 'f22')
+
+    fh.dry_run = True
+    fh.reset()
+    assert fh.overlay.readlink('df/f22sym') == 'f22'
+    assert fh.overlay.readlink('df/f11sym') == abs_path('ki/f11')
@@ -0,0 +1,51 @@
+import os
+import filecmp
+from timeit import timeit
+
+from file_groups.compare_files import CompareFiles, BufferedCompareFiles, SparseCompareFiles
+
+
+_SIZE = 512 * 1024 * 1024
+
+
+def _compare(fcmp, fn1, fn2):
+    assert fcmp.compare(fn1, fn2)
+
+
+def _filecmp_compare(fn1, fn2):
+    # The implementation before CompareFiles read the content itself
+    filecmp.clear_cache()
+    assert filecmp.cmp(fn1, fn2, shallow=False)
+
+
+def _throughput(compare, fn1, fn2):
+    exec_time = min(timeit(lambda: compare(fn1, fn2), number=1) for _ in range(3))
+    return _SIZE / exec_time / 1024 / 1024
+
+
+def test_compare_throughput(tmp_path):
+    fn1 = tmp_path/'f1'
+    fn2 = tmp_path/'f2'
+    data = os.urandom(_SIZE)
+    fn1.write_bytes(data)
+    fn2.write_bytes(data)
+    del data
+
+    print(f"filecmp: {_throughput(_filecmp_compare, fn1, fn2):.0f} MiB/s")
+
+    # Disable result cache to measure the content comparison
+    for fcmp in CompareFiles(cache_size=0), BufferedCompareFiles(cache_size=0), *(BufferedCompareFiles(cache_size=0, block_size=bs * 1024) for bs in (64, 1024, 4096)):
+        print(f"{type(fcmp).__name__} {getattr(fcmp, 'block_size', '')}: {_throughput(fcmp.compare, fn1, fn2):.0f} MiB/s")
+
+
+def test_sparse_compare(tmp_path):
+    fns = []
+    for fn in tmp_path/'s1', tmp_path/'s2':
+        with open(fn, 'wb') as ff:
+            ff.truncate(8 * _SIZE)
+            ff.seek(_SIZE)
+            ff.write(b'x' * 1024 * 1024)
+        fns.append(fn)
+
+    for fcmp in BufferedCompareFiles(cache_size=0), SparseCompareFiles(cache_size=0):
+        print(f"{type(fcmp).__name__}: {timeit(lambda: _compare(fcmp, *fns), number=1):.3f}s")
@@ -0,0 +1,106 @@
+import logging
+from pathlib import Path
+
+import pytest
+
+from file_groups import rate_limiter
+from file_groups.rate_limiter import RateLimiter
+from file_groups.groups import FileGroups
+from file_groups.handler import FileHandler
+from file_groups.io_policy import IoPolicy
+from file_groups.compare_files import CompareFiles
+
+from .conftest import same_content_files, abs_path
+
+
+@pytest.fixture(name="clock")
+def _fixture_clock(monkeypatch):
+    """Fake time, where sleeping advances the time. Returns list of [now, sleeps]."""
+    clock = [100.0, []]
+
+    def sleep(secs):
+        clock[1].append(secs)
+        clock[0] += secs
+
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(rate_limiter.time, 'sleep', sleep)
+    return clock
+
+
+def test_rate_limiter_ops_and_bytes(clock, log_debug):
+    limiter = RateLimiter(ops_per_sec=10, bytes_per_sec=1000)
+    # Burst of one second
+    for _ in range(10):
+        limiter.acquire()
+    assert not clock[1]
+    limiter.acquire()
+    assert clock[1] == [pytest.approx(0.1)]
+
+    # The bytes rate determines the wait
+    limiter.acquire(num_bytes=1500)
+    assert clock[1][-1] == pytest.approx(0.5)
+    assert limiter.num_waits == 2
+    assert limiter.wait_seconds == pytest.approx(0.6)
+
+    limiter.stats()
+    assert "throttled: 2 times, 0.6 seconds" in log_debug.text
+
+    RateLimiter().acquire(num_ops=10**9, num_bytes=10**12)
+    assert limiter.num_waits == 2
+
+
+def test_rate_limiter_configure(clock, caplog):
+    limiter = RateLimiter(ops_per_sec=10, burst_seconds=0)
+    limiter.acquire(num_ops=5)
+    assert clock[1] == [pytest.approx(0.5)]
+
+    # Debt of 1 second at 10 ops/s is 0.5 seconds at 20 ops/s
+    clock[0] -= 1.0
+    limiter.configure(ops_per_sec=20, bytes_per_sec=100)
+    limiter.acquire(num_ops=10, num_bytes=10)
+    assert clock[1][-1] == pytest.approx(1.0)
+
+    # Unlimited
+    limiter.configure(ops_per_sec=None, bytes_per_sec=None)
+    limiter.acquire(num_ops=1000)
+    assert len(clock[1]) == 2
+
+    # Limited again, the debt is gone
+    limiter.configure(ops_per_sec=10, bytes_per_sec=None)
+    limiter.acquire()
+    assert clock[1][-1] == pytest.approx(0.1)
+
+    caplog.set_level(logging.WARNING)
+    limiter.stats()
+    assert "throttled" not in caplog.text
+
+    with pytest.raises(AssertionError):
+        IoPolicy(max_bytes_per_sec=10, rate_limiter=limiter)
+
+
+@same_content_files("Hi", 'ki/d/f11', 'df/f11', 'df/f12')
+def test_rate_limiter_collect_compare_handler(duplicates_dir, clock, log_debug):
+    limiter = RateLimiter(ops_per_sec=1, bytes_per_sec=1, burst_seconds=0)
+
+    fg = FileGroups(['ki'], ['df'], rate_limiter=limiter)
+    # ki, ki/d, df
+    assert clock[1] == [1.0, 1.0, 1.0]
+    fg.stats()
+    assert "throttled: 3 times" in log_debug.text
+
+    assert CompareFiles(io_policy=IoPolicy(rate_limiter=limiter)).compare(Path('ki/d/f11'), Path('df/f11'))
+    # Both files are read in one chunk
+    assert clock[1][3:] == [4.0]
+
+    limiter.configure(ops_per_sec=10, bytes_per_sec=None)
+    fh = FileHandler(['ki'], ['df'], rate_limiter=limiter, dry_run=True)
+    assert clock[1][4:] == [pytest.approx(0.1)] * 3
+    del clock[1][:]
+    fh.registered_delete(abs_path('df/f11'), 'ki/d/f11')
+    assert not clock[1]
+
+    fh.dry_run = False
+    fh.reset()
+    fh.registered_delete(abs_path('df/f11'), 'ki/d/f11')
+    fh.registered_rename(abs_path('df/f12'), 'df/f22')
+    assert clock[1] == [pytest.approx(0.1)] * 2
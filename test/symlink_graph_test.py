@@ -0,0 +1,65 @@
+import os
+
+from file_groups.groups import FileGroups
+from file_groups.symlink_graph import SymlinkGraph
+from file_groups.handler import FileHandler
+
+from .conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11')
+@symlink_files([('f11', 'ki/f11sym'), ('f11', 'df/f11sym'), ('f11sym', 'df/f11sym2'), ('f11sym2', 'df/f11sym3'), ('../df/f11sym', 'ki/f11sym4')])
+def test_symlink_graph(duplicates_dir):
+    graph = SymlinkGraph(FileGroups(['ki'], ['df']))
+    assert graph.points_to[abs_path('df/f11sym2')] == abs_path('df/f11sym')
+    assert graph.pointed_to_by[abs_path('df/f11sym')] == [abs_path('ki/f11sym4'), abs_path('df/f11sym2')]
+    assert graph.final_target(abs_path('df/f11sym3')) == abs_path('df/f11')
+    assert graph.final_target(abs_path('ki/f11sym4')) == abs_path('df/f11')
+    assert not graph.cycles
+
+    assert graph.dependents(abs_path('df/f11')) == [abs_path('df/f11sym'), abs_path('ki/f11sym4'), abs_path('df/f11sym2'), abs_path('df/f11sym3')]
+    assert graph.dependents(abs_path('df/f11'), {abs_path('df/f11sym'), abs_path('df/f11sym2')}) == [abs_path('df/f11sym'), abs_path('df/f11sym2')]
+    assert graph.dependents(abs_path('df/f11sym3')) == []
+
+    graph.relink(abs_path('df/f11sym'), abs_path('ki/f11'))
+    assert graph.final_target(abs_path('df/f11sym3')) == abs_path('ki/f11')
+    assert graph.dependents(abs_path('df/f11')) == []
+
+    graph.remove(abs_path('df/f11sym2'))
+    assert graph.final_target(abs_path('df/f11sym3')) == abs_path('df/f11sym2')
+    assert abs_path('df/f11sym2') not in graph.points_to
+    graph.remove(abs_path('df/f11'))
+    assert graph.final_target(abs_path('ki/f11sym4')) == abs_path('ki/f11')
+
+
+@same_content_files('Hi', 'df/f11')
+@symlink_files([('c2', 'df/c1'), ('c3', 'df/c2'), ('c1', 'df/c3'), ('c1', 'df/to_cycle'), ('f11', 'df/f11sym')], broken=True)
+def test_symlink_graph_cycles(duplicates_dir):
+    graph = SymlinkGraph(FileGroups([], ['df']))
+    assert graph.cycles == {abs_path('df/c1'), abs_path('df/c2'), abs_path('df/c3')}
+    assert graph.final_target(abs_path('df/c1')) is None
+    assert graph.final_target(abs_path('df/to_cycle')) is None
+    assert sorted(graph.dependents(abs_path('df/c1'))) == [abs_path('df/c2'), abs_path('df/c3'), abs_path('df/to_cycle')]
+
+    # Break cycle
+    graph.relink(abs_path('df/c3'), abs_path('df/f11'))
+    assert not graph.cycles
+    assert graph.final_target(abs_path('df/to_cycle')) == abs_path('df/f11')
+
+    # Make cycle
+    graph.relink(abs_path('df/c3'), abs_path('df/to_cycle'))
+    assert graph.cycles == {abs_path('df/c1'), abs_path('df/c2'), abs_path('df/c3'), abs_path('df/to_cycle')}
+    graph.remove(abs_path('df/c2'))
+    assert not graph.cycles
+    assert graph.final_target(abs_path('df/c1')) == abs_path('df/c2')
+    assert graph.final_target(abs_path('df/to_cycle')) == abs_path('df/c2')
+    assert os.path.islink('df/c2')
+
+
+@same_content_files('Hi', 'df/f11')
+@symlink_files([('c2', 'df/c1'), ('c3', 'df/c2'), ('c1', 'df/c3'), ('c1', 'df/to_cycle')], broken=True)
+def test_handler_delete_symlink_cycle(duplicates_dir, log_debug):
+    fh = FileHandler([], ['df'], dry_run=False)
+    fh.registered_delete(abs_path('df/c1'), None)
+    assert fh.num_deleted == 4
+    assert count_files({'df': 1})
@@ -0,0 +1,152 @@
+import os
+import errno
+from pathlib import Path
+
+import pytest
+
+from file_groups.groups import FileGroups
+from file_groups.handler import FileHandler
+from file_groups.trash import Trash
+from file_groups.dir_fds import DirFds
+from file_groups.executor import ConcurrentExecutor
+from file_groups.plan import OpKind
+
+from .conftest import same_content_files, symlink_files, count_files, abs_path
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/d/f12')
+@symlink_files([('f11', 'df/f11sym')])
+def test_trash_handler(duplicates_dir, log_debug):
+    trash = Trash(['.'], run='run1')
+    fh = FileHandler(['ki'], ['df'], dry_run=True, trash=trash)
+
+    for dry in (True, False):
+        fh.dry_run = dry
+        fh.reset()
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        fh.registered_delete(abs_path('df/d/f12'), None)
+        assert fh.num_deleted == 2
+        assert [op.kind for op in fh.plan] == [OpKind.TRASH, OpKind.RELINK, OpKind.TRASH]
+        assert fh.plan.ops[0].target == abs_path('.file_groups_trash/run1/df/f11')
+        assert fh.plan.ops[2].target == abs_path('.file_groups_trash/run1/df/d/f12')
+
+    assert "deleting: " + abs_path('df/f11') + " (to trash" in log_debug.text
+    assert count_files({'ki': 1, 'df': 1, '.file_groups_trash/run1': 2})
+    assert os.readlink('df/f11sym') == abs_path('ki/f11')
+
+    res = trash.restore()
+    assert res.ok
+    assert res.num_done == 2
+    assert res.num_dirs == 1
+    assert Path('df/f11').read_text(encoding='utf-8') == 'Hi'
+    assert Path('df/d/f12').read_text(encoding='utf-8') == 'Hi'
+    assert not os.path.exists('.file_groups_trash')
+
+
+@same_content_files('Hi', 'ki/f11', 'df/f11', 'df/f12')
+def test_trash_executor_dir_fds(duplicates_dir):
+    with DirFds() as dir_fds, ConcurrentExecutor(dir_fds=dir_fds) as executor:
+        fh = FileHandler(['ki'], ['df'], dry_run=False, dir_fds=dir_fds, executor=executor, trash=Trash(['.'], run='run1'))
+        fh.registered_delete(abs_path('df/f11'), 'ki/f11')
+        fh.registered_delete(abs_path('df/f12'), 'ki/f11')
+        executor.join()
+        assert not executor.failed
+        assert fh.num_deleted == 2
+
+    assert count_files({'ki': 1, 'df': 0, '.file_groups_trash/run1/df': 2})
+
+
+@same_content_files('Hi', 'df/f11', 'df/f12', 'df/x.~1~')
+def test_trash_collisions_restore_purge(duplicates_dir, log_debug):
+    trash = Trash(['.', 'df'], run='run1')
+    trashed = trash.trash_path(abs_path('df/f11'))
+    assert trashed == abs_path('df/.file_groups_trash/run1/f11')
+    assert trash.trash_path(abs_path('df/f11')) == abs_path('df/.file_groups_trash/run1.~1~/f11')
+
+    os.makedirs(os.path.dirname(trashed))
+    os.rename('df/f11', trashed)
+    trash.reset()
+    assert trash.trash_path(abs_path('df/f11')) == abs_path('df/.file_groups_trash/run1.~1~/f11')
+
+    # A file with the same name is trashed again
+    Path('df/f11').write_text('Ho', encoding='utf-8')
+    os.makedirs('df/.file_groups_trash/run1.~1~')
+    os.rename('df/f11', 'df/.file_groups_trash/run1.~1~/f11')
+
+    # A file named like a numbered backup keeps its name
+    trashed_x = trash.trash_path(abs_path('df/x.~1~'))
+    assert trashed_x == abs_path('df/.file_groups_trash/run1/x.~1~')
+    os.rename('df/x.~1~', trashed_x)
+
+    # The trash directory is not collected
+    fg = FileGroups([], ['df'])
+    assert list(fg.may_work_on.files) == [abs_path('df/f12')]
+
+    res = trash.restore()
+    assert not res.ok
+    assert res.num_done == 2
+    assert res.num_dirs == 2
+    assert list(res.failed) == [abs_path('df/.file_groups_trash/run1.~1~/f11')]
+    assert "Not restoring" in log_debug.text
+    assert Path('df/f11').read_text(encoding='utf-8') == 'Hi'
+    assert Path('df/x.~1~').read_text(encoding='utf-8') == 'Hi'
+
+    assert Trash(['df']).restore(run='run2').num_dirs == 0
+    res = Trash(['df']).purge(run='run1')
+    assert res.ok
+    assert res.num_done == 1
+    assert not os.path.exists('df/.file_groups_trash')
+    assert count_files({'df': 3})
+
+    assert Trash(['df']).purge(run='run1').num_dirs == 0
+
+
+@same_content_files('Hi', 'df/f11')
+@symlink_files([('f11', 'df/f11sym')])
+def test_trash_purge_failed(duplicates_dir, monkeypatch):
+    trash = Trash(['.'], run='run1')
+    fh = FileHandler([], ['df'], dry_run=False, trash=trash)
+    fh.registered_delete(abs_path('df/f11sym'), None)
+    assert os.readlink('.file_groups_trash/run1/df/f11sym') == 'f11'
+
+    def unlink(path):
+        raise OSError(errno.EACCES, os.strerror(errno.EACCES), path)
+
+    monkeypatch.setattr(os, 'unlink', unlink)
+    res = trash.purge()
+    assert not res.ok
+    assert isinstance(res.failed[abs_path('.file_groups_trash/run1/df/f11sym')], PermissionError)
+    assert os.path.islink('.file_groups_trash/run1/df/f11sym')
+
+
+def test_trash_mount_point(tmp_path, monkeypatch):
+    fn = tmp_path/'f11'
+    fn.write_text('Hi', encoding='utf-8')
+    (tmp_path/'d').mkdir()
+
+    ismount_paths = []
+    ismount = os.path.ismount
+
+    def counting_ismount(path):
+        ismount_paths.append(path)
+        return ismount(path)
+
+    monkeypatch.setattr(os.path, 'ismount', counting_ismount)
+    trash = Trash()
+    trashed = trash.trash_path(str(fn))
+    top_dir = trashed.split('/.file_groups_trash/')[0] or '/'
+    assert ismount(top_dir)
+    assert trashed.endswith(os.path.relpath(fn, top_dir))
+    assert trash.top_dirs == {top_dir: os.stat(fn).st_dev}
+
+    # The top directory is looked up once per directory
+    num_ismount = len(ismount_paths)
+    assert num_ismount > 0
+    assert trash.trash_path(str(tmp_path/'f12')) == os.path.join(os.path.dirname(trashed), 'f12')
+    assert trash.trash_path(str(tmp_path/'d'/'f13')) == os.path.join(os.path.dirname(trashed), 'd', 'f13')
+    assert ismount_paths[num_ismount:] == [str(tmp_path/'d')]
+    assert trash.trash_path(str(tmp_path/'d'/'f14')).startswith(os.path.dirname(trashed))
+    assert len(ismount_paths) == num_ismount + 1
+
+    with pytest.raises(AssertionError):
+        trash.trash_path('f11')